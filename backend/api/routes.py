@@ -1,109 +1,118 @@
 import os
+import json
 import uuid
 from fastapi import APIRouter, UploadFile, File, HTTPException
-from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import List, Optional
 
 from models.schemas import (
     UploadResponse, 
     QueryRequest, 
+    BatchSearchRequest,
     QueryResponse,
     SearchResult,
     HealthResponse,
+    JobStatusResponse,
 )
-from services.document_processor import DocumentParser, TextChunker
-from services.embedding_service import EmbeddingService
-from services.vector_store import VectorStore
-from services.llm_service import LLMService, MockLLMService
+from services.container import container
+from services.llm_service import LLMError
+from services.metrics import profiler
 from core.config import settings
 
 router = APIRouter()
 
-embedding_service = None
-vector_store = None
-llm_service = None
-
 
 def get_services():
-    global embedding_service, vector_store, llm_service
-    
-    if embedding_service is None:
-        embedding_service = EmbeddingService()
-    
-    if vector_store is None:
-        vector_store = VectorStore(embedding_service)
-    
-    if llm_service is None:
-        llm_service = LLMService()
-    
-    return embedding_service, vector_store, llm_service
+    return container.get_services()
+
+
+ALLOWED_CONTENT_TYPES = {
+    'text/plain',
+    'application/pdf',
+    'text/markdown',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+}
 
 
 @router.post("/upload", response_model=UploadResponse)
 async def upload_document(file: UploadFile = File(...)):
     """上传并处理文档"""
-    allowed_types = {
-        'text/plain': 'text/plain',
-        'application/pdf': 'application/pdf',
-        'text/markdown': 'text/markdown',
-        'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-    }
-    
-    if file.content_type not in allowed_types:
+    if file.content_type not in ALLOWED_CONTENT_TYPES:
         raise HTTPException(status_code=400, detail=f"不支持的文件类型: {file.content_type}")
     
+    return await _save_and_submit(file)
+
+
+@router.post("/upload/batch", response_model=List[UploadResponse])
+async def upload_documents(files: List[UploadFile] = File(...)):
+    """批量上传文档，各文件在解析进程池中并行处理"""
+    unsupported = [file.filename for file in files if file.content_type not in ALLOWED_CONTENT_TYPES]
+    if unsupported:
+        raise HTTPException(status_code=400, detail=f"不支持的文件类型: {', '.join(unsupported)}")
+    
+    return [await _save_and_submit(file) for file in files]
+
+
+async def _save_and_submit(file: UploadFile) -> UploadResponse:
     document_id = str(uuid.uuid4())
     file_extension = os.path.splitext(file.filename)[1]
     local_filename = f"{document_id}{file_extension}"
     file_path = os.path.join(settings.upload_dir, local_filename)
     
     try:
-        content = await file.read()
         with open(file_path, 'wb') as f:
-            f.write(content)
-        
-        parser = DocumentParser()
-        text_content = parser.parse_file(file_path, file.content_type)
-        
-        chunker = TextChunker(chunk_size=settings.chunk_size, chunk_overlap=settings.chunk_overlap)
-        chunks_data = chunker.chunk_text(text_content, document_id)
-        
-        for chunk in chunks_data:
-            chunk['metadata'] = {
-                **chunk.get('metadata', {}),
-                'document_id': document_id,
-                'filename': file.filename,
-                'source': file.filename
-            }
+            while True:
+                piece = await file.read(settings.upload_read_size)
+                if not piece:
+                    break
+                f.write(piece)
         
-        _, vector_store, _ = get_services()
-        vector_store.add_chunks(chunks_data)
-        
-        return UploadResponse(
-            document_id=document_id,
-            filename=file.filename,
-            chunk_count=len(chunks_data),
-            message=f"文档上传成功，已处理为 {len(chunks_data)} 个文本块"
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"处理文档时出错: {str(e)}")
+        get_services()
+        job = container.job_queue.submit(file_path, file.content_type, document_id, file.filename)
     
-    finally:
+    except Exception as e:
         if os.path.exists(file_path):
             os.remove(file_path)
+        raise HTTPException(status_code=500, detail=f"处理文档时出错: {str(e)}")
+    
+    return UploadResponse(
+        document_id=document_id,
+        filename=file.filename,
+        chunk_count=0,
+        message="文档已上传，正在后台处理",
+        job_id=job.job_id,
+        status=job.stage
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str):
+    """查询入库任务进度"""
+    job = container.job_queue.get(job_id) if container.job_queue else None
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    
+    return JobStatusResponse(**job.to_dict())
 
 
 @router.post("/query", response_model=QueryResponse)
 async def query_documents(request: QueryRequest):
     """查询文档 - RAG 完整流程"""
-    from services.llm_service import MockLLMService
-    from services.vector_store import VectorStore
-    from services.embedding_service import EmbeddingService
-    
+    _, _, llm_service = get_services()
+    answer_cache = container.answer_cache
+    epoch = answer_cache.epoch
+    scope = _cache_scope(request)
+    query_embedding = None
+    sources = []
     try:
-        es = EmbeddingService()
-        vs = VectorStore(es)
-        search_results = vs.search(query=request.query, top_k=request.top_k)
+        query_embedding = await container.embedding_scheduler.embed_text(request.query)
+        cached = answer_cache.lookup(query_embedding, scope)
+        if cached is not None:
+            answer, cached_sources = cached
+            return QueryResponse(answer=answer, sources=cached_sources, query=request.query, cached=True)
+        
+        search_results = await _search(request, query_embedding)
         
         if not search_results:
             return QueryResponse(
@@ -113,31 +122,192 @@ async def query_documents(request: QueryRequest):
             )
         
         relevant_chunks = [chunk for chunk, score in search_results]
-        
+        sources = [_to_source(chunk, score) for chunk, score in search_results]
+    
     except Exception as e:
         relevant_chunks = [{"content": f"错误: {str(e)}", "metadata": {"source": "error"}}]
     
-    mock_llm = MockLLMService()
-    answer = mock_llm.generate_answer(query=request.query, context_chunks=relevant_chunks)
+    try:
+        answer = await llm_service.agenerate_answer(request.query, relevant_chunks)
+    except LLMError as e:
+        raise HTTPException(status_code=e.http_status, detail=e.to_dict())
+    if sources:
+        answer_cache.store(query_embedding, scope, answer, [source.model_dump() for source in sources], epoch)
     
     return QueryResponse(
         answer=answer,
-        sources=[],
+        sources=sources,
         query=request.query
     )
 
 
+@router.post("/query/stream")
+async def query_documents_stream(request: QueryRequest):
+    """流式问答 - 先推送检索到的来源，再逐段推送生成的回答 (Server-Sent Events)"""
+    _, _, llm_service = get_services()
+    answer_cache = container.answer_cache
+    epoch = answer_cache.epoch
+    scope = _cache_scope(request)
+    query_embedding = await container.embedding_scheduler.embed_text(request.query)
+    
+    cached = answer_cache.lookup(query_embedding, scope)
+    if cached is not None:
+        answer, cached_sources = cached
+        
+        async def cached_events():
+            yield _sse_event('sources', {'query': request.query, 'sources': cached_sources, 'cached': True})
+            yield _sse_event('token', {'text': answer})
+            yield _sse_event('done', {})
+        
+        return _sse_response(cached_events())
+    
+    search_results = await _search(request, query_embedding)
+    relevant_chunks = [chunk for chunk, score in search_results]
+    sources = [_to_source(chunk, score).model_dump() for chunk, score in search_results]
+    
+    async def events():
+        yield _sse_event('sources', {'query': request.query, 'sources': sources, 'cached': False})
+        if not relevant_chunks:
+            yield _sse_event('token', {'text': "抱歉，知识库中没有找到与您问题相关的内容。"})
+            yield _sse_event('done', {})
+            return
+        
+        parts = []
+        try:
+            async for text in llm_service.stream_answer(request.query, relevant_chunks):
+                parts.append(text)
+                yield _sse_event('token', {'text': text})
+        except Exception as e:
+            yield _sse_event('error', LLMError.from_exception(e).to_dict())
+            return
+        answer_cache.store(query_embedding, scope, ''.join(parts), sources, epoch)
+        yield _sse_event('done', {})
+    
+    return _sse_response(events())
+
+
+async def _search(request: QueryRequest, query_embedding):
+    return await _retrieve(
+        request.query, query_embedding, request.top_k,
+        filters={'document_id': request.document_id, 'filename': request.filename},
+        nprobe=request.nprobe,
+        ef_search=request.ef_search,
+        hybrid=request.hybrid,
+        rerank=request.rerank
+    )
+
+
+async def _retrieve(query: str, query_embedding, top_k: Optional[int], filters: dict,
+                    nprobe: Optional[int], ef_search: Optional[int],
+                    hybrid: Optional[bool], rerank: Optional[bool]):
+    """向量 (或混合) 检索与交叉编码器重排都在线程池中进行，不阻塞事件循环；启用重排时多取候选"""
+    _, vector_store, _ = get_services()
+    top_k = top_k or settings.similarity_top_k
+    rerank = settings.rerank_enabled if rerank is None else rerank
+    search_results = await run_in_threadpool(
+        vector_store.search_by_vector,
+        query_embedding,
+        top_k=max(top_k, settings.rerank_candidates) if rerank else top_k,
+        filters=filters,
+        nprobe=nprobe,
+        ef_search=ef_search,
+        query=query,
+        hybrid=hybrid
+    )
+    if not rerank:
+        return search_results
+    return await run_in_threadpool(container.reranker.rerank, query, search_results, top_k)
+
+
+def _cache_scope(request: QueryRequest) -> tuple:
+    """影响检索结果的请求参数，语义缓存只在参数相同的问题之间复用回答"""
+    return (request.top_k, request.document_id, request.filename,
+            request.nprobe, request.ef_search, request.hybrid, request.rerank)
+
+
+def _to_source(chunk: dict, score: float) -> SearchResult:
+    metadata = chunk.get('metadata', {})
+    return SearchResult(
+        chunk_id=chunk.get('chunk_id', ''),
+        document_id=metadata.get('document_id', ''),
+        content=chunk.get('content', ''),
+        score=score,
+        metadata=metadata
+    )
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/search")
-async def search_documents(query: str, top_k: Optional[int] = 5):
+async def search_documents(
+    query: str,
+    top_k: Optional[int] = 5,
+    document_id: Optional[str] = None,
+    filename: Optional[str] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    hybrid: Optional[bool] = None,
+    rerank: Optional[bool] = None
+):
     """简单搜索"""
-    from services.vector_store import VectorStore
-    from services.embedding_service import EmbeddingService
+    get_services()
+    query_embedding = await container.embedding_scheduler.embed_text(query)
+    search_results = await _retrieve(
+        query, query_embedding, top_k,
+        filters={'document_id': document_id, 'filename': filename},
+        nprobe=nprobe,
+        ef_search=ef_search,
+        hybrid=hybrid,
+        rerank=rerank
+    )
+    
+    results = _format_results(search_results)
+    return {"query": query, "total": len(results), "results": results}
+
+
+@router.post("/search/batch")
+async def search_documents_batch(request: BatchSearchRequest):
+    """批量搜索 - 一次编码全部查询，并用一个 N×d 矩阵检索"""
+    if len(request.queries) > settings.search_batch_max_queries:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次最多 {settings.search_batch_max_queries} 个查询"
+        )
+    
+    _, vector_store, _ = get_services()
+    texts = [item.query for item in request.queries]
+    query_embeddings = await container.embedding_scheduler.embed_texts(texts)
+    search_results = await run_in_threadpool(
+        vector_store.search_batch,
+        query_embeddings,
+        top_ks=[item.top_k for item in request.queries],
+        filters=[{'document_id': item.document_id, 'filename': item.filename} for item in request.queries],
+        nprobe=request.nprobe,
+        ef_search=request.ef_search,
+        queries=texts,
+        hybrid=request.hybrid
+    )
     
-    es = EmbeddingService()
-    vs = VectorStore(es)
-    search_results = vs.search(query=query, top_k=top_k)
+    results = []
+    for text, query_results in zip(texts, search_results):
+        formatted = _format_results(query_results)
+        results.append({"query": text, "total": len(formatted), "results": formatted})
     
-    results = [
+    return {"total": len(results), "results": results}
+
+
+def _format_results(search_results):
+    return [
         {
             "chunk_id": chunk.get('chunk_id', ''),
             "content": chunk.get('content', ''),
@@ -146,8 +316,6 @@ async def search_documents(query: str, top_k: Optional[int] = 5):
         }
         for chunk, score in search_results
     ]
-    
-    return {"query": query, "total": len(results), "results": results}
 
 
 @router.get("/documents")
@@ -155,39 +323,57 @@ async def list_documents():
     """获取所有已上传的文档列表"""
     _, vector_store, _ = get_services()
     
-    chunks = vector_store.get_all_chunks()
-    
-    documents = {}
-    for chunk in chunks:
-        doc_id = chunk.get('metadata', {}).get('document_id', 'unknown')
-        if doc_id not in documents:
-            documents[doc_id] = {
-                'document_id': doc_id,
-                'filename': chunk.get('metadata', {}).get('filename', 'Unknown'),
-                'chunk_count': 0
-            }
-        documents[doc_id]['chunk_count'] += 1
+    documents = await run_in_threadpool(vector_store.list_documents)
+    total_chunks = await run_in_threadpool(vector_store.get_chunk_count)
     
-    return {"total_documents": len(documents), "total_chunks": len(chunks), "documents": list(documents.values())}
+    return {"total_documents": len(documents), "total_chunks": total_chunks, "documents": documents}
 
 
 @router.delete("/documents/{document_id}")
 async def delete_document(document_id: str):
     """删除指定文档"""
     _, vector_store, _ = get_services()
-    vector_store.clear()
+    deleted = await run_in_threadpool(vector_store.delete_document, document_id)
+    if deleted == 0:
+        raise HTTPException(status_code=404, detail=f"文档不存在: {document_id}")
     
-    return {"message": "文档已删除", "document_id": document_id}
+    return {"message": "文档已删除", "document_id": document_id, "deleted_chunks": deleted}
 
 
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
     """健康检查"""
-    _, vector_store, _ = get_services()
+    vector_store = container.vector_store
+    index_type, document_count = None, 0
+    if vector_store:
+        # 分片存储的这两项都要经进程间调用取得
+        index_type, document_count = await run_in_threadpool(
+            lambda: (vector_store.index_type, vector_store.get_chunk_count())
+        )
     
     return HealthResponse(
-        status="healthy",
+        status="healthy" if container.ready else "starting",
         embedding_model=settings.embedding_model,
-        vector_store=settings.vector_store_type,
-        document_count=vector_store.get_chunk_count() if vector_store else 0
+        vector_store=index_type or settings.vector_store_type,
+        document_count=document_count,
+        ready=container.ready
     )
+
+
+@router.get("/profiler")
+async def profiler_status():
+    """采样分析器状态"""
+    return profiler.status()
+
+
+@router.post("/profiler/start")
+async def start_profiler():
+    """开始采样 (清空上一轮结果)"""
+    profiler.start()
+    return profiler.status()
+
+
+@router.post("/profiler/stop", response_class=PlainTextResponse)
+async def stop_profiler():
+    """停止采样并返回折叠栈，可交给 flamegraph.pl 或 speedscope 生成火焰图"""
+    return profiler.stop()
@@ -0,0 +1,494 @@
+"""离线基准测试 - 不需要 GPU 与网络，结果写成 JSON 供版本间对比
+
+    cd backend
+    python benchmark.py --sizes 1000,10000 --output benchmark-results.json
+    python benchmark.py --baseline benchmark-results.json --output new.json
+
+语料由固定种子生成，向量由确定性的 MockEmbeddingService 计算，同一台机器上多次运行结果可比。
+每种配置在独立的子进程中建索引、加载与检索，内存按进程私有内存 (RssAnon) 的增量计算。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+# 检索基准的配置：索引类型 + 混合检索 + 内存映射 + 分片进程数
+CONFIGS = {
+    'flat': {'vector_store_type': 'flat'},
+    'ivf_flat': {'vector_store_type': 'ivf_flat'},
+    'ivf_pq': {'vector_store_type': 'ivf_pq'},
+    'hnsw': {'vector_store_type': 'hnsw'},
+    'sq_fp16': {'vector_store_type': 'sq_fp16'},
+    'sq_int8': {'vector_store_type': 'sq_int8'},
+    'binary': {'vector_store_type': 'binary'},
+    'flat_hybrid': {'vector_store_type': 'flat', 'hybrid': True},
+    'flat_mmap': {'vector_store_type': 'flat', 'index_mmap': True},
+    'hnsw_mmap': {'vector_store_type': 'hnsw', 'index_mmap': True},
+    'flat_sharded': {'vector_store_type': 'flat', 'vector_store_shards': 2},
+    'ivf_flat_sharded': {'vector_store_type': 'ivf_flat', 'vector_store_shards': 2},
+}
+CHUNKS_PER_DOCUMENT = 20
+RECALL_K = 10
+BATCH_QUERIES = 64
+# 对比基线时超过该比例视为退化
+REGRESSION_THRESHOLD = 0.10
+
+COMMON_WORDS = [
+    '系统', '数据', '方法', '结果', '问题', '模型', '文档', '用户', '需要', '可以', '通过', '进行',
+    'the', 'with', 'for', 'and', 'system', 'data', 'result', 'value', 'input', 'output', 'using', 'from',
+]
+TOPIC_SYLLABLES = [
+    '检索', '向量', '索引', '分块', '嵌入', '缓存', '排序', '召回', '压缩', '量化', '分片', '日志',
+    '语义', '查询', '融合', '训练', '推理', '延迟', '吞吐', '内存', '磁盘', '线程', '进程', '队列',
+    'vector', 'index', 'cache', 'shard', 'query', 'token', 'batch', 'graph', 'score', 'rank',
+    'merge', 'embed', 'store', 'parse', 'chunk', 'model', 'latency', 'memory', 'thread', 'bucket',
+]
+
+
+def _directory_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    values = np.array(samples) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'mean_ms': round(float(values.mean()), 3),
+    }
+
+
+def _apply_settings(overrides: Dict[str, object]) -> None:
+    from core.config import settings
+    
+    # 基准只测本地计算：关闭缓存、后台合并与跨进程跟进
+    settings.embedding_cache_enabled = False
+    settings.index_watch_interval = 0
+    settings.index_compaction_threshold = 10 ** 9
+    settings.index_tombstone_threshold = 10 ** 9
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+
+def generate_corpus(directory: str, n_chunks: int, chunk_size: int, seed: int) -> List[str]:
+    """生成主题化的合成文档 (中英混合)，每篇约 CHUNKS_PER_DOCUMENT 个块，返回文件路径"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    n_documents = max(1, -(-n_chunks // CHUNKS_PER_DOCUMENT))
+    paths = []
+    
+    for document in range(n_documents):
+        topic = rng.choice(TOPIC_SYLLABLES, size=8, replace=False)
+        sentences = []
+        length = 0
+        while length < CHUNKS_PER_DOCUMENT * chunk_size:
+            n_words = int(rng.integers(4, 14))
+            use_topic = rng.random(n_words) < 0.6
+            words = np.where(use_topic, rng.choice(topic, n_words), rng.choice(COMMON_WORDS, n_words))
+            sentence = ' '.join(words) + str(rng.choice(['。', '！', '？', '\n']))
+            sentences.append(sentence)
+            length += len(sentence)
+        
+        path = os.path.join(directory, f"doc{document:06d}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(''.join(sentences))
+        paths.append(path)
+    return paths
+
+
+def generate_queries(paths: List[str], n_queries: int, seed: int) -> List[str]:
+    """从语料中抽取句子片段作为查询"""
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for path in rng.choice(paths, size=n_queries):
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        start = int(rng.integers(0, max(1, len(text) - 40)))
+        queries.append(text[start:start + 40].strip() or text[:40])
+    return queries
+
+
+def run_ingest(index_dir: str, paths: List[str], batch_size: int) -> Dict[str, object]:
+    """按 解析 / 分块 / 嵌入 / 写入索引 四个阶段计时，写入 flat 索引"""
+    from core.config import settings
+    from services.document_processor import DocumentParser, TextChunker
+    from services.embedding_service import MockEmbeddingService
+    from services.vector_store import VectorStore
+    
+    embedding_service = MockEmbeddingService(settings.embedding_dimension)
+    store = VectorStore(embedding_service, index_dir=index_dir)
+    store.load()
+    chunker = TextChunker(settings.chunk_size, settings.chunk_overlap, settings.chunk_length_unit)
+    timings = {'parse': 0.0, 'chunk': 0.0, 'embed': 0.0, 'index': 0.0}
+    batch: List[dict] = []
+    n_chunks = 0
+    
+    def flush():
+        start = time.perf_counter()
+        embeddings = embedding_service.embed_texts([chunk['content'] for chunk in batch])
+        timings['embed'] += time.perf_counter() - start
+        start = time.perf_counter()
+        store.add_embeddings(batch, embeddings)
+        timings['index'] += time.perf_counter() - start
+    
+    for path in paths:
+        filename = os.path.basename(path)
+        start = time.perf_counter()
+        pieces = list(DocumentParser.iter_pages(path, 'text/plain'))
+        timings['parse'] += time.perf_counter() - start
+        
+        start = time.perf_counter()
+        chunks = list(chunker.iter_document_chunks(pieces, filename.split('.')[0], filename))
+        timings['chunk'] += time.perf_counter() - start
+        
+        n_chunks += len(chunks)
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                flush()
+                batch = []
+    if batch:
+        flush()
+    
+    total = sum(timings.values())
+    corpus_bytes = sum(os.path.getsize(path) for path in paths)
+    return {
+        'documents': len(paths),
+        'chunks': n_chunks,
+        'corpus_mb': round(corpus_bytes / 1e6, 3),
+        'seconds': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        'chunks_per_second': round(n_chunks / total, 1) if total else None,
+        'mb_per_second': round(corpus_bytes / 1e6 / total, 3) if total else None,
+    }
+
+
+def run_build(index_dir: str, index_type: str, shard_count: int = 0) -> Dict[str, object]:
+    """在 flat 索引目录的副本上重建为指定类型并合并为快照；shard_count > 0 时先按文档拆分为分片目录"""
+    from services.ann_index import resolve_index_type
+    from services.vector_store import VectorStore
+    
+    result: Dict[str, object] = {}
+    if shard_count:
+        start = time.perf_counter()
+        stores = _split_shards(index_dir, shard_count)
+        result['split_seconds'] = round(time.perf_counter() - start, 4)
+    else:
+        stores = [VectorStore(index_dir=index_dir, dimension=_dimension())]
+        stores[0].load()
+    # 各分片统一按最小分片的规模确定实际索引类型
+    effective = resolve_index_type(index_type, min(store.get_chunk_count() for store in stores))
+    start = time.perf_counter()
+    for store in stores:
+        if effective != 'flat':
+            store.rebuild_index(effective)
+        store.compact()
+    return {'index_type': effective, 'build_seconds': round(time.perf_counter() - start, 4), **result}
+
+
+def _split_shards(index_dir: str, shard_count: int) -> list:
+    """把单机索引目录按 ShardedVectorStore 的布局 (shard-N 子目录 + shards.json) 拆分并删除原有文件，返回各分片的 VectorStore"""
+    from services.sharded_vector_store import SHARDS_FILE, shard_of
+    from services.vector_store import VectorStore, document_id_of
+    
+    source = _open_persistence(index_dir)
+    shard_dirs = [os.path.join(index_dir, f"shard-{shard_index}") for shard_index in range(shard_count)]
+    shards = [VectorStore(index_dir=directory, dimension=_dimension()) for directory in shard_dirs]
+    for shard in shards:
+        shard.load()
+    
+    live_ids = source.chunk_store.live_ids()
+    for start in range(0, len(live_ids), 4096):
+        ids = live_ids[start:start + 4096]
+        chunks = [source.chunk_store.get(vector_id) for vector_id in ids.tolist()]
+        vectors = np.asarray(source.vectors[ids])
+        rows: Dict[int, List[int]] = {}
+        for row, chunk in enumerate(chunks):
+            rows.setdefault(shard_of(document_id_of(chunk), shard_count), []).append(row)
+        for shard_index, shard_rows in rows.items():
+            shards[shard_index].add_embeddings([chunks[row] for row in shard_rows], vectors[shard_rows])
+    
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if path in shard_dirs:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    with open(os.path.join(index_dir, SHARDS_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'shard_count': shard_count}, f)
+    return shards
+
+
+def _open_persistence(index_dir: str):
+    """只读打开索引目录的全精度向量与文本块 (不建立检索索引)，删除标记已回放"""
+    from services.index_persistence import IndexPersistence
+    
+    persistence = IndexPersistence(index_dir, _dimension())
+    _, base_deleted = persistence.load(mmap=True)
+    persistence.chunk_store.mark_deleted(base_deleted)
+    for _, _, deleted in persistence.iter_logs():
+        persistence.chunk_store.mark_deleted(deleted)
+    return persistence
+
+
+def run_search(index_dir: str, queries: List[str], hybrid: bool) -> Dict[str, object]:
+    """加载索引并测量内存、单查询延迟分位数、批量吞吐与相对精确检索的 recall@10
+
+    VECTOR_STORE_SHARDS > 0 时经 ShardedVectorStore 检索，内存计入各分片进程的私有内存。
+    """
+    from core.config import settings
+    from services.embedding_service import MockEmbeddingService
+    from services.sharded_vector_store import ShardedVectorStore
+    from services.vector_store import VectorStore
+    from utils.memory import rss_anon
+    
+    embedding_service = MockEmbeddingService(_dimension())
+    embeddings = embedding_service.embed_texts(queries)
+    
+    rss_before = rss_anon()
+    start = time.perf_counter()
+    if settings.vector_store_shards:
+        settings.index_dir = index_dir
+        store = ShardedVectorStore(embedding_service)
+    else:
+        store = VectorStore(embedding_service, index_dir=index_dir)
+    store.load()
+    while not store.lexical_ready:
+        time.sleep(0.01)
+    load_seconds = time.perf_counter() - start
+    rss_loaded = rss_anon() - rss_before
+    if settings.vector_store_shards:
+        rss_loaded += sum(rss_anon(str(shard.process.pid)) for shard in store.shards)
+    n_chunks = store.get_chunk_count()
+    
+    for embedding, query in list(zip(embeddings, queries))[:10]:
+        store.search_by_vector(embedding, top_k=RECALL_K, query=query, hybrid=hybrid)
+    
+    latencies = []
+    for embedding, query in zip(embeddings, queries):
+        start = time.perf_counter()
+        store.search_by_vector(embedding, top_k=RECALL_K, query=query, hybrid=hybrid)
+        latencies.append(time.perf_counter() - start)
+    
+    batches = [slice(i, i + BATCH_QUERIES) for i in range(0, len(queries), BATCH_QUERIES)]
+    start = time.perf_counter()
+    for rows in batches:
+        store.search_batch(embeddings[rows], [RECALL_K] * len(queries[rows]), queries=queries[rows], hybrid=hybrid)
+    batch_seconds = time.perf_counter() - start
+    
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    if settings.vector_store_shards:
+        recall = _sharded_recall(store, normalized)
+        store.close()
+    else:
+        # 精确 top-k：用磁盘上的全精度向量暴力计算
+        live_ids = store.chunk_store.live_ids()
+        vectors = np.asarray(store.persistence.vectors[live_ids])
+        exact = live_ids[np.argsort(-(normalized @ vectors.T), axis=1)[:, :RECALL_K]]
+        candidates = store.search_candidates(embeddings, [RECALL_K] * len(queries), hybrid=False)
+        recall = np.mean([
+            len({idx for idx, _, _ in dense} & set(truth.tolist())) / RECALL_K
+            for (dense, _), truth in zip(candidates, exact)
+        ])
+    
+    return {
+        'chunks': n_chunks,
+        'load_seconds': round(load_seconds, 4),
+        'latency': _percentiles(latencies),
+        'batch_qps': round(len(queries) / batch_seconds, 1),
+        f'recall_at_{RECALL_K}': round(float(recall), 4),
+        'rss_bytes_per_chunk': round(rss_loaded / max(n_chunks, 1), 1),
+        'disk_bytes_per_chunk': round(_directory_bytes(index_dir) / max(n_chunks, 1), 1),
+    }
+
+
+def _sharded_recall(store, embeddings: np.ndarray) -> float:
+    """分片存储的 recall@10：精确 top-k 由各分片目录的全精度向量合并计算，按 chunk_id 比较"""
+    from core.config import settings
+    
+    chunk_ids: List[str] = []
+    vectors = []
+    for shard_index in range(store.shard_count):
+        persistence = _open_persistence(os.path.join(settings.index_dir, f"shard-{shard_index}"))
+        live_ids = persistence.chunk_store.live_ids()
+        vectors.append(np.asarray(persistence.vectors[live_ids]))
+        chunk_ids.extend(persistence.chunk_store.get(vector_id)['chunk_id'] for vector_id in live_ids.tolist())
+    
+    chunk_ids = np.array(chunk_ids)
+    exact = chunk_ids[np.argsort(-(embeddings @ np.concatenate(vectors).T), axis=1)[:, :RECALL_K]]
+    results = store.search_batch(embeddings, [RECALL_K] * len(embeddings), hybrid=False)
+    return float(np.mean([
+        len({chunk['chunk_id'] for chunk, _ in hits} & set(truth.tolist())) / RECALL_K
+        for hits, truth in zip(results, exact)
+    ]))
+
+
+def _dimension() -> int:
+    from core.config import settings
+    return settings.embedding_dimension
+
+
+def _child(conn, overrides: Dict[str, object], function: str, args: tuple) -> None:
+    try:
+        _apply_settings(overrides)
+        conn.send(('ok', globals()[function](*args)))
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def _in_subprocess(function: str, args: tuple, overrides: Optional[Dict[str, object]] = None) -> Dict[str, object]:
+    """在全新的子进程中运行，避免前一个配置的内存与线程影响测量"""
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child, args=(sender, overrides or {}, function, args))
+    process.start()
+    sender.close()
+    try:
+        status, result = receiver.recv()
+    except EOFError:
+        status, result = 'error', f"子进程异常退出 (exit code {process.exitcode})"
+    process.join()
+    if status != 'ok':
+        raise RuntimeError(result)
+    return result
+
+
+def compare(results: dict, baseline: dict) -> List[str]:
+    """与基线逐项对比延迟、吞吐与 recall，返回超过阈值的退化描述"""
+    regressions = []
+    
+    def check(label: str, current: Optional[float], previous: Optional[float], higher_is_better: bool) -> None:
+        if not current or not previous:
+            return
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > REGRESSION_THRESHOLD:
+            regressions.append(f"{label}: {previous} -> {current} ({change:+.1%})")
+    
+    previous_ingest = {item['chunks_target']: item for item in baseline.get('ingest', [])}
+    for item in results['ingest']:
+        previous = previous_ingest.get(item['chunks_target'])
+        if previous:
+            check(f"ingest[{item['chunks_target']}] chunks/s", item['chunks_per_second'],
+                  previous['chunks_per_second'], True)
+    
+    previous_search = {(item['config'], item['chunks_target']): item for item in baseline.get('search', [])}
+    for item in results['search']:
+        previous = previous_search.get((item['config'], item['chunks_target']))
+        if not previous or 'error' in item or 'error' in previous:
+            continue
+        label = f"search[{item['config']}, {item['chunks_target']}]"
+        check(f"{label} p50_ms", item['latency']['p50_ms'], previous['latency']['p50_ms'], False)
+        check(f"{label} p95_ms", item['latency']['p95_ms'], previous['latency']['p95_ms'], False)
+        check(f"{label} batch_qps", item['batch_qps'], previous['batch_qps'], True)
+        check(f"{label} recall", item[f'recall_at_{RECALL_K}'], previous[f'recall_at_{RECALL_K}'], True)
+        check(f"{label} rss_bytes_per_chunk", item['rss_bytes_per_chunk'], previous['rss_bytes_per_chunk'], False)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="RAG 后端离线基准测试")
+    parser.add_argument('--sizes', default='1000,10000', help="语料规模 (文本块数)，逗号分隔")
+    parser.add_argument('--configs', default=','.join(CONFIGS), help=f"检索配置，可选: {', '.join(CONFIGS)}")
+    parser.add_argument('--queries', type=int, default=200, help="每个配置的查询数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=256, help="入库时每批嵌入的文本块数")
+    parser.add_argument('--workdir', default=None, help="语料与索引目录，默认使用临时目录并在结束后删除")
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', default=None, help="上一次的结果 JSON，输出退化项")
+    args = parser.parse_args(argv)
+    
+    from core.config import settings
+    import faiss
+    
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    configs = [name for name in args.configs.split(',') if name]
+    unknown = [name for name in configs if name not in CONFIGS]
+    if unknown:
+        parser.error(f"未知配置: {', '.join(unknown)}")
+    
+    workdir = args.workdir or tempfile.mkdtemp(prefix='rag-benchmark-')
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'faiss': getattr(faiss, '__version__', None),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'queries': args.queries,
+            'embedding_dimension': settings.embedding_dimension,
+            'chunk_size': settings.chunk_size,
+            'chunk_overlap': settings.chunk_overlap,
+        },
+        'ingest': [],
+        'search': [],
+    }
+    
+    try:
+        for size in sizes:
+            corpus_dir = os.path.join(workdir, f"corpus-{size}")
+            paths = generate_corpus(corpus_dir, size, settings.chunk_size, args.seed)
+            queries = generate_queries(paths, args.queries, args.seed)
+            
+            base_dir = os.path.join(workdir, f"index-{size}-base")
+            shutil.rmtree(base_dir, ignore_errors=True)
+            ingest = _in_subprocess('run_ingest', (base_dir, paths, args.batch_size), {'vector_store_type': 'flat'})
+            results['ingest'].append({'chunks_target': size, **ingest})
+            print(f"[ingest {size}] {ingest['chunks']} 块, {ingest['chunks_per_second']} 块/秒, {ingest['seconds']}")
+            
+            for name in configs:
+                config = CONFIGS[name]
+                index_dir = os.path.join(workdir, f"index-{size}-{name}")
+                shutil.rmtree(index_dir, ignore_errors=True)
+                shutil.copytree(base_dir, index_dir)
+                overrides = {'vector_store_type': 'flat', 'index_mmap': config.get('index_mmap', False)}
+                shard_count = config.get('vector_store_shards', 0)
+                try:
+                    build = _in_subprocess('run_build', (index_dir, config['vector_store_type'], shard_count), overrides)
+                    overrides.update(vector_store_type=build['index_type'], vector_store_shards=shard_count)
+                    search = _in_subprocess('run_search', (index_dir, queries, config.get('hybrid', False)), overrides)
+                    item = {'config': name, 'chunks_target': size, **build, **search}
+                    print(f"[search {size} {name}] p50 {search['latency']['p50_ms']} ms, "
+                          f"p95 {search['latency']['p95_ms']} ms, recall {search[f'recall_at_{RECALL_K}']}, "
+                          f"{search['rss_bytes_per_chunk']} B/块")
+                except RuntimeError as e:
+                    item = {'config': name, 'chunks_target': size, 'error': str(e)}
+                    print(f"[search {size} {name}] 失败: {e}")
+                results['search'].append(item)
+                shutil.rmtree(index_dir, ignore_errors=True)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f))
+        for line in regressions:
+            print(f"退化: {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,18 +10,100 @@ class Settings(BaseSettings):
     openai_base_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
     openai_temperature: float = 0.7
     openai_max_tokens: int = 2000
+    # 为 True 时使用 MockLLMService，不调用模型接口
+    llm_mock: bool = True
+    llm_max_concurrency: int = 16
+    llm_max_connections: int = 32
+    llm_request_timeout: float = 60.0
+    llm_max_retries: int = 3
+    llm_retry_base_delay: float = 0.5
+    llm_retry_max_delay: float = 8.0
+    # 对冲请求延迟，0 表示关闭；建议设为上游 p95 延迟
+    llm_hedge_delay_ms: float = 0
+    # 提示词中检索上下文的 token 预算；安装 tiktoken 时按该编码计数
+    context_token_budget: int = 3000
+    context_tokenizer: str = "cl100k_base"
     
     embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"
     embedding_dimension: int = 384
+    embedding_warmup: bool = True
+    # 推理后端：torch (sentence-transformers) 或 onnx (ONNX Runtime 运行导出或 int8 量化的模型)
+    embedding_backend: str = "torch"
+    embedding_onnx_path: str = ""
+    # 默认在模型文件所在目录及上一级查找 tokenizer.json
+    embedding_onnx_tokenizer: str = ""
+    embedding_onnx_batch_size: int = 32
+    embedding_max_seq_length: int = 256
+    # ONNX Runtime 算子内线程数，0 表示由运行时按物理核数决定
+    embedding_intra_op_threads: int = 0
+    embedding_batch_max_size: int = 32
+    embedding_batch_window_ms: float = 5.0
+    embedding_cache_enabled: bool = True
+    query_embedding_cache_size: int = 1024
     
+    # 向量索引类型: faiss/flat, ivf_flat, ivf_pq, hnsw, sq_fp16, sq_int8, binary,
+    # auto (超过 ann_auto_threshold 后自动迁移)
     vector_store_type: str = "faiss"
+    ann_auto_threshold: int = 200000
+    ann_auto_index_type: str = "hnsw"
+    ann_training_sample_size: int = 100000
+    ivf_nlist: int = 0
+    ivf_nprobe: int = 16
+    ivf_pq_m: int = 48
+    ivf_pq_nbits: int = 8
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 128
+    hnsw_ef_search: int = 64
+    # 量化索引 (ivf_pq, sq_fp16, sq_int8, binary) 多取 N 倍候选，用全精度向量重新打分；≤1 表示关闭
+    rescore_multiplier: int = 4
     upload_dir: str = "./uploads"
     index_dir: str = "./indexes"
+    # 向量存储分片进程数 (按 document_id 哈希分配)，0 表示在 API 进程内单机存储
+    vector_store_shards: int = 0
+    # 多进程 (uvicorn --workers) 共用索引目录：基线快照以只读内存映射打开，按间隔 (秒) 跟进其他进程的提交
+    index_mmap: bool = False
+    index_watch_interval: float = 1.0
+    index_compaction_threshold: int = 20000
+    index_tombstone_threshold: int = 5000
     
     chunk_size: int = 500
     chunk_overlap: int = 50
+    # 分块长度单位：chars 按字符，tokens 按 token (与上下文预算使用同一计数方式)
+    chunk_length_unit: str = "chars"
+    ingest_batch_size: int = 256
+    ingest_parse_workers: int = 0
+    pdf_pages_per_task: int = 16
+    ingest_job_history: int = 1000
+    upload_read_size: int = 1024 * 1024
     
     similarity_top_k: int = 5
+    search_batch_max_queries: int = 1024
+    # 语义回答缓存：相似度超过阈值的问题直接复用回答
+    answer_cache_enabled: bool = True
+    answer_cache_size: int = 1000
+    answer_cache_threshold: float = 0.92
+    answer_cache_ttl_seconds: float = 3600
+    # 混合检索：BM25 与向量结果按倒数排名融合 (RRF)
+    hybrid_search_enabled: bool = True
+    hybrid_fetch_multiplier: int = 4
+    rrf_k: int = 60
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+    # 交叉编码器重排：向量检索多取 rerank_candidates 个候选分批打分，候选文本截断到 rerank_max_tokens；
+    # 单次查询超出 rerank_budget_ms (0 表示不限) 时停止，未打分的候选保持向量顺序
+    rerank_enabled: bool = False
+    rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    rerank_candidates: int = 50
+    rerank_batch_size: int = 16
+    rerank_max_tokens: int = 256
+    rerank_budget_ms: float = 150
+    
+    # 指标：/metrics 输出 Prometheus 文本格式；开启 timing 头时响应带 Server-Timing 阶段耗时分解
+    metrics_enabled: bool = True
+    metrics_timing_headers: bool = False
+    # 采样分析器：启动即开始采样，也可通过 /api/profiler/start 与 /api/profiler/stop 开关
+    profiler_enabled: bool = False
+    profiler_interval_ms: float = 10.0
     
     host: str = "0.0.0.0"
     port: int = 8000
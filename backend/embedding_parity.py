@@ -0,0 +1,141 @@
+"""嵌入推理后端一致性检查 - 对比 ONNX 后端与 sentence-transformers 参考实现
+
+    cd backend
+    python embedding_parity.py --onnx-path ./models/all-MiniLM-L6-v2/onnx/model_qint8_avx512.onnx
+    python embedding_parity.py --onnx-path ... --texts-file samples.txt --threads 4 --output parity.json
+
+两个后端各在独立子进程中加载并编码同一批文本，输出逐行余弦相似度 (最小/平均)、
+编码吞吐与加载后的进程私有内存；最小余弦低于 --threshold 时以非零状态退出。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from typing import List, Optional
+
+import numpy as np
+
+
+SAMPLE_SENTENCES = [
+    '向量检索先把文本编码成稠密向量，再按内积找最近邻。',
+    '文档上传后在后台解析、分块并写入索引。',
+    'The quick brown fox jumps over the lazy dog.',
+    'Error E1234: connection to the upstream service timed out after 30 seconds.',
+    '混合检索把 BM25 的关键词命中与语义相似度按倒数排名融合。',
+    'Quantized indexes trade a little recall for much smaller memory per vector.',
+    '请根据以下上下文信息回答用户的问题。',
+    'ONNX Runtime executes the exported graph with fused kernels on the CPU.',
+]
+
+
+def generate_texts(count: int, seed: int) -> List[str]:
+    """长短不一的样本文本 (1~12 句)，覆盖长度分桶与动态填充的不同批次"""
+    rng = np.random.default_rng(seed)
+    texts = []
+    for _ in range(count):
+        picks = rng.integers(0, len(SAMPLE_SENTENCES), size=int(rng.integers(1, 13)))
+        texts.append(' '.join(SAMPLE_SENTENCES[i] for i in picks))
+    return texts
+
+
+def _encode_child(backend: str, texts: List[str], output_path: str, overrides: dict, queue) -> None:
+    try:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from core.config import settings
+        for name, value in overrides.items():
+            setattr(settings, name, value)
+        from services.embedding_backends import create_backend
+        from utils.memory import rss_anon
+        
+        start = time.perf_counter()
+        model = create_backend(backend)
+        load_seconds = time.perf_counter() - start
+        model.encode(texts[:8])
+        
+        start = time.perf_counter()
+        embeddings = model.encode(texts)
+        encode_seconds = time.perf_counter() - start
+        np.save(output_path, np.asarray(embeddings, dtype=np.float32))
+        queue.put({
+            'backend': backend,
+            'load_seconds': round(load_seconds, 3),
+            'texts_per_second': round(len(texts) / encode_seconds, 1),
+            'rss_bytes': rss_anon(),
+        })
+    except Exception as e:
+        queue.put({'backend': backend, 'error': f"{type(e).__name__}: {e}"})
+
+
+def run_backend(backend: str, texts: List[str], output_path: str, overrides: dict) -> dict:
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_encode_child, args=(backend, texts, output_path, overrides, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    if 'error' in result:
+        raise RuntimeError(f"{backend} 后端失败: {result['error']}")
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="ONNX 嵌入后端与参考实现的一致性与吞吐对比")
+    parser.add_argument('--onnx-path', default=None, help="ONNX 模型文件，默认取 EMBEDDING_ONNX_PATH")
+    parser.add_argument('--tokenizer', default=None, help="tokenizer.json，默认在模型目录及上一级查找")
+    parser.add_argument('--texts-file', default=None, help="每行一条文本，默认使用生成的样本")
+    parser.add_argument('--count', type=int, default=512, help="生成的样本文本数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=None, help="ONNX Runtime 算子内线程数")
+    parser.add_argument('--threshold', type=float, default=0.98, help="允许的最小余弦相似度")
+    parser.add_argument('--output', default=None, help="结果 JSON 路径")
+    args = parser.parse_args(argv)
+    
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from core.config import settings
+    from services.embedding_backends import cosine_parity
+    
+    if args.texts_file:
+        with open(args.texts_file, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = generate_texts(args.count, args.seed)
+    
+    overrides = {'embedding_onnx_path': args.onnx_path or settings.embedding_onnx_path}
+    if args.tokenizer:
+        overrides['embedding_onnx_tokenizer'] = args.tokenizer
+    if args.threads is not None:
+        overrides['embedding_intra_op_threads'] = args.threads
+    if not overrides['embedding_onnx_path']:
+        parser.error("请通过 --onnx-path 或 EMBEDDING_ONNX_PATH 指定 ONNX 模型")
+    
+    with tempfile.TemporaryDirectory(prefix='embedding-parity-') as workdir:
+        reference_path = os.path.join(workdir, 'torch.npy')
+        onnx_path = os.path.join(workdir, 'onnx.npy')
+        reference = run_backend('torch', texts, reference_path, overrides)
+        candidate = run_backend('onnx', texts, onnx_path, overrides)
+        parity = cosine_parity(np.load(onnx_path), np.load(reference_path))
+    
+    results = {
+        'model': settings.embedding_model,
+        'onnx_path': overrides['embedding_onnx_path'],
+        'parity': parity,
+        'torch': reference,
+        'onnx': candidate,
+        'speedup': round(candidate['texts_per_second'] / reference['texts_per_second'], 2),
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    
+    if parity['min_cosine'] < args.threshold:
+        print(f"不一致: 最小余弦 {parity['min_cosine']:.4f} 低于阈值 {args.threshold}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,32 @@
 """
 RAG Learning Project - FastAPI 后端主应用
 """
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from api.routes import router
 from core.config import settings
+from services.container import container
+from services.metrics import CONTENT_TYPE, REQUEST_SECONDS, profiler, render_metrics, server_timing, track_request
 import os
+import time
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时一次性加载模型与索引，所有请求共享同一组服务实例
+    if settings.profiler_enabled:
+        profiler.start()
+    await run_in_threadpool(container.startup)
+    await container.embedding_scheduler.start()
+    app.state.services = container
+    yield
+    await container.embedding_scheduler.stop()
+    await container.llm_service.aclose()
+    container.shutdown()
+    profiler.stop()
 
 
 app = FastAPI(
@@ -15,6 +35,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 
@@ -27,6 +48,33 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_request_timing(request: Request, call_next):
+    """记录请求耗时；开启 METRICS_TIMING_HEADERS 时附加 Server-Timing 阶段耗时分解
+
+    流式响应只计到响应头发出为止。
+    """
+    if not settings.metrics_enabled:
+        return await call_next(request)
+    
+    start = time.perf_counter()
+    with track_request() as timings:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    
+    # 按路由模板而非实际路径打标签，避免 /api/jobs/{id} 之类的路径撑爆标签基数
+    route = request.scope.get('route')
+    REQUEST_SECONDS.observe(
+        elapsed,
+        method=request.method,
+        route=getattr(route, 'path', 'unmatched'),
+        status=str(response.status_code)
+    )
+    if settings.metrics_timing_headers:
+        response.headers['Server-Timing'] = server_timing(timings, elapsed)
+    return response
+
+
 app.include_router(router, prefix="/api", tags=["RAG"])
 
 
@@ -39,6 +87,14 @@ async def root():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 抓取端点"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="指标未启用")
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -39,12 +39,33 @@ class SearchResult(BaseModel):
 class QueryRequest(BaseModel):
     query: str
     top_k: Optional[int] = 5
+    document_id: Optional[str] = None
+    filename: Optional[str] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    hybrid: Optional[bool] = None
+    rerank: Optional[bool] = None
+
+
+class BatchSearchQuery(BaseModel):
+    query: str
+    top_k: Optional[int] = 5
+    document_id: Optional[str] = None
+    filename: Optional[str] = None
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery]
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    hybrid: Optional[bool] = None
 
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[SearchResult]
     query: str
+    cached: bool = False
 
 
 class UploadResponse(BaseModel):
@@ -52,6 +73,21 @@ class UploadResponse(BaseModel):
     filename: str
     chunk_count: int
     message: str
+    job_id: Optional[str] = None
+    status: Optional[str] = None
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    document_id: str
+    filename: str
+    stage: str
+    pages_total: Optional[int] = None
+    chunks_total: Optional[int] = None
+    chunks_indexed: int
+    elapsed_seconds: float
+    chunks_per_second: float
+    error: Optional[str] = None
 
 
 class HealthResponse(BaseModel):
@@ -59,3 +95,4 @@ class HealthResponse(BaseModel):
     embedding_model: str
     vector_store: str
     document_count: int
+    ready: bool = False
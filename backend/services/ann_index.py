@@ -0,0 +1,280 @@
+import math
+from typing import Optional, Set
+
+import numpy as np
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+from core.config import settings
+
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq_fp16', 'sq_int8', 'binary')
+INDEX_TYPE_ALIASES = {'faiss': 'flat'}
+TRAINED_INDEX_TYPES = ('ivf_flat', 'ivf_pq', 'sq_int8')
+# 有损压缩存储的索引：检索时多取候选，再用全精度向量重新打分
+QUANTIZED_INDEX_TYPES = ('ivf_pq', 'sq_fp16', 'sq_int8', 'binary')
+
+# faiss 建议每个聚类中心至少有 39 个训练样本
+MIN_POINTS_PER_CENTROID = 39
+PQ_CENTROIDS = 256
+# int8 标量量化只需估计每一维的取值范围
+SQ_MIN_TRAINING_SIZE = 1000
+# faiss 二进制索引文件的 fourcc 前缀 (IBxF、IBMp 等)
+BINARY_INDEX_MAGIC = b'IB'
+
+
+class BinaryIndex:
+    """二值量化索引 - 每维只保留符号位 (384 维为 48 字节)，按汉明距离检索
+
+    接口与 IndexIDMap 一致 (浮点向量输入)；分数为由汉明距离估计的余弦相似度 cos(π·h/d)，
+    仅用于排序候选，最终分数由全精度向量重新计算。
+    """
+    
+    def __init__(self, dimension: int, index: Optional["faiss.IndexBinary"] = None):
+        if dimension % 8:
+            raise ValueError(f"二值量化要求向量维度为 8 的倍数: {dimension}")
+        self.d = dimension
+        self.index = index if index is not None else faiss.IndexBinaryIDMap(faiss.IndexBinaryFlat(dimension))
+    
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+    
+    @property
+    def is_trained(self) -> bool:
+        return True
+    
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(np.asarray(vectors) > 0, axis=1)
+    
+    def add_with_ids(self, vectors: np.ndarray, ids: np.ndarray) -> None:
+        self.index.add_with_ids(self.encode(vectors), np.ascontiguousarray(ids, dtype=np.int64))
+    
+    def search(self, vectors: np.ndarray, k: int, params: Optional["faiss.SearchParameters"] = None):
+        distances, ids = self.index.search(self.encode(vectors), k, params=params)
+        return np.cos(np.pi * distances / self.d).astype(np.float32), ids
+    
+    def remove_ids(self, ids: np.ndarray) -> int:
+        return self.index.remove_ids(np.ascontiguousarray(ids, dtype=np.int64))
+    
+    def reset(self) -> None:
+        self.index.reset()
+
+
+def ivf_nlist(n_vectors: int) -> int:
+    if settings.ivf_nlist > 0:
+        return settings.ivf_nlist
+    return int(min(65536, max(16, 4 * math.sqrt(max(n_vectors, 1)))))
+
+
+def min_training_size(index_type: str, n_vectors: int) -> int:
+    if index_type not in TRAINED_INDEX_TYPES:
+        return 0
+    size = ivf_nlist(n_vectors) * MIN_POINTS_PER_CENTROID
+    if index_type == 'ivf_pq':
+        size = max(size, PQ_CENTROIDS * MIN_POINTS_PER_CENTROID)
+    if index_type == 'sq_int8':
+        size = SQ_MIN_TRAINING_SIZE
+    return size
+
+
+def resolve_index_type(configured: str, n_vectors: int) -> str:
+    """根据配置与当前向量数决定应使用的索引类型；训练样本不足时退回 flat"""
+    index_type = INDEX_TYPE_ALIASES.get(configured, configured)
+    if index_type == 'auto':
+        index_type = settings.ann_auto_index_type if n_vectors >= settings.ann_auto_threshold else 'flat'
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的向量索引类型: {configured}")
+    if n_vectors < min_training_size(index_type, n_vectors):
+        return 'flat'
+    return index_type
+
+
+def create_index(index_type: str, dimension: int, n_vectors: int = 0) -> "faiss.Index":
+    """创建空索引 (内积度量，向量需预先归一化)；IVF 类索引需随后训练"""
+    if index_type == 'flat':
+        return faiss.IndexIDMap(faiss.IndexFlatIP(dimension))
+    
+    if index_type == 'hnsw':
+        hnsw = faiss.IndexHNSWFlat(dimension, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = settings.hnsw_ef_construction
+        return faiss.IndexIDMap(hnsw)
+    
+    if index_type in ('sq_fp16', 'sq_int8'):
+        qtype = faiss.ScalarQuantizer.QT_fp16 if index_type == 'sq_fp16' else faiss.ScalarQuantizer.QT_8bit
+        return faiss.IndexIDMap(faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_INNER_PRODUCT))
+    
+    if index_type == 'binary':
+        return BinaryIndex(dimension)
+    
+    nlist = ivf_nlist(n_vectors)
+    quantizer = faiss.IndexFlatIP(dimension)
+    if index_type == 'ivf_flat':
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == 'ivf_pq':
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, settings.ivf_pq_m,
+                                 settings.ivf_pq_nbits, faiss.METRIC_INNER_PRODUCT)
+    else:
+        raise ValueError(f"不支持的向量索引类型: {index_type}")
+    
+    # IVF 自带 ID 存储，量化器需随索引存活
+    index.referenced_objects = [quantizer]
+    index.nprobe = settings.ivf_nprobe
+    return index
+
+
+def index_type_of(index: "faiss.Index") -> str:
+    if isinstance(index, LayeredIndex):
+        return index_type_of(index.base)
+    if isinstance(index, BinaryIndex):
+        return 'binary'
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return 'sq_fp16' if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'sq_int8'
+    if isinstance(inner, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(inner, faiss.IndexIVF):
+        return 'ivf_flat'
+    return 'flat'
+
+
+class LayeredIndex:
+    """只读基线 + 内存增量层 - 基线以内存映射打开、在多个进程间共享页缓存，之后的新增写入增量层
+
+    内存映射的基线不能修改：删除的基线向量由调用方在检索时通过 IDSelector 排除，合并快照时清理。
+    量化基线的分数与增量层的精确内积不可比，检索时两层各取 k 个候选 (共 2k 列)，由调用方用全精度向量重排合并。
+    """
+    
+    def __init__(self, base: "faiss.Index", dimension: int):
+        self.base = base
+        self.delta = faiss.IndexIDMap(faiss.IndexFlatIP(dimension))
+        self.delta_ids: Set[int] = set()
+        self.quantized = index_type_of(base) in QUANTIZED_INDEX_TYPES
+    
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + self.delta.ntotal
+    
+    @property
+    def is_trained(self) -> bool:
+        return True
+    
+    def add_with_ids(self, vectors: np.ndarray, ids: np.ndarray) -> None:
+        self.delta.add_with_ids(vectors, ids)
+        self.delta_ids.update(ids.tolist())
+    
+    def remove_ids(self, ids: np.ndarray) -> int:
+        """只能从增量层删除，返回删除数；其余 ID 位于基线，需由调用方排除"""
+        in_delta = np.array([i for i in ids.tolist() if i in self.delta_ids], dtype=np.int64)
+        if not len(in_delta):
+            return 0
+        self.delta_ids.difference_update(in_delta.tolist())
+        return self.delta.remove_ids(in_delta)
+    
+    def search(self, vectors: np.ndarray, k: int, params: Optional["faiss.SearchParameters"] = None):
+        base_scores, base_ids = self.base.search(vectors, k, params=params)
+        if self.delta.ntotal == 0:
+            return base_scores, base_ids
+        
+        # 增量层是精确 flat 索引，只沿用 ID 过滤条件
+        delta_params = None
+        if params is not None and params.sel is not None:
+            delta_params = faiss.SearchParameters()
+            delta_params.sel = params.sel
+        delta_scores, delta_ids = self.delta.search(vectors, k, params=delta_params)
+        
+        scores = np.concatenate([base_scores, delta_scores], axis=1)
+        ids = np.concatenate([base_ids, delta_ids], axis=1)
+        scores[ids < 0] = -np.inf
+        if self.quantized:
+            return scores, ids
+        top = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(scores, top, axis=1), np.take_along_axis(ids, top, axis=1)
+
+
+def clone_index(index: "faiss.Index") -> "faiss.Index":
+    if isinstance(index, BinaryIndex):
+        # clone_binary_index 不支持 IndexBinaryIDMap，经序列化复制
+        return BinaryIndex(index.d, faiss.deserialize_index_binary(faiss.serialize_index_binary(index.index)))
+    return faiss.clone_index(index)
+
+
+def write_index(index: "faiss.Index", path: str) -> None:
+    if isinstance(index, BinaryIndex):
+        faiss.write_index_binary(index.index, path)
+    else:
+        faiss.write_index(index, path)
+
+
+def read_index(path: str, mmap: bool = False) -> "faiss.Index":
+    """读取索引文件；mmap 时数据段直接映射文件 (只读，不可再增删)"""
+    flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    with open(path, 'rb') as f:
+        magic = f.read(len(BINARY_INDEX_MAGIC))
+    if magic == BINARY_INDEX_MAGIC:
+        index = faiss.read_index_binary(path, flags)
+        return BinaryIndex(index.d, index)
+    return faiss.read_index(path, flags)
+
+
+def supports_remove(index_type: str) -> bool:
+    return index_type != 'hnsw'
+
+
+def search_parameters(
+    index_type: str,
+    selector: Optional["faiss.IDSelector"] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None
+) -> Optional["faiss.SearchParameters"]:
+    """构造单次查询的检索参数 (ID 过滤、nprobe、efSearch)"""
+    if index_type in TRAINED_INDEX_TYPES:
+        params = faiss.SearchParametersIVF()
+        params.nprobe = nprobe or settings.ivf_nprobe
+    elif index_type == 'hnsw':
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search or settings.hnsw_ef_search
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    
+    if selector is not None:
+        params.sel = selector
+        params.referenced_objects = [selector]
+    return params
+
+
+def id_selector(
+    include_ids: Optional[np.ndarray] = None,
+    exclude_ids: Optional[np.ndarray] = None
+) -> Optional["faiss.IDSelector"]:
+    """由允许/排除的向量 ID 构造 IDSelector，无约束时返回 None"""
+    selectors = []
+    if include_ids is not None:
+        selectors.append(_batch_selector(include_ids))
+    if exclude_ids is not None and len(exclude_ids):
+        excluded = _batch_selector(exclude_ids)
+        selector = faiss.IDSelectorNot(excluded)
+        selector.referenced_objects = [excluded]
+        selectors.append(selector)
+    
+    if not selectors:
+        return None
+    if len(selectors) == 1:
+        return selectors[0]
+    
+    selector = faiss.IDSelectorAnd(selectors[0], selectors[1])
+    selector.referenced_objects = selectors
+    return selector
+
+
+def _batch_selector(ids: np.ndarray) -> "faiss.IDSelector":
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    return faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
@@ -0,0 +1,177 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+from core.config import settings
+from services.metrics import record_cache_lookup
+
+
+class _CachedAnswer:
+    __slots__ = ('scope', 'answer', 'sources', 'document_ids', 'filenames', 'created_at')
+    
+    def __init__(self, scope: tuple, answer: str, sources: List[dict],
+                 document_ids: Set[str], filenames: Set[str]):
+        self.scope = scope
+        self.answer = answer
+        self.sources = sources
+        self.document_ids = document_ids
+        self.filenames = filenames
+        self.created_at = time.time()
+
+
+class SemanticAnswerCache:
+    """语义回答缓存 - 用小型 FAISS 索引匹配相近的问题，直接复用已生成的回答与来源
+
+    scope 区分影响回答的请求参数 (top_k、过滤条件等)，只有 scope 相同的问题才会命中。
+    来源文档被删除或重新入库时相关条目失效；条目另有 TTL，超出容量时按 LRU 淘汰。
+    """
+    
+    # 每次查找检查的近邻数，跳过 scope 不同或已过期的条目
+    SEARCH_NEIGHBORS = 8
+    
+    def __init__(
+        self,
+        dimension: int,
+        capacity: Optional[int] = None,
+        threshold: Optional[float] = None,
+        ttl_seconds: Optional[float] = None
+    ):
+        self.dimension = dimension
+        self.capacity = settings.answer_cache_size if capacity is None else capacity
+        self.threshold = settings.answer_cache_threshold if threshold is None else threshold
+        self.ttl_seconds = settings.answer_cache_ttl_seconds if ttl_seconds is None else ttl_seconds
+        self.index = faiss.IndexIDMap(faiss.IndexFlatIP(dimension))
+        self.entries: "OrderedDict[int, _CachedAnswer]" = OrderedDict()
+        self.by_document: Dict[str, Set[int]] = {}
+        self.by_filename: Dict[str, Set[int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._next_id = 0
+        self._epoch = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    @property
+    def epoch(self) -> int:
+        """失效计数；生成回答前记录，写入时若已变化说明期间有文档变更，放弃写入"""
+        return self._epoch
+    
+    def lookup(self, embedding: np.ndarray, scope: tuple) -> Optional[Tuple[str, List[dict]]]:
+        if self.capacity <= 0:
+            return None
+        
+        query = self._normalize(embedding)
+        with self._lock:
+            if self.index.ntotal == 0:
+                self.misses += 1
+                record_cache_lookup('answer', 0, 1)
+                return None
+            
+            k = min(self.SEARCH_NEIGHBORS, self.index.ntotal)
+            scores, ids = self.index.search(query, k)
+            now = time.time()
+            expired = []
+            hit = None
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id < 0 or score < self.threshold:
+                    break
+                entry = self.entries[int(entry_id)]
+                if now - entry.created_at > self.ttl_seconds:
+                    expired.append(int(entry_id))
+                    continue
+                if entry.scope == scope:
+                    hit = int(entry_id)
+                    break
+            
+            self._remove(expired)
+            if hit is None:
+                self.misses += 1
+                record_cache_lookup('answer', 0, 1)
+                return None
+            
+            self.hits += 1
+            record_cache_lookup('answer', 1)
+            self.entries.move_to_end(hit)
+            entry = self.entries[hit]
+            return entry.answer, entry.sources
+    
+    def store(self, embedding: np.ndarray, scope: tuple, answer: str, sources: List[dict], epoch: int) -> None:
+        if self.capacity <= 0 or not sources:
+            return
+        
+        query = self._normalize(embedding)
+        document_ids = {source.get('document_id') for source in sources if source.get('document_id')}
+        filenames = {source.get('metadata', {}).get('filename') for source in sources}
+        filenames.discard(None)
+        
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            
+            entry_id = self._next_id
+            self._next_id += 1
+            self.index.add_with_ids(query, np.array([entry_id], dtype=np.int64))
+            self.entries[entry_id] = _CachedAnswer(scope, answer, sources, document_ids, filenames)
+            for document_id in document_ids:
+                self.by_document.setdefault(document_id, set()).add(entry_id)
+            for filename in filenames:
+                self.by_filename.setdefault(filename, set()).add(entry_id)
+            
+            if len(self.entries) > self.capacity:
+                self._remove(list(self.entries)[:len(self.entries) - self.capacity])
+    
+    def invalidate(self, document_ids: Iterable[str] = (), filenames: Iterable[str] = ()) -> None:
+        """使引用了这些文档 (或同名文件) 的缓存条目失效"""
+        with self._lock:
+            self._epoch += 1
+            stale: Set[int] = set()
+            for document_id in document_ids:
+                stale |= self.by_document.get(document_id, set())
+            for filename in filenames:
+                stale |= self.by_filename.get(filename, set())
+            self._remove(list(stale))
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self.index.reset()
+            self.entries = OrderedDict()
+            self.by_document = {}
+            self.by_filename = {}
+    
+    def _remove(self, entry_ids: List[int]) -> None:
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id in self.entries]
+        if not entry_ids:
+            return
+        
+        self.index.remove_ids(np.array(entry_ids, dtype=np.int64))
+        for entry_id in entry_ids:
+            entry = self.entries.pop(entry_id)
+            for document_id in entry.document_ids:
+                self._discard(self.by_document, document_id, entry_id)
+            for filename in entry.filenames:
+                self._discard(self.by_filename, filename, entry_id)
+    
+    @staticmethod
+    def _discard(postings: Dict[str, Set[int]], key: str, entry_id: int) -> None:
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del postings[key]
+    
+    def _normalize(self, embedding: np.ndarray) -> np.ndarray:
+        query = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        norm = np.linalg.norm(query)
+        return query / norm if norm > 0 else query
@@ -0,0 +1,342 @@
+import os
+import json
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+# 定宽列：列名 -> 类型；整数列用 -1 表示该字段不存在
+COLUMNS = {
+    'text_end': np.int64,
+    'extra_end': np.int64,
+    'document': np.int32,
+    'number': np.int32,
+    'meta_document_id': np.int32,
+    'filename': np.int32,
+    'source': np.int32,
+    'char_count': np.int32,
+    'sentence_count': np.int32,
+    'page_start': np.int32,
+    'page_end': np.int32,
+    'position': np.int32,
+    'flags': np.uint8,
+}
+INT_FIELDS = ('char_count', 'sentence_count', 'page_start', 'page_end', 'position')
+# 元数据中的字符串字段 -> 列名 (值驻留到字符串表)
+STRING_FIELDS = {'document_id': 'meta_document_id', 'filename': 'filename', 'source': 'source'}
+TEXT_FILE = 'text.bin'
+EXTRA_FILE = 'extra.bin'
+STRINGS_FILE = 'strings.jsonl'
+FLAG_HAS_SPLIT = 1
+FLAG_IS_SPLIT = 2
+INT32_MAX = np.iinfo(np.int32).max
+
+
+class ChunkStore:
+    """列式文本块存储 - 文本拼接为单个内存映射文件 + 结束偏移数组，元数据按类型分列保存
+
+    文档 ID、文件名等字符串驻留为整数编号；行号即向量 ID，按 ID 读取为 O(1)。
+    已知字段之外的少量元数据以 JSON 存入 extra 区。删除状态只在内存中维护，由索引的墓碑日志恢复。
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.strings: List[str] = []
+        self._string_codes: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {}
+        self._text: Optional[np.memmap] = None
+        self._extra: Optional[np.memmap] = None
+        self._count = 0
+        self._mapped = 0
+        self._text_bytes = 0
+        self._extra_bytes = 0
+        self._strings_bytes = 0
+        self.deleted = np.zeros(0, dtype=bool)
+        self.deleted_count = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def __getitem__(self, vector_id: int) -> Optional[dict]:
+        return self.get(vector_id)
+    
+    @property
+    def live_count(self) -> int:
+        return self._count - self.deleted_count
+    
+    def open(self, count: int) -> None:
+        """打开已提交的前 count 行，截掉超出部分 (未提交的残留写入)"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_strings()
+        
+        for name, dtype in COLUMNS.items():
+            path = self._path(f"{name}.col")
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+            size = count * np.dtype(dtype).itemsize
+            if os.path.getsize(path) < size:
+                raise ValueError(f"文本块列 {name} 不完整: 需要 {count} 行")
+            if os.path.getsize(path) != size:
+                os.truncate(path, size)
+        
+        self._count = count
+        self._mapped = -1
+        self._remap()
+        self._text_bytes = int(self._columns['text_end'][-1]) if count else 0
+        self._extra_bytes = int(self._columns['extra_end'][-1]) if count else 0
+        for name, size in ((TEXT_FILE, self._text_bytes), (EXTRA_FILE, self._extra_bytes)):
+            path = self._path(name)
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+            if os.path.getsize(path) != size:
+                os.truncate(path, size)
+        self._remap()
+        
+        self.deleted = np.zeros(count, dtype=bool)
+        self.deleted_count = 0
+    
+    def refresh(self, count: int) -> None:
+        """跟进其他进程已提交的行 (只增不截断)，读取新增的驻留字符串"""
+        with self._lock:
+            if count <= self._count:
+                return
+            self._load_strings(incremental=True)
+            self._count = count
+            self._remap()
+            self._text_bytes = int(self._columns['text_end'][-1])
+            self._extra_bytes = int(self._columns['extra_end'][-1])
+            self.deleted = np.concatenate([self.deleted, np.zeros(count - len(self.deleted), dtype=bool)])
+    
+    def append(self, chunks: List[dict]) -> None:
+        """追加一批文本块并落盘；调用方随后提交清单中的行数"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            text_end = self._text_bytes
+            extra_end = self._extra_bytes
+            new_strings: List[str] = []
+            rows = {name: np.empty(len(chunks), dtype=dtype) for name, dtype in COLUMNS.items()}
+            texts = []
+            extras = []
+            
+            for row, chunk in enumerate(chunks):
+                values, text, extra = self._encode(chunk, new_strings)
+                text_end += len(text)
+                extra_end += len(extra)
+                values['text_end'] = text_end
+                values['extra_end'] = extra_end
+                for name, value in values.items():
+                    rows[name][row] = value
+                texts.append(text)
+                extras.append(extra)
+            
+            # 先写字符串表，再写列，保证已提交的行引用的字符串都已落盘
+            if new_strings:
+                payload = ''.join(json.dumps(s, ensure_ascii=False) + '\n' for s in new_strings).encode('utf-8')
+                self._write(STRINGS_FILE, payload)
+                self._strings_bytes += len(payload)
+            self._write(TEXT_FILE, b''.join(texts))
+            self._write(EXTRA_FILE, b''.join(extras))
+            for name, values in rows.items():
+                self._write(f"{name}.col", values.tobytes())
+            
+            self._text_bytes = text_end
+            self._extra_bytes = extra_end
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(chunks), dtype=bool)])
+            self._count += len(chunks)
+    
+    def get(self, vector_id: int) -> Optional[dict]:
+        if vector_id < 0 or vector_id >= self._count or self.deleted[vector_id]:
+            return None
+        self._ensure_mapped()
+        
+        columns = self._columns
+        content = self._slice(self._text, columns['text_end'], vector_id).decode('utf-8')
+        extra_bytes = self._slice(self._extra, columns['extra_end'], vector_id)
+        extra = json.loads(extra_bytes) if extra_bytes else {}
+        
+        metadata = {}
+        for field in INT_FIELDS:
+            value = int(columns[field][vector_id])
+            if value >= 0:
+                metadata[field] = value
+        flags = int(columns['flags'][vector_id])
+        if flags & FLAG_HAS_SPLIT:
+            metadata['is_split'] = bool(flags & FLAG_IS_SPLIT)
+        for field, column in STRING_FIELDS.items():
+            code = int(columns[column][vector_id])
+            if code >= 0:
+                metadata[field] = self.strings[code]
+        metadata.update(extra.get('metadata', {}))
+        
+        chunk_id = extra.get('chunk_id')
+        if chunk_id is None:
+            chunk_id = f"{self.document_id(vector_id)}_chunk_{int(columns['number'][vector_id])}"
+        chunk = {'chunk_id': chunk_id, 'content': content, 'metadata': metadata}
+        chunk.update(extra.get('fields', {}))
+        return chunk
+    
+    def content(self, vector_id: int) -> str:
+        self._ensure_mapped()
+        return self._slice(self._text, self._columns['text_end'], vector_id).decode('utf-8')
+    
+    def document_id(self, vector_id: int) -> str:
+        self._ensure_mapped()
+        return self.strings[int(self._columns['document'][vector_id])]
+    
+    def filename(self, vector_id: int) -> Optional[str]:
+        self._ensure_mapped()
+        code = int(self._columns['filename'][vector_id])
+        return self.strings[code] if code >= 0 else None
+    
+    def column(self, name: str) -> np.ndarray:
+        """只读的整列视图 (内存映射)，用于加载时的向量化统计"""
+        self._ensure_mapped()
+        return self._columns[name][:self._count]
+    
+    def live_ids(self, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        end = self._count if end is None else end
+        return np.flatnonzero(~self.deleted[start:end]).astype(np.int64) + start
+    
+    def deleted_ids(self) -> np.ndarray:
+        return np.flatnonzero(self.deleted).astype(np.int64)
+    
+    def iter_live(self) -> Iterator[Tuple[int, dict]]:
+        for vector_id in self.live_ids().tolist():
+            yield vector_id, self.get(vector_id)
+    
+    def mark_deleted(self, ids: np.ndarray) -> np.ndarray:
+        """标记删除，返回此前仍存活的 ID"""
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[(ids >= 0) & (ids < self._count)]
+        ids = np.unique(ids[~self.deleted[ids]])
+        self.deleted[ids] = True
+        self.deleted_count += len(ids)
+        return ids
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._columns = {}
+            self._text = None
+            self._extra = None
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    os.remove(self._path(name))
+            self.strings = []
+            self._string_codes = {}
+            self._count = 0
+            self._mapped = 0
+            self._text_bytes = self._extra_bytes = 0
+            self.deleted = np.zeros(0, dtype=bool)
+            self.deleted_count = 0
+            self.open(0)
+    
+    def _encode(self, chunk: dict, new_strings: List[str]) -> Tuple[dict, bytes, bytes]:
+        chunk_id = chunk.get('chunk_id', '')
+        document_id, _, number = chunk_id.partition('_chunk_')
+        values = {
+            'document': self._intern(document_id, new_strings),
+            'number': int(number) if number.isdigit() and int(number) <= INT32_MAX else -1,
+            'flags': 0,
+        }
+        extra: dict = {}
+        if values['number'] < 0 or f"{document_id}_chunk_{values['number']}" != chunk_id:
+            values['number'] = -1
+            extra['chunk_id'] = chunk_id
+        
+        metadata = dict(chunk.get('metadata') or {})
+        for field in INT_FIELDS:
+            value = metadata.get(field)
+            if type(value) is int and 0 <= value <= INT32_MAX:
+                values[field] = metadata.pop(field)
+            else:
+                values[field] = -1
+        if type(metadata.get('is_split')) is bool:
+            values['flags'] = FLAG_HAS_SPLIT | (FLAG_IS_SPLIT if metadata.pop('is_split') else 0)
+        for field, column in STRING_FIELDS.items():
+            value = metadata.get(field)
+            if isinstance(value, str):
+                values[column] = self._intern(metadata.pop(field), new_strings)
+            else:
+                values[column] = -1
+        
+        if metadata:
+            extra['metadata'] = metadata
+        fields = {key: value for key, value in chunk.items() if key not in ('chunk_id', 'content', 'metadata')}
+        if fields:
+            extra['fields'] = fields
+        
+        text = chunk.get('content', '').encode('utf-8')
+        extra_bytes = json.dumps(extra, ensure_ascii=False).encode('utf-8') if extra else b''
+        return values, text, extra_bytes
+    
+    def _intern(self, value: str, new_strings: List[str]) -> int:
+        code = self._string_codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(value)
+            self._string_codes[value] = code
+            new_strings.append(value)
+        return code
+    
+    def _load_strings(self, incremental: bool = False) -> None:
+        """读取字符串表；incremental 时只读取上次位置之后的完整行，且不截断 (可能有写入进行中)"""
+        if not incremental:
+            self.strings = []
+            self._string_codes = {}
+            self._strings_bytes = 0
+        path = self._path(STRINGS_FILE)
+        if not os.path.exists(path):
+            return
+        
+        with open(path, 'rb') as f:
+            f.seek(self._strings_bytes)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                value = json.loads(line)
+                self._string_codes.setdefault(value, len(self.strings))
+                self.strings.append(value)
+                self._strings_bytes += len(line)
+        if not incremental and os.path.getsize(path) != self._strings_bytes:
+            os.truncate(path, self._strings_bytes)
+    
+    def _ensure_mapped(self) -> None:
+        if self._mapped != self._count:
+            with self._lock:
+                self._remap()
+    
+    def _remap(self) -> None:
+        count = self._count
+        for name, dtype in COLUMNS.items():
+            if count == 0:
+                self._columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                self._columns[name] = np.memmap(self._path(f"{name}.col"), dtype=dtype, mode='r', shape=(count,))
+        self._text = self._map_blob(TEXT_FILE)
+        self._extra = self._map_blob(EXTRA_FILE)
+        self._mapped = count
+    
+    def _map_blob(self, name: str) -> Optional[np.memmap]:
+        path = self._path(name)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        return np.memmap(path, dtype=np.uint8, mode='r')
+    
+    @staticmethod
+    def _slice(blob: Optional[np.memmap], ends: np.ndarray, vector_id: int) -> bytes:
+        end = int(ends[vector_id])
+        start = int(ends[vector_id - 1]) if vector_id > 0 else 0
+        if blob is None or start == end:
+            return b''
+        return blob[start:end].tobytes()
+    
+    def _write(self, name: str, data: bytes) -> None:
+        with open(self._path(name), 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
@@ -0,0 +1,77 @@
+from typing import Optional, Tuple
+
+from core.config import settings
+from services.embedding_service import EmbeddingService
+from services.embedding_scheduler import EmbeddingScheduler
+from services.vector_store import VectorStore
+from services.sharded_vector_store import ShardedVectorStore
+from services.llm_service import LLMService, MockLLMService
+from services.job_queue import IngestionJobQueue
+from services.answer_cache import SemanticAnswerCache
+from services.reranker import CrossEncoderReranker
+
+
+class ServiceContainer:
+    """服务容器 - 在应用生命周期内共享已加载、已预热的服务实例"""
+    
+    def __init__(self):
+        self.embedding_service: Optional[EmbeddingService] = None
+        self.embedding_scheduler: Optional[EmbeddingScheduler] = None
+        self.vector_store: Optional[VectorStore] = None
+        self.llm_service: Optional[LLMService] = None
+        self.job_queue: Optional[IngestionJobQueue] = None
+        self.answer_cache: Optional[SemanticAnswerCache] = None
+        self.reranker: Optional[CrossEncoderReranker] = None
+        self.ready = False
+    
+    def startup(self) -> None:
+        """预加载嵌入模型、加载持久化索引并执行一次预热编码"""
+        self._build()
+        if settings.embedding_warmup:
+            self.embedding_service.warmup()
+        if settings.rerank_enabled:
+            self.reranker.load()
+            if settings.embedding_warmup:
+                self.reranker.warmup()
+        self.job_queue.start()
+        self.ready = True
+    
+    def shutdown(self) -> None:
+        self.ready = False
+        if self.job_queue is not None:
+            self.job_queue.stop()
+        if isinstance(self.vector_store, ShardedVectorStore):
+            self.vector_store.close()
+    
+    def get_services(self) -> Tuple[EmbeddingService, VectorStore, LLMService]:
+        if self.vector_store is None:
+            self._build()
+        return self.embedding_service, self.vector_store, self.llm_service
+    
+    def _build(self) -> None:
+        if self.embedding_service is None:
+            self.embedding_service = EmbeddingService()
+            self.embedding_service.load()
+            self.embedding_scheduler = EmbeddingScheduler(self.embedding_service)
+        
+        if self.vector_store is None:
+            if settings.vector_store_shards > 0:
+                self.vector_store = ShardedVectorStore(self.embedding_service)
+            else:
+                self.vector_store = VectorStore(self.embedding_service)
+            self.vector_store.load()
+            self.job_queue = IngestionJobQueue(self.vector_store)
+            
+            capacity = settings.answer_cache_size if settings.answer_cache_enabled else 0
+            self.answer_cache = SemanticAnswerCache(self.vector_store.dimension, capacity=capacity)
+            self.vector_store.add_change_listener(self.answer_cache.invalidate)
+        
+        if self.reranker is None:
+            # 模型在首次重排 (或 RERANK_ENABLED 时在启动阶段) 才加载
+            self.reranker = CrossEncoderReranker()
+        
+        if self.llm_service is None:
+            self.llm_service = MockLLMService() if settings.llm_mock else LLMService()
+
+
+container = ServiceContainer()
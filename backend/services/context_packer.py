@@ -0,0 +1,192 @@
+import re
+import math
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from core.config import settings
+from services.lexical_index import CJK_RANGES
+from services.metrics import TOKENS
+
+
+# 无 tiktoken 时的估算：CJK 字符约 1 token/字，拉丁词约 4 字符/token，其余符号各 1 token
+CJK_CHAR_PATTERN = re.compile(rf'[{CJK_RANGES}]')
+WORD_PATTERN = re.compile(r'[A-Za-z0-9_]+')
+SYMBOL_PATTERN = re.compile(rf'[^\sA-Za-z0-9_{CJK_RANGES}]')
+# 分块时句子以这些字符结尾，再以空格连接 (无 overlap_chars 元数据的旧文本块按此对齐重叠)
+SENTENCE_END_PATTERN = re.compile(r'[。！？\n] ')
+
+
+class TokenCounter:
+    """快速 token 计数 - 优先使用 tiktoken，未安装时按字符类别估算"""
+    
+    def __init__(self, encoding_name: Optional[str] = None):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name or settings.context_tokenizer)
+            except Exception:
+                self.encoding = None
+    
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        words = sum(math.ceil(len(word) / 4) for word in WORD_PATTERN.findall(text))
+        return len(CJK_CHAR_PATTERN.findall(text)) + words + len(SYMBOL_PATTERN.findall(text))
+    
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """批量计数；tiktoken 可一次编码整批文本"""
+        if self.encoding is not None:
+            return [len(tokens) for tokens in self.encoding.encode_batch(texts, disallowed_special=())]
+        return [self.count(text) for text in texts]
+
+
+def chunk_position(chunk: dict) -> Tuple[str, Optional[int]]:
+    """由 chunk_id ({document_id}_chunk_{n}) 解析文档 ID 与块序号"""
+    chunk_id = chunk.get('chunk_id', '')
+    document_id, _, index = chunk_id.rpartition('_chunk_')
+    document_id = chunk.get('metadata', {}).get('document_id') or document_id or chunk_id
+    return document_id, int(index) if index.isdigit() else None
+
+
+def sentence_overlap(previous: str, following: str) -> int:
+    """following 开头与 previous 结尾重复的长度 (按句子边界对齐)，即分块时带入的重叠句"""
+    overlap = 0
+    for match in SENTENCE_END_PATTERN.finditer(following):
+        prefix = following[:match.end() - 1]
+        if len(prefix) > len(previous):
+            break
+        if previous.endswith(prefix):
+            overlap = len(prefix)
+    return overlap
+
+
+def chunk_overlap(previous: str, following: dict) -> int:
+    """following 块开头与 previous 结尾重复的字符数：优先用分块时记录的 overlap_chars，旧文本块按句子边界匹配"""
+    content = following.get('content', '')
+    overlap = following.get('metadata', {}).get('overlap_chars')
+    if overlap is None:
+        return sentence_overlap(previous, content)
+    return overlap if overlap and previous.endswith(content[:overlap]) else 0
+
+
+class ContextPacker:
+    """上下文打包 - 按检索得分在 token 预算内选取文本块，合并同一文档的相邻块并去掉重叠句
+
+    每个块的成本只计入与已选相邻块不重复的部分；最终按段落中最高得分块的名次输出。
+    """
+    
+    def __init__(self, token_budget: Optional[int] = None, token_counter: Optional[TokenCounter] = None):
+        self.token_budget = settings.context_token_budget if token_budget is None else token_budget
+        self.token_counter = token_counter or TokenCounter()
+    
+    def pack(self, chunks: List[dict]) -> List[dict]:
+        """chunks 按得分从高到低排列，返回合并后的段落 [{'content', 'metadata'}]"""
+        selected: Dict[Tuple[str, int], Tuple[int, dict]] = {}
+        seen_contents = set()
+        used = 0
+        
+        for rank, chunk in enumerate(chunks):
+            content = chunk.get('content', '')
+            document_id, index = chunk_position(chunk)
+            # 无法解析块序号的块用负数占位，不与其他块合并
+            key = (document_id, index if index is not None else -rank - 1)
+            if not content or content in seen_contents or key in selected:
+                continue
+            
+            cost = self.token_counter.count(content) - self._shared_tokens(key, chunk, selected)
+            if used + cost > self.token_budget:
+                if not selected:
+                    # 预算连一个块都放不下时，截断得分最高的块
+                    selected[key] = (rank, {**chunk, 'content': self._truncate(content, self.token_budget)})
+                    break
+                continue
+            
+            selected[key] = (rank, chunk)
+            seen_contents.add(content)
+            used += cost
+        
+        TOKENS.inc(used, type='context')
+        return self._merge(selected)
+    
+    def _shared_tokens(
+        self,
+        key: Tuple[str, int],
+        chunk: dict,
+        selected: Dict[Tuple[str, int], Tuple[int, dict]]
+    ) -> int:
+        document_id, index = key
+        if index < 0:
+            return 0
+        
+        content = chunk.get('content', '')
+        shared = 0
+        previous = selected.get((document_id, index - 1))
+        if previous is not None:
+            overlap = chunk_overlap(previous[1]['content'], chunk)
+            shared += self.token_counter.count(content[:overlap])
+        following = selected.get((document_id, index + 1))
+        if following is not None:
+            overlap = chunk_overlap(content, following[1])
+            shared += self.token_counter.count(following[1]['content'][:overlap])
+        return shared
+    
+    def _merge(self, selected: Dict[Tuple[str, int], Tuple[int, dict]]) -> List[dict]:
+        passages: List[Tuple[int, dict]] = []
+        run: List[Tuple[int, dict]] = []
+        last_key: Optional[Tuple[str, int]] = None
+        
+        for key in sorted(selected):
+            adjacent = (last_key is not None and last_key[1] >= 0
+                        and key[0] == last_key[0] and key[1] == last_key[1] + 1)
+            if run and not adjacent:
+                passages.append(self._join(run))
+                run = []
+            run.append(selected[key])
+            last_key = key
+        if run:
+            passages.append(self._join(run))
+        
+        passages.sort(key=lambda item: item[0])
+        return [passage for _, passage in passages]
+    
+    def _join(self, run: List[Tuple[int, dict]]) -> Tuple[int, dict]:
+        first = run[0][1]
+        content = first.get('content', '')
+        for _, chunk in run[1:]:
+            following = chunk.get('content', '')
+            overlap = chunk_overlap(content, chunk)
+            # 重叠部分之后紧接原文中的分隔空格 (超长句的切分窗口则直接续接)
+            content = content + following[overlap:] if overlap else f"{content} {following}"
+        
+        metadata = dict(first.get('metadata', {}))
+        metadata['chunk_ids'] = [chunk.get('chunk_id', '') for _, chunk in run]
+        last_metadata = run[-1][1].get('metadata', {})
+        if 'page_end' in last_metadata:
+            metadata['page_end'] = last_metadata['page_end']
+        return min(rank for rank, _ in run), {'content': content, 'metadata': metadata}
+    
+    def _truncate(self, content: str, budget: int) -> str:
+        """按句子截断到预算以内；单句超出预算时按字符二分截断"""
+        truncated = ''
+        for match in SENTENCE_END_PATTERN.finditer(content + ' '):
+            candidate = content[:match.end() - 1]
+            if self.token_counter.count(candidate) > budget:
+                break
+            truncated = candidate
+        if truncated:
+            return truncated
+        
+        low, high = 0, len(content)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.token_counter.count(content[:middle]) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return content[:low]
@@ -1,8 +1,14 @@
 import os
+import json
 import re
-from typing import List
+import bisect
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 from pathlib import Path
 
+import numpy as np
+
+from services.metrics import CHUNKS, timed
+
 try:
     import PyPDF2
 except ImportError:
@@ -14,16 +20,41 @@ except ImportError:
     docx = None
 
 
+# 分块输入片段：纯文本，或 (页码, 文本)
+Piece = Union[str, Tuple[Optional[int], str]]
+
+# 句末标点 (另以换行分句)
+SENTENCE_END_MARKS = '。！？'
+LENGTH_UNITS = ('chars', 'tokens')
+NO_PAGE = -1
+
+
 class DocumentParser:
     """文档解析器 - 支持多种格式转换为纯文本"""
     
+    # 流式读取纯文本时每个片段的目标字符数
+    PIECE_SIZE = 64 * 1024
+    
     @staticmethod
+    @timed('parse')
     def parse_file(file_path: str, content_type: str) -> str:
+        return '\n'.join(DocumentParser.iter_file(file_path, content_type))
+    
+    @staticmethod
+    def iter_pages(file_path: str, content_type: str) -> Iterator[Tuple[Optional[int], str]]:
+        """产出 (页码, 文本) 片段；只有 PDF 带页码 (从 1 开始)，其余格式页码为 None"""
+        if content_type == 'application/pdf':
+            return DocumentParser.iter_pdf_pages(file_path)
+        return ((None, piece) for piece in DocumentParser.iter_file(file_path, content_type))
+    
+    @staticmethod
+    def iter_file(file_path: str, content_type: str) -> Iterator[str]:
+        """按页/段落逐片产出文本，片段之间相当于以换行连接"""
         parsers = {
-            'text/plain': DocumentParser.parse_txt,
-            'application/pdf': DocumentParser.parse_pdf,
-            'text/markdown': DocumentParser.parse_markdown,
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document': DocumentParser.parse_docx,
+            'text/plain': DocumentParser.iter_txt,
+            'application/pdf': DocumentParser.iter_pdf,
+            'text/markdown': DocumentParser.iter_markdown,
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document': DocumentParser.iter_docx,
         }
         
         parser = parsers.get(content_type)
@@ -33,116 +64,356 @@ class DocumentParser:
         return parser(file_path)
     
     @staticmethod
-    def parse_txt(file_path: str) -> str:
+    def iter_txt(file_path: str) -> Iterator[str]:
         with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+            yield from DocumentParser._iter_line_pieces(f)
     
     @staticmethod
-    def parse_markdown(file_path: str) -> str:
+    def iter_markdown(file_path: str) -> Iterator[str]:
         with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        content = re.sub(r'^#{1,6}\s+', '', content, flags=re.MULTILINE)
-        content = re.sub(r'\*\*([^*]+)\*\*', r'\1', content)
-        content = re.sub(r'\*([^*]+)\*', r'\1', content)
-        content = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', content)
-        content = re.sub(r'```[\s\S]*?```', '', content)
-        content = re.sub(r'`([^`]+)`', r'\1', content)
-        return content
+            yield from DocumentParser._iter_line_pieces(DocumentParser._strip_markdown_lines(f))
     
     @staticmethod
-    def parse_pdf(file_path: str) -> str:
+    def iter_pdf(file_path: str) -> Iterator[str]:
+        for _, text in DocumentParser.iter_pdf_pages(file_path):
+            yield text
+    
+    @staticmethod
+    def iter_pdf_pages(file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """逐页提取 PDF 文本，可只处理 [start, end) 页区间，页码从 1 开始"""
         if PyPDF2 is None:
             raise ImportError("请安装 PyPDF2: pip install PyPDF2")
         
-        text_parts = []
         with open(file_path, 'rb') as f:
             reader = PyPDF2.PdfReader(f)
-            for page in reader.pages:
-                text_parts.append(page.extract_text())
+            end = len(reader.pages) if end is None else min(end, len(reader.pages))
+            for page_index in range(start, end):
+                yield page_index + 1, reader.pages[page_index].extract_text()
+    
+    @staticmethod
+    def pdf_page_count(file_path: str) -> int:
+        if PyPDF2 is None:
+            raise ImportError("请安装 PyPDF2: pip install PyPDF2")
         
-        return '\n'.join(text_parts)
+        with open(file_path, 'rb') as f:
+            return len(PyPDF2.PdfReader(f).pages)
     
     @staticmethod
-    def parse_docx(file_path: str) -> str:
+    def iter_docx(file_path: str) -> Iterator[str]:
         if docx is None:
             raise ImportError("请安装 python-docx: pip install python-docx")
         
         doc = docx.Document(file_path)
-        paragraphs = [para.text for para in doc.paragraphs]
-        return '\n'.join(paragraphs)
+        for para in doc.paragraphs:
+            yield para.text
+    
+    @staticmethod
+    def _iter_line_pieces(lines: Iterable[str]) -> Iterator[str]:
+        """把若干整行合并为约 PIECE_SIZE 大小的片段，片段边界总落在换行处"""
+        buffer = []
+        size = 0
+        for line in lines:
+            line = line.rstrip('\n')
+            buffer.append(line)
+            size += len(line) + 1
+            if size >= DocumentParser.PIECE_SIZE:
+                yield '\n'.join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield '\n'.join(buffer)
+    
+    @staticmethod
+    def _strip_markdown_lines(lines: Iterable[str]) -> Iterator[str]:
+        in_code_block = False
+        for line in lines:
+            line = re.sub(r'```.*?```', '', line)
+            if line.lstrip().startswith('```'):
+                in_code_block = not in_code_block
+                continue
+            if in_code_block:
+                continue
+            line = re.sub(r'^#{1,6}\s+', '', line)
+            line = re.sub(r'\*\*([^*]+)\*\*', r'\1', line)
+            line = re.sub(r'\*([^*]+)\*', r'\1', line)
+            line = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', line)
+            line = re.sub(r'`([^`]+)`', r'\1', line)
+            yield line
+    
+    @staticmethod
+    def parse_txt(file_path: str) -> str:
+        return '\n'.join(DocumentParser.iter_txt(file_path))
+    
+    @staticmethod
+    def parse_markdown(file_path: str) -> str:
+        return '\n'.join(DocumentParser.iter_markdown(file_path))
+    
+    @staticmethod
+    def parse_pdf(file_path: str) -> str:
+        return '\n'.join(DocumentParser.iter_pdf(file_path))
+    
+    @staticmethod
+    def parse_docx(file_path: str) -> str:
+        return '\n'.join(DocumentParser.iter_docx(file_path))
 
 
 class TextChunker:
-    """文本分块处理器 - 将长文本分割成重叠的小块"""
+    """文本分块处理器 - 将长文本分割成重叠的小块
+
+    句子边界只计算一次：每个片段的句子以空格连接进待处理缓冲区，句子的起止位置与长度存为数组，
+    按累积长度二分查找确定块窗口；块内容是缓冲区的一个切片，不再逐块拼接句子。
+    长度单位可以是字符 (chars) 或 token (tokens)，相邻块按 chunk_overlap 重叠完整的句子。
+    """
     
-    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50):
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50, length_unit: str = 'chars'):
+        if length_unit not in LENGTH_UNITS:
+            raise ValueError(f"不支持的分块长度单位: {length_unit}")
         self.chunk_size = chunk_size
-        self.chunk_overlap = chunk_overlap
+        self.chunk_overlap = max(0, min(chunk_overlap, chunk_size - 1))
+        self.length_unit = length_unit
+        self._token_counter = None
     
+    @timed('chunk')
     def chunk_text(self, text: str, document_id: str) -> List[dict]:
-        sentences = self._split_into_sentences(text)
+        chunks = list(self.iter_chunks([text], document_id))
+        CHUNKS.inc(len(chunks), operation='chunked')
+        return chunks
+    
+    def iter_chunks(self, pieces: Iterable[Piece], document_id: str) -> Iterator[dict]:
+        """流式分块：逐片切分句子并产出文本块，片段之间视为换行
         
-        chunks = []
-        current_chunk = []
-        current_length = 0
-        chunk_id = 0
+        片段可以是纯文本，也可以是 (页码, 文本)；带页码时块元数据中记录 page_start/page_end。
+        块 ID 按产出顺序编号，同样的输入与参数得到同样的 ID。
+        """
+        for number, (content, metadata) in enumerate(self._iter_windows(pieces)):
+            yield {
+                'chunk_id': f"{document_id}_chunk_{number}",
+                'content': content,
+                'metadata': metadata
+            }
+    
+    def iter_document_chunks(self, pieces: Iterable[Piece], document_id: str, filename: str) -> Iterator[dict]:
+        """流式分块并附加文档来源元数据"""
+        for chunk in self.iter_chunks(pieces, document_id):
+            chunk['metadata'].update({
+                'document_id': document_id,
+                'filename': filename,
+                'source': filename
+            })
+            yield chunk
+    
+    def _iter_windows(self, pieces: Iterable[Piece]) -> Iterator[Tuple[str, dict]]:
+        buffer = _SentenceBuffer()
+        for piece in pieces:
+            page, text = piece if isinstance(piece, tuple) else (None, piece)
+            sentences = self._split_into_sentences(text)
+            if sentences:
+                buffer.extend(sentences, self._measure(sentences), page)
+                yield from self._drain(buffer, final=False)
+        yield from self._drain(buffer, final=True)
+    
+    def _drain(self, buffer: "_SentenceBuffer", final: bool) -> Iterator[Tuple[str, dict]]:
+        """产出缓冲区中已能确定边界的块；非 final 时最后一个窗口可能还会并入后续句子，留待下次"""
+        # 累积长度一次算好，逐块的边界查找用 bisect 在列表上进行，避免 numpy 标量开销
+        sizes = buffer.sizes.tolist()
+        count = len(sizes)
+        cumulative = [0] + np.cumsum(buffer.sizes).tolist()
+        long_sentences = np.flatnonzero(buffer.sizes > self.chunk_size).tolist()
+        first = 0
         
-        for sentence in sentences:
-            sentence_length = len(sentence)
-            
-            if sentence_length > self.chunk_size:
-                if current_chunk:
-                    chunks.append(self._create_chunk(current_chunk, document_id, chunk_id))
-                    chunk_id += 1
-                    current_chunk = []
-                    current_length = 0
-                
-                sub_chunks = self._split_long_sentence(sentence, document_id, chunk_id)
-                chunks.extend(sub_chunks)
-                chunk_id += len(sub_chunks)
+        while first < count:
+            if sizes[first] > self.chunk_size:
+                yield from self._split_long_sentence(buffer, first)
+                buffer.overlap = 0
+                first += 1
                 continue
             
-            if current_length + sentence_length > self.chunk_size and current_chunk:
-                chunks.append(self._create_chunk(current_chunk, document_id, chunk_id))
-                chunk_id += 1
-                
-                overlap_text = current_chunk[-2:] if len(current_chunk) >= 2 else current_chunk
-                current_chunk = overlap_text
-                current_length = sum(len(s) for s in overlap_text)
+            # 窗口 [first, end)：累积长度不超过 chunk_size，且不跨过超长句
+            end = bisect.bisect_right(cumulative, cumulative[first] + self.chunk_size) - 1
+            next_long = bisect.bisect_left(long_sentences, first)
+            if next_long < len(long_sentences):
+                end = min(end, long_sentences[next_long])
+            if end >= count and not final:
+                break
+            
+            content, metadata = buffer.window(first, end)
+            metadata['overlap_chars'] = buffer.overlap
+            yield content, metadata
+            if end >= count or sizes[end] > self.chunk_size:
+                # 超长句前后的块之间不重叠
+                buffer.overlap = 0
+                first = end
+                continue
             
-            current_chunk.append(sentence)
-            current_length += sentence_length
+            # 重叠：从末尾带入总长不超过 chunk_overlap 的句子，并保证下一句放得进新窗口
+            overlap_start = bisect.bisect_left(cumulative, cumulative[end] - self.chunk_overlap)
+            fit_start = bisect.bisect_left(cumulative, cumulative[end + 1] - self.chunk_size)
+            first = max(overlap_start, fit_start, first + 1)
+            buffer.overlap = int(buffer.ends[end - 1] - buffer.starts[first]) if first < end else 0
         
-        if current_chunk:
-            chunks.append(self._create_chunk(current_chunk, document_id, chunk_id))
+        buffer.consume(first)
+    
+    def _split_long_sentence(self, buffer: "_SentenceBuffer", index: int) -> Iterator[Tuple[str, dict]]:
+        """按固定窗口切分超出 chunk_size 的句子，相邻窗口重叠 chunk_overlap；每个窗口都是独立编号的块"""
+        text = buffer.sentence(index)
+        # token 单位时按该句的平均字符/token 比例换算窗口
+        ratio = len(text) / max(int(buffer.sizes[index]), 1)
+        window = max(1, int(self.chunk_size * ratio))
+        step = max(1, int((self.chunk_size - self.chunk_overlap) * ratio))
+        page = buffer.page(index)
         
-        return chunks
+        for position in range(0, len(text), step):
+            # 相邻窗口重叠 window - step 个字符
+            overlap = max(0, window - step) if position else 0
+            metadata = {'position': position, 'is_split': True, 'overlap_chars': overlap}
+            if page is not None:
+                metadata.update({'page_start': page, 'page_end': page})
+            yield text[position:position + window], metadata
+            if position + window >= len(text):
+                break
+    
+    def _measure(self, sentences: List[str]) -> np.ndarray:
+        if self.length_unit == 'chars':
+            return np.fromiter(map(len, sentences), dtype=np.int64, count=len(sentences))
+        if self._token_counter is None:
+            # 按需导入：只按字符分块的解析进程不加载配置与分词器
+            from services.context_packer import TokenCounter
+            self._token_counter = TokenCounter()
+        return np.array(self._token_counter.count_batch(sentences), dtype=np.int64)
     
     def _split_into_sentences(self, text: str) -> List[str]:
-        sentences = re.split(r'([。！？\n])', text)
-        result = []
-        for i in range(0, len(sentences) - 1, 2):
-            if i + 1 < len(sentences):
-                result.append(sentences[i] + sentences[i + 1])
-            else:
-                result.append(sentences[i])
-        return [s.strip() for s in result if s.strip()]
-    
-    def _split_long_sentence(self, text: str, document_id: str, start_id: int) -> List[dict]:
-        chunks = []
-        for i in range(0, len(text), self.chunk_size):
-            chunk_text = text[i:i + self.chunk_size]
-            chunks.append({
-                'chunk_id': f"{document_id}_chunk_{start_id}",
-                'content': chunk_text,
-                'metadata': {'position': i, 'is_split': True}
-            })
-        return chunks
+        """按 。！？ 与换行切句并去掉首尾空白：在句末标点后补换行，整体按行切分 (都在 C 层完成)"""
+        for mark in SENTENCE_END_MARKS:
+            text = text.replace(mark, mark + '\n')
+        return [sentence for sentence in map(str.strip, text.split('\n')) if sentence]
+
+
+class _SentenceBuffer:
+    """待分块的句子：text 为以空格连接的句子，starts/ends/sizes/pages 为逐句数组
+
+    overlap 为下一个块开头与上一个已产出的块重复的字符数，写入块元数据 overlap_chars，供上下文打包去重。
+    """
     
-    def _create_chunk(self, sentences: List[str], document_id: str, chunk_id: int) -> dict:
-        content = ' '.join(sentences)
-        return {
-            'chunk_id': f"{document_id}_chunk_{chunk_id}",
-            'content': content,
-            'metadata': {'char_count': len(content), 'sentence_count': len(sentences)}
-        }
+    def __init__(self):
+        self.text = ''
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.ends = np.zeros(0, dtype=np.int64)
+        self.sizes = np.zeros(0, dtype=np.int64)
+        self.pages = np.zeros(0, dtype=np.int64)
+        self.paged = False
+        self.overlap = 0
+    
+    def extend(self, sentences: List[str], sizes: np.ndarray, page: Optional[int]) -> None:
+        offset = len(self.text) + 1 if self.text else 0
+        lengths = np.fromiter(map(len, sentences), dtype=np.int64, count=len(sentences))
+        starts = offset + np.concatenate(([0], np.cumsum(lengths[:-1] + 1)))
+        
+        self.text = f"{self.text} {' '.join(sentences)}" if self.text else ' '.join(sentences)
+        self.starts = np.concatenate((self.starts, starts))
+        self.ends = np.concatenate((self.ends, starts + lengths))
+        self.sizes = np.concatenate((self.sizes, sizes))
+        self.pages = np.concatenate((self.pages, np.full(len(sentences), NO_PAGE if page is None else page)))
+        self.paged = self.paged or page is not None
+    
+    def window(self, first: int, end: int) -> Tuple[str, dict]:
+        """句子 [first, end) 组成的块：内容为缓冲区切片"""
+        content = self.text[int(self.starts[first]):int(self.ends[end - 1])]
+        metadata = {'char_count': len(content), 'sentence_count': end - first}
+        if self.paged:
+            pages = self.pages[first:end]
+            pages = pages[pages != NO_PAGE]
+            if len(pages):
+                metadata.update({'page_start': int(pages[0]), 'page_end': int(pages[-1])})
+        return content, metadata
+    
+    def sentence(self, index: int) -> str:
+        return self.text[self.starts[index]:self.ends[index]]
+    
+    def page(self, index: int) -> Optional[int]:
+        page = int(self.pages[index])
+        return None if page == NO_PAGE else page
+    
+    def consume(self, count: int) -> None:
+        """丢弃前 count 个句子，缓冲区只保留其后的文本"""
+        if count == 0:
+            return
+        if count >= len(self.starts):
+            self.__init__()
+            return
+        
+        shift = self.starts[count]
+        self.text = self.text[shift:]
+        self.starts = self.starts[count:] - shift
+        self.ends = self.ends[count:] - shift
+        self.sizes = self.sizes[count:]
+        self.pages = self.pages[count:]
+
+
+def chunk_file_to_spool(
+    file_path: str,
+    content_type: str,
+    document_id: str,
+    filename: str,
+    spool_path: str,
+    chunk_size: int = 500,
+    chunk_overlap: int = 50,
+    length_unit: str = 'chars'
+) -> int:
+    """解析并分块文件，将文本块逐行写入 JSONL 暂存文件，返回块数
+
+    供进程池调用：只依赖标准库与解析库，结果经磁盘传递以保持内存占用平稳。
+    """
+    pieces = DocumentParser.iter_pages(file_path, content_type)
+    return _write_chunk_spool(pieces, document_id, filename, spool_path, chunk_size, chunk_overlap, length_unit)
+
+
+def extract_pdf_range(file_path: str, start: int, end: int, part_path: str) -> int:
+    """提取 PDF 的 [start, end) 页，按 (页码, 文本) 写入分片文件，返回页数 (供进程池并行调用)"""
+    count = 0
+    with open(part_path, 'w', encoding='utf-8') as f:
+        for page, text in DocumentParser.iter_pdf_pages(file_path, start, end):
+            f.write(json.dumps([page, text], ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def chunk_parts_to_spool(
+    part_paths: List[str],
+    document_id: str,
+    filename: str,
+    spool_path: str,
+    chunk_size: int = 500,
+    chunk_overlap: int = 50,
+    length_unit: str = 'chars'
+) -> int:
+    """按顺序读取各页区间的分片文件，拼接后分块写入暂存文件"""
+    def iter_parts() -> Iterator[Tuple[Optional[int], str]]:
+        for part_path in part_paths:
+            with open(part_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    page, text = json.loads(line)
+                    yield page, text
+    
+    return _write_chunk_spool(iter_parts(), document_id, filename, spool_path, chunk_size, chunk_overlap, length_unit)
+
+
+def _write_chunk_spool(
+    pieces: Iterable[Piece],
+    document_id: str,
+    filename: str,
+    spool_path: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    length_unit: str
+) -> int:
+    chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_unit=length_unit)
+    count = 0
+    
+    with open(spool_path, 'w', encoding='utf-8') as f:
+        for chunk in chunker.iter_document_chunks(pieces, document_id, filename):
+            f.write(json.dumps(chunk, ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    
+    return count
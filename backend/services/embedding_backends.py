@@ -0,0 +1,153 @@
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from core.config import settings
+
+
+# EMBEDDING_BACKEND 可选值
+EMBEDDING_BACKENDS = ('torch', 'onnx')
+# ONNX 模型目录或其上一级目录中的 HuggingFace 快速分词器文件
+TOKENIZER_FILE = 'tokenizer.json'
+
+
+class SentenceTransformerBackend:
+    """PyTorch 推理 - sentence-transformers 的参考实现
+
+    import 推迟到首次加载：选用 ONNX 后端时进程不加载 torch。
+    """
+    
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("请安装 sentence-transformers: pip install sentence-transformers")
+        self.model = SentenceTransformer(model_name)
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, convert_to_numpy=True)
+
+
+class OnnxBackend:
+    """ONNX Runtime CPU 推理 - 运行导出 (或 int8 动态量化) 的 ONNX 模型
+
+    按 token 长度排序后分批 (长度分桶)，每批只填充到批内最长序列 (动态填充)；
+    模型只输出 token 向量时按 attention_mask 做均值池化，结果 L2 归一化。
+    """
+    
+    def __init__(
+        self,
+        model_path: str,
+        tokenizer_path: Optional[str] = None,
+        intra_op_threads: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        max_seq_length: Optional[int] = None
+    ):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError("请安装 onnxruntime 与 tokenizers: pip install onnxruntime tokenizers")
+        
+        self.model_path = model_path
+        self.batch_size = batch_size or settings.embedding_onnx_batch_size
+        self.max_seq_length = max_seq_length or settings.embedding_max_seq_length
+        
+        options = onnxruntime.SessionOptions()
+        threads = settings.embedding_intra_op_threads if intra_op_threads is None else intra_op_threads
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        # 单个模型串行执行，并行只发生在算子内部
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        
+        self.tokenizer = Tokenizer.from_file(tokenizer_path or find_tokenizer(model_path))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(self.max_seq_length)
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        encodings = self.tokenizer.encode_batch(texts)
+        lengths = np.array([len(encoding.ids) for encoding in encodings])
+        order = np.argsort(-lengths, kind='stable')
+        
+        embeddings = None
+        for start in range(0, len(texts), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            batch = self._run([encodings[row] for row in rows], int(lengths[rows].max()))
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            embeddings[rows] = batch
+        return embeddings
+    
+    def _run(self, encodings: list, length: int) -> np.ndarray:
+        input_ids = np.zeros((len(encodings), length), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), length), dtype=np.int64)
+        token_type_ids = np.zeros((len(encodings), length), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            size = len(encoding.ids)
+            input_ids[row, :size] = encoding.ids
+            attention_mask[row, :size] = encoding.attention_mask
+            token_type_ids[row, :size] = encoding.type_ids
+        
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask, 'token_type_ids': token_type_ids}
+        feeds = {name: value for name, value in feeds.items() if name in self.input_names}
+        
+        if 'sentence_embedding' in self.output_names:
+            pooled = self.session.run(['sentence_embedding'], feeds)[0]
+        else:
+            hidden = self.session.run(self.output_names[:1], feeds)[0]
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+def find_tokenizer(model_path: str) -> str:
+    """在模型文件所在目录及上一级查找 tokenizer.json (HuggingFace 仓库的 onnx/ 子目录布局)"""
+    directory = os.path.dirname(os.path.abspath(model_path))
+    for candidate in (directory, os.path.dirname(directory)):
+        path = os.path.join(candidate, TOKENIZER_FILE)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"未找到 {TOKENIZER_FILE}，请设置 EMBEDDING_ONNX_TOKENIZER")
+
+
+def create_backend(backend: Optional[str] = None, model_name: Optional[str] = None):
+    backend = backend or settings.embedding_backend
+    if backend == 'torch':
+        return SentenceTransformerBackend(model_name or settings.embedding_model)
+    if backend == 'onnx':
+        if not settings.embedding_onnx_path:
+            raise ValueError("EMBEDDING_BACKEND=onnx 时需设置 EMBEDDING_ONNX_PATH")
+        return OnnxBackend(settings.embedding_onnx_path, settings.embedding_onnx_tokenizer or None)
+    raise ValueError(f"未知的嵌入推理后端: {backend}，可选 {', '.join(EMBEDDING_BACKENDS)}")
+
+
+def cache_key(model_name: str, backend: Optional[str] = None) -> str:
+    """持久化嵌入缓存的模型键；ONNX 模型文件 (如 fp32 与 int8) 结果略有差异，各用一份缓存"""
+    backend = backend or settings.embedding_backend
+    if backend == 'onnx' and settings.embedding_onnx_path:
+        return f"{model_name}@onnx-{os.path.splitext(os.path.basename(settings.embedding_onnx_path))[0]}"
+    return model_name
+
+
+def cosine_parity(embeddings: np.ndarray, reference: np.ndarray) -> dict:
+    """逐行余弦相似度，衡量候选后端与参考实现的一致性"""
+    a = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    b = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    cosines = (a * b).sum(axis=1)
+    return {
+        'texts': len(cosines),
+        'min_cosine': float(cosines.min()),
+        'mean_cosine': float(cosines.mean()),
+    }
@@ -0,0 +1,184 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.metrics import record_cache_lookup
+from utils.file_lock import LOCK_FILE, exclusive_lock
+
+KEY_SIZE = 16
+
+
+def content_key(model_name: str, text: str) -> bytes:
+    """以 (模型名, 文本内容) 计算定长内容哈希"""
+    h = hashlib.blake2b(digest_size=KEY_SIZE)
+    h.update(model_name.encode('utf-8'))
+    h.update(b'\0')
+    h.update(text.encode('utf-8'))
+    return h.digest()
+
+
+class EmbeddingCache:
+    """磁盘嵌入缓存 - 内容寻址，向量以 float32 矩阵内存映射读取
+
+    多个 worker 共用同一目录：追加在文件锁 (flock) 内进行，行号由文件中已有的行数决定；
+    其他进程追加的键在写入前或查询未命中时从 keys.bin 尾部读入。
+    """
+    
+    def __init__(self, cache_dir: str, model_name: str, dimension: int):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.cache_dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9._-]+', '_', model_name))
+        self.vectors_file = os.path.join(self.cache_dir, 'vectors.f32')
+        self.keys_file = os.path.join(self.cache_dir, 'keys.bin')
+        self.lock_file = os.path.join(self.cache_dir, LOCK_FILE)
+        
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        # 已读入的文件行数 (重复写入的键只保留第一行，可能大于 len(_rows))
+        self._count = 0
+        self._vectors: Optional[np.memmap] = None
+        self._load()
+    
+    def __len__(self) -> int:
+        return len(self._rows)
+    
+    def get_many(self, texts: List[str]) -> Tuple[np.ndarray, List[int], List[bytes]]:
+        """返回 (命中向量矩阵, 未命中下标, 全部键)，未命中行填零
+
+        全部命中且行号连续递增时直接返回内存映射的只读切片 (不复制)，否则返回新数组。
+        """
+        keys = [content_key(self.model_name, text) for text in texts]
+        result = None
+        misses = []
+        
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                self._sync()
+            hit_positions = []
+            hit_rows = []
+            for i, key in enumerate(keys):
+                row = self._rows.get(key)
+                if row is None:
+                    misses.append(i)
+                else:
+                    hit_positions.append(i)
+                    hit_rows.append(row)
+            
+            if hit_rows and not misses and all(b == a + 1 for a, b in zip(hit_rows, hit_rows[1:])):
+                result = np.asarray(self._vectors[hit_rows[0]:hit_rows[-1] + 1])
+            else:
+                result = np.zeros((len(texts), self.dimension), dtype=np.float32)
+                if hit_rows:
+                    result[hit_positions] = self._vectors[hit_rows]
+        
+        record_cache_lookup('embedding', len(texts) - len(misses), len(misses))
+        return result, misses, keys
+    
+    def put_many(self, keys: List[bytes], embeddings: np.ndarray) -> None:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        
+        with self._lock, exclusive_lock(self.lock_file):
+            self._sync()
+            self._truncate_partial()
+            new_keys = []
+            new_rows = []
+            seen = set()
+            for i, key in enumerate(keys):
+                if key in self._rows or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_rows.append(i)
+            
+            if not new_keys:
+                return
+            
+            # 先写向量再写键：崩溃时多出的向量行会在加载时被截掉
+            with open(self.vectors_file, 'ab') as f:
+                f.write(embeddings[new_rows].tobytes())
+            with open(self.keys_file, 'ab') as f:
+                f.write(b''.join(new_keys))
+            
+            for offset, key in enumerate(new_keys):
+                self._rows[key] = self._count + offset
+            self._count += len(new_keys)
+            self._remap(self._count)
+    
+    def _load(self) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock, exclusive_lock(self.lock_file):
+            self._truncate_partial()
+            self._sync()
+    
+    def _committed_count(self) -> int:
+        """文件中完整的行数：先写向量再写键，有键的行一定有完整的向量"""
+        if not os.path.exists(self.keys_file) or not os.path.exists(self.vectors_file):
+            return 0
+        key_count = os.path.getsize(self.keys_file) // KEY_SIZE
+        vector_count = os.path.getsize(self.vectors_file) // (self.dimension * 4)
+        return min(key_count, vector_count)
+    
+    def _sync(self) -> None:
+        """读入其他进程追加的键 (调用方持 _lock)"""
+        count = self._committed_count()
+        if count <= self._count:
+            return
+        
+        with open(self.keys_file, 'rb') as f:
+            f.seek(self._count * KEY_SIZE)
+            raw = f.read((count - self._count) * KEY_SIZE)
+        for offset in range(count - self._count):
+            self._rows.setdefault(raw[offset * KEY_SIZE:(offset + 1) * KEY_SIZE], self._count + offset)
+        self._count = count
+        self._remap(count)
+    
+    def _truncate_partial(self) -> None:
+        """截掉写入中途崩溃留下的不完整行 (调用方持文件锁)"""
+        count = self._committed_count()
+        for path, row_bytes in ((self.keys_file, KEY_SIZE), (self.vectors_file, self.dimension * 4)):
+            if os.path.exists(path) and os.path.getsize(path) != count * row_bytes:
+                os.truncate(path, count * row_bytes)
+    
+    def _remap(self, count: int) -> None:
+        if count == 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(self.vectors_file, dtype=np.float32, mode='r',
+                                  shape=(count, self.dimension))
+
+
+class QueryEmbeddingCache:
+    """查询向量 LRU 缓存 - 容量有限的内存缓存，保存热点查询的嵌入"""
+    
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get(self, text: str, record: bool = True) -> Optional[np.ndarray]:
+        """record=False 时不计入命中率 (调用方未命中后还会再查一次)"""
+        with self._lock:
+            embedding = self._entries.get(text)
+            if embedding is not None:
+                self._entries.move_to_end(text)
+        if record and self.capacity > 0:
+            hit = embedding is not None
+            record_cache_lookup('query_embedding', int(hit), int(not hit))
+        return embedding
+    
+    def put(self, text: str, embedding: np.ndarray) -> None:
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[text] = embedding
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
@@ -0,0 +1,108 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+from services.metrics import record_cache_lookup, timed
+
+
+class EmbeddingScheduler:
+    """嵌入微批调度器 - 将并发的查询编码请求合并为一次批量 encode 调用"""
+    
+    def __init__(
+        self,
+        embedding_service,
+        max_batch_size: Optional[int] = None,
+        batch_window_ms: Optional[float] = None
+    ):
+        self.embedding_service = embedding_service
+        self.max_batch_size = max_batch_size or settings.embedding_batch_max_size
+        self.batch_window = (batch_window_ms if batch_window_ms is not None
+                             else settings.embedding_batch_window_ms) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+    
+    async def start(self) -> None:
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        # 单线程执行器：模型内部已多线程，串行化批次避免线程争抢
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
+        self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+        
+        self._executor.shutdown(wait=False)
+        self._executor = None
+    
+    @timed('query_embed')
+    async def embed_text(self, text: str) -> np.ndarray:
+        # 未命中的查询在编码线程里还会查一次缓存，由那一次计数
+        cached = self.embedding_service.query_cache.get(text, record=False)
+        if cached is not None:
+            record_cache_lookup('query_embedding', 1)
+            return cached
+        
+        if self._worker is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+    
+    @timed('query_embed')
+    async def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """整批编码 (如批量检索)，作为一个批次提交给同一个模型线程，不再拆分合批"""
+        if self._worker is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.embedding_service.embed_queries, texts)
+    
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch(loop)
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = await loop.run_in_executor(
+                    self._executor, self.embedding_service.embed_queries, texts
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for row, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(embeddings[row])
+    
+    async def _collect_batch(self, loop) -> List[Tuple[str, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_window
+        
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        
+        return batch
@@ -1,58 +1,167 @@
+import os
 from typing import List, Optional
 import numpy as np
 
-try:
-    from sentence_transformers import SentenceTransformer
-    SENTENCE_TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    SENTENCE_TRANSFORMERS_AVAILABLE = False
-
 from core.config import settings
+from services.embedding_backends import cache_key, create_backend
+from services.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+from services.metrics import EMBEDDED_TEXTS, timed
 
 
 class EmbeddingService:
-    """文本向量化服务 - 将文本转换为向量表示"""
+    """文本向量化服务 - 将文本转换为向量表示；推理后端由 EMBEDDING_BACKEND 选择 (torch / onnx)"""
     
-    def __init__(self, model_name: Optional[str] = None):
+    def __init__(self, model_name: Optional[str] = None, backend: Optional[str] = None):
         self.model_name = model_name or settings.embedding_model
+        self.backend = backend or settings.embedding_backend
         self.dimension = settings.embedding_dimension
         self._model = None
+        self._cache: Optional[EmbeddingCache] = None
+        self.query_cache = QueryEmbeddingCache(settings.query_embedding_cache_size)
     
     @property
     def model(self):
         if self._model is None:
-            if not SENTENCE_TRANSFORMERS_AVAILABLE:
-                raise ImportError("请安装 sentence-transformers: pip install sentence-transformers")
-            self._model = SentenceTransformer(self.model_name)
+            self._model = create_backend(self.backend, self.model_name)
         return self._model
     
+    def load(self) -> None:
+        """立即加载模型，避免首个请求承担加载开销"""
+        _ = self.model
+    
+    def warmup(self) -> None:
+        self.embed_text("warmup")
+    
+    @property
+    def cache(self) -> Optional[EmbeddingCache]:
+        if self._cache is None and settings.embedding_cache_enabled:
+            cache_dir = os.path.join(settings.index_dir, 'embedding_cache')
+            self._cache = EmbeddingCache(cache_dir, cache_key(self.model_name, self.backend), self.dimension)
+        return self._cache
+    
     def embed_text(self, text: str) -> np.ndarray:
-        embedding = self.model.encode(text, convert_to_numpy=True)
+        embedding = self.query_cache.get(text)
+        if embedding is None:
+            embedding = self._encode([text])[0]
+            self.query_cache.put(text, embedding)
         return embedding
     
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """批量编码查询文本，命中 LRU 的查询不再进入模型"""
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        misses = []
+        for i, text in enumerate(texts):
+            embedding = self.query_cache.get(text)
+            if embedding is None:
+                misses.append(i)
+            else:
+                embeddings[i] = embedding
+        
+        if misses:
+            encoded = self._encode([texts[i] for i in misses])
+            for row, i in enumerate(misses):
+                embeddings[i] = encoded[row]
+                self.query_cache.put(texts[i], encoded[row])
+        
+        return embeddings
+    
     def embed_texts(self, texts: List[str]) -> np.ndarray:
-        embeddings = self.model.encode(texts, convert_to_numpy=True)
+        cache = self.cache
+        if cache is None:
+            return self._encode(texts)
+        
+        embeddings, misses, keys = cache.get_many(texts)
+        if misses:
+            encoded = self._encode([texts[i] for i in misses])
+            embeddings[misses] = encoded
+            cache.put_many([keys[i] for i in misses], encoded)
         return embeddings
     
+    @timed('embed')
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """模型编码 (缓存未命中的部分)，计入 embed 阶段耗时"""
+        EMBEDDED_TEXTS.inc(len(texts))
+        return self.model.encode(texts)
+    
     def get_embedding_dimension(self) -> int:
         return self.dimension
 
 
 class MockEmbeddingService:
-    """模拟向量化服务 - 用于测试"""
+    """模拟向量化服务 - 用于测试与离线基准
+
+    字符 1~3-gram 经固定的乘法哈希映射到维度桶并带符号累加 (feature hashing)，再归一化。
+    结果与进程、运行次数无关；共享 n-gram 越多的文本相似度越高。整批文本一次向量化计算。
+    """
+    
+    NGRAM_SIZES = (1, 2, 3)
     
     def __init__(self, dimension: int = 384):
         self.dimension = dimension
+        self.query_cache = QueryEmbeddingCache(0)
     
     def embed_text(self, text: str) -> np.ndarray:
-        np.random.seed(hash(text) % (2**32))
-        return np.random.randn(self.dimension).astype(np.float32)
+        return self.embed_texts([text])[0]
     
+    @timed('embed')
     def embed_texts(self, texts: List[str]) -> np.ndarray:
-        embeddings = []
-        for text in texts:
-            embeddings.append(self.embed_text(text))
-        return np.array(embeddings)
+        EMBEDDED_TEXTS.inc(len(texts))
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        
+        # 整批文本以 \0 连接成一个码点数组，跨越分隔符的 n-gram 丢弃；先逐条转小写 (可能改变长度，如 'İ')
+        # 分隔符位置由各文本长度确定，文本自身含 \0 时不会错位
+        texts = [text.lower() for text in texts]
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        codes = np.frombuffer('\0'.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths + 1)[:len(codes)]
+        is_separator = np.zeros(len(codes), dtype=np.int64)
+        is_separator[np.cumsum(lengths + 1)[:-1] - 1] = 1
+        separators = np.concatenate(([0], np.cumsum(is_separator)))
+        
+        bins = []
+        weights = []
+        for n in self.NGRAM_SIZES:
+            count = len(codes) - n + 1
+            if count <= 0:
+                continue
+            hashes = np.full(count, n, dtype=np.uint64)
+            for offset in range(n):
+                hashes = hashes * _HASH_MULTIPLIER + codes[offset:offset + count]
+            hashes = _mix(hashes)
+            valid = separators[n:n + count] == separators[:count]
+            
+            bins.append(rows[:count][valid] * self.dimension + (hashes[valid] % np.uint64(self.dimension)).astype(np.int64))
+            # 最高位决定符号，较长的 n-gram 权重更高
+            signs = 1.0 - 2.0 * (hashes[valid] >> np.uint64(63)).astype(np.float32)
+            weights.append(signs * n)
+        
+        embeddings = np.bincount(
+            np.concatenate(bins) if bins else np.zeros(0, dtype=np.int64),
+            weights=np.concatenate(weights) if weights else None,
+            minlength=len(texts) * self.dimension
+        ).reshape(len(texts), self.dimension).astype(np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+    
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        return self.embed_texts(texts)
+    
+    def load(self) -> None:
+        pass
+    
+    def warmup(self) -> None:
+        pass
     
     def get_embedding_dimension(self) -> int:
         return self.dimension
+
+
+_HASH_MULTIPLIER = np.uint64(0x100000001B3)
+
+
+def _mix(hashes: np.ndarray) -> np.ndarray:
+    """64 位混洗 (splitmix64 终结步)，让相近的码点组合分散到不同的桶"""
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
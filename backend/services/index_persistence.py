@@ -0,0 +1,423 @@
+import os
+import re
+import json
+import fcntl
+import pickle
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+from services.ann_index import read_index, write_index
+from services.chunk_store import ChunkStore
+from utils.file_lock import LOCK_FILE
+
+
+MANIFEST_FILE = 'manifest.json'
+VECTORS_FILE = 'vectors.f32'
+LEGACY_INDEX_FILE = 'faiss.index'
+LEGACY_CHUNKS_FILE = 'chunks.pkl'
+CHUNKS_DIR = 'chunks'
+MANIFEST_VERSION = 2
+SEGMENT_PATTERN = re.compile(r'^(base-\d+\.(index|deleted)|log-\d+\.(ids|del))$')
+LOG_SUFFIXES = ('ids', 'del')
+
+
+def _fsync_dir(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class IndexPersistence:
+    """分段索引持久化 - 基线快照 + 追加写日志，通过原子替换清单文件提交
+    
+    全精度向量按向量 ID 顺序追加到 vectors.f32，可内存映射读取，用于索引重建与训练采样。
+    文本块按同样的行号存入列式 ChunkStore；快照只记录索引与已删除的向量 ID。
+    多个进程可共用同一目录：写入在文件锁 (flock) 内基于磁盘上最新的清单进行，清单的 commit 计数每次提交加一。
+    """
+    
+    def __init__(self, index_dir: str, dimension: int):
+        self.index_dir = index_dir
+        self.dimension = dimension
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_fd: Optional[int] = None
+        self._loaded = False
+        self.manifest = self._empty_manifest()
+        self._vectors: Optional[np.memmap] = None
+        self.chunk_store = ChunkStore(self._path(CHUNKS_DIR))
+    
+    @property
+    def vectors(self) -> np.ndarray:
+        """已提交的全精度向量矩阵 (内存映射，行号即向量 ID)"""
+        if self._vectors is None:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return self._vectors
+    
+    @property
+    def pending_count(self) -> int:
+        """尚未合并进基线快照的日志向量数"""
+        return sum(log['count'] for log in self.manifest['logs'])
+    
+    @property
+    def pending_deletes(self) -> int:
+        """日志段中尚未被快照合并掉的删除标记数"""
+        return sum(log.get('deleted', 0) for log in self.manifest['logs'])
+    
+    @property
+    def generation(self) -> int:
+        return self.manifest['generation']
+    
+    @property
+    def commit(self) -> int:
+        """提交计数：每次写入清单加一，供其他进程判断是否需要跟进"""
+        return self.manifest.get('commit', 0)
+    
+    @property
+    def base_key(self) -> Optional[str]:
+        """当前基线快照的标识；变化说明有进程写入了新快照"""
+        base = self.manifest['base']
+        return base['deleted'] if base else None
+    
+    @contextmanager
+    def write_lock(self):
+        """进程间互斥的写锁 (可重入)；首次获取时从磁盘重新读取清单，保证修改基于最新的提交"""
+        with self._lock:
+            if self._lock_depth == 0:
+                os.makedirs(self.index_dir, exist_ok=True)
+                self._lock_fd = os.open(self._path(LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+                try:
+                    self._reload_manifest()
+                except Exception:
+                    self._release_file_lock()
+                    raise
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._release_file_lock()
+    
+    @property
+    def epoch(self) -> int:
+        """清空计数：索引被清空后已有的向量 ID 全部失效"""
+        return self.manifest.get('epoch', 0)
+    
+    def manifest_changed(self) -> bool:
+        """磁盘上的清单是否有本进程尚未看到的提交 (不加锁，清单文件整体原子替换)"""
+        try:
+            return self._read_manifest().get('commit', 0) != self.commit
+        except (OSError, ValueError):
+            return False
+    
+    def load(self, mmap: bool = False) -> Tuple[Optional["faiss.Index"], np.ndarray]:
+        """读取清单并返回 (基线索引, 基线中已删除的向量 ID)；日志段通过 iter_logs 回放"""
+        with self.write_lock():
+            self._load()
+        return self.read_base(mmap)
+    
+    def read_base(self, mmap: bool = False) -> Tuple[Optional["faiss.Index"], np.ndarray]:
+        """打开当前基线快照；mmap 时以只读内存映射打开索引"""
+        base = self.manifest['base']
+        if base is None:
+            return None, np.empty(0, dtype=np.int64)
+        
+        index = read_index(self._path(base['index']), mmap=mmap)
+        deleted = np.fromfile(self._path(base['deleted']), dtype=np.int64)
+        return index, deleted
+    
+    def read_deletes(self, log: dict, start: int) -> np.ndarray:
+        """读取日志段中第 start 条之后已提交的删除标记"""
+        if log.get('deleted', 0) <= start:
+            return np.empty(0, dtype=np.int64)
+        return np.fromfile(self._path(f"{log['name']}.del"), dtype=np.int64,
+                           count=log.get('deleted', 0) - start, offset=start * 8)
+    
+    def _load(self) -> None:
+        self._loaded = False
+        manifest_path = self._path(MANIFEST_FILE)
+        
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        elif (os.path.exists(self._path(LEGACY_INDEX_FILE))
+              and os.path.exists(self._path(LEGACY_CHUNKS_FILE))):
+            # 旧版整文件格式直接作为基线快照接管
+            self.manifest = self._empty_manifest()
+            self._adopt_legacy_vectors()
+            self._adopt_legacy_chunks()
+        else:
+            self.manifest = self._empty_manifest()
+        
+        self._recover()
+        self._loaded = True
+    
+    def iter_logs(self) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """按提交顺序回放日志段 (新增 ids, 向量, 删除 ids)，只读取已提交的部分；文本块从 chunk_store 按 ID 读取"""
+        vectors = self.vectors
+        for log in self.manifest['logs']:
+            count = log['count']
+            if count == 0 and log.get('deleted', 0) == 0:
+                continue
+            
+            deleted = self.read_deletes(log, 0)
+            ids = np.empty(0, dtype=np.int64)
+            if count:
+                # 日志段的 ID 文件在首次写入时才创建
+                ids = np.fromfile(self._path(f"{log['name']}.ids"), dtype=np.int64, count=count)
+            yield ids, np.asarray(vectors[ids]), deleted
+    
+    def append(self, ids: np.ndarray, vectors: np.ndarray, chunks: List[dict]) -> None:
+        """追加一批向量与文本块，写入落盘后再提交清单；ids 必须紧接已提交的向量行"""
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        
+        with self.write_lock():
+            if not self.manifest['logs']:
+                self.manifest['logs'].append(self._new_log(self.manifest['generation']))
+            log = self.manifest['logs'][-1]
+            if len(ids) and ids[0] != self.manifest['vector_count']:
+                raise ValueError(f"向量 ID 不连续: {ids[0]} != {self.manifest['vector_count']}")
+            
+            # 文本块行、向量行与日志 ID 都超出清单提交长度，崩溃后由 _recover 截掉
+            self.chunk_store.append(chunks)
+            files = (
+                (self._path(VECTORS_FILE), vectors.tobytes()),
+                (self._path(f"{log['name']}.ids"), ids.tobytes()),
+            )
+            for path, data in files:
+                with open(path, 'ab') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            
+            log['count'] += len(ids)
+            self.manifest['vector_count'] += len(ids)
+            self._write_manifest()
+            self._remap_vectors()
+    
+    def append_tombstones(self, ids: np.ndarray) -> None:
+        """记录被删除的向量 ID，回放时在新增之后生效"""
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        
+        with self.write_lock():
+            if not self.manifest['logs']:
+                self.manifest['logs'].append(self._new_log(self.manifest['generation']))
+            log = self.manifest['logs'][-1]
+            
+            with open(self._path(f"{log['name']}.del"), 'ab') as f:
+                f.write(ids.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            
+            log['deleted'] = log.get('deleted', 0) + len(ids)
+            self._write_manifest()
+    
+    def rotate(self) -> int:
+        """切换到新的日志段，返回新一代编号；之前的日志段可被合并进快照"""
+        with self.write_lock():
+            self.manifest['generation'] += 1
+            self.manifest['logs'].append(self._new_log(self.manifest['generation']))
+            self._write_manifest()
+            return self.manifest['generation']
+    
+    def write_base(self, generation: int, index: "faiss.Index", deleted_ids: np.ndarray) -> bool:
+        """写入新的基线快照 (索引 + 截至快照时已删除的向量 ID)，并丢弃已合并的日志段
+
+        其他进程已提交了更新一代的快照时放弃本次快照，返回 False。
+        """
+        index_name = f"base-{generation}.index"
+        deleted_name = f"base-{generation}.deleted"
+        
+        write_index(index, self._path(index_name + '.tmp'))
+        self._write_ids(deleted_name + '.tmp', deleted_ids)
+        os.replace(self._path(index_name + '.tmp'), self._path(index_name))
+        os.replace(self._path(deleted_name + '.tmp'), self._path(deleted_name))
+        
+        with self.write_lock():
+            if self._base_generation() >= generation:
+                self._remove_unreferenced()
+                return False
+            self.manifest['base'] = {'index': index_name, 'deleted': deleted_name}
+            self.manifest['logs'] = [
+                log for log in self.manifest['logs']
+                if int(log['name'].split('-')[1]) >= generation
+            ]
+            self._write_manifest()
+            self._remove_unreferenced()
+            return True
+    
+    def clear(self) -> None:
+        with self.write_lock():
+            commit, epoch = self.commit, self.epoch
+            self.manifest = self._empty_manifest()
+            self.manifest.update(commit=commit, epoch=epoch + 1)
+            self._write_manifest()
+            self._remove_unreferenced()
+            self._vectors = None
+            self.chunk_store.clear()
+            for name in (VECTORS_FILE, LEGACY_INDEX_FILE, LEGACY_CHUNKS_FILE):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+    
+    def _recover(self) -> None:
+        """截掉向量文件、文本块存储与日志段中超出清单提交长度的残留数据，并清理未被引用的段文件"""
+        vectors_path = self._path(VECTORS_FILE)
+        if not os.path.exists(vectors_path):
+            open(vectors_path, 'wb').close()
+        committed_bytes = self.manifest['vector_count'] * self.dimension * 4
+        if os.path.getsize(vectors_path) != committed_bytes:
+            os.truncate(vectors_path, committed_bytes)
+        self._remap_vectors()
+        self.chunk_store.open(self.manifest['vector_count'])
+        
+        for log in self.manifest['logs']:
+            committed = {
+                'ids': log['count'] * 8,
+                'del': log.get('deleted', 0) * 8,
+            }
+            for suffix, size in committed.items():
+                path = self._path(f"{log['name']}.{suffix}")
+                if not os.path.exists(path):
+                    open(path, 'wb').close()
+                if os.path.getsize(path) != size:
+                    os.truncate(path, size)
+        self._remove_unreferenced()
+    
+    def _reload_manifest(self) -> None:
+        """持有文件锁时跟进磁盘上的清单，并让向量映射与文本块存储覆盖到已提交的行"""
+        if not self._loaded or not os.path.exists(self._path(MANIFEST_FILE)):
+            return
+        
+        manifest = self._read_manifest()
+        if manifest.get('commit', 0) == self.commit:
+            return
+        
+        cleared = manifest.get('epoch', 0) != self.epoch
+        self.manifest = manifest
+        self._remap_vectors()
+        if cleared:
+            # 其他进程清空了索引
+            self.chunk_store.open(self.manifest['vector_count'])
+        else:
+            self.chunk_store.refresh(self.manifest['vector_count'])
+    
+    def _read_manifest(self) -> dict:
+        with open(self._path(MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _release_file_lock(self) -> None:
+        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        os.close(self._lock_fd)
+        self._lock_fd = None
+    
+    def _base_generation(self) -> int:
+        match = re.match(r'^base-(\d+)\.', self.base_key or '')
+        return int(match.group(1)) if match else -1
+    
+    def _remove_unreferenced(self) -> None:
+        """删除已被当前快照取代的段文件；更新一代的文件可能是其他进程正在写入的快照，保留"""
+        current = self._base_generation()
+        referenced = set()
+        if self.manifest['base']:
+            referenced.update(self.manifest['base'].values())
+        for log in self.manifest['logs']:
+            referenced.update(f"{log['name']}.{suffix}" for suffix in LOG_SUFFIXES)
+        
+        for name in os.listdir(self.index_dir):
+            segment = name[:-4] if name.endswith('.tmp') else name
+            if not SEGMENT_PATTERN.match(segment) or name in referenced:
+                continue
+            if int(re.match(r'^\w+-(\d+)\.', segment).group(1)) < current:
+                os.remove(self._path(name))
+    
+    def _adopt_legacy_chunks(self) -> None:
+        """把旧版 chunks.pkl 中的文本块按向量 ID 写入 ChunkStore，并提交以旧版 FAISS 索引为基线的清单
+
+        缺失的行写成空行，记入基线的删除列表。清单提交前中断时旧版文件仍完整，下次加载会重新接管。
+        """
+        count = self.manifest['vector_count']
+        with open(self._path(LEGACY_CHUNKS_FILE), 'rb') as f:
+            chunks = pickle.load(f).get('chunks', [])[:count]
+        rows: List[Optional[dict]] = list(chunks) + [None] * (count - len(chunks))
+        
+        self.chunk_store.clear()
+        empty = {'chunk_id': '', 'content': '', 'metadata': {}}
+        batch_size = 65536
+        for start in range(0, count, batch_size):
+            self.chunk_store.append([row or empty for row in rows[start:start + batch_size]])
+        
+        deleted_name = f"base-{self.manifest['generation']}.deleted"
+        missing = np.array([i for i, row in enumerate(rows) if row is None], dtype=np.int64)
+        self._write_ids(deleted_name, missing)
+        self.manifest['base'] = {'index': LEGACY_INDEX_FILE, 'deleted': deleted_name}
+        self._write_manifest()
+        
+        os.remove(self._path(LEGACY_CHUNKS_FILE))
+    
+    def _write_ids(self, name: str, ids: np.ndarray) -> None:
+        with open(self._path(name), 'wb') as f:
+            f.write(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _adopt_legacy_vectors(self) -> None:
+        """从旧版 IndexIDMap(IndexFlatIP) 中按向量 ID 顺序导出全精度向量"""
+        index = faiss.read_index(self._path(LEGACY_INDEX_FILE))
+        count = index.ntotal
+        vectors = np.zeros((0, self.dimension), dtype=np.float32)
+        if count:
+            ids = faiss.vector_to_array(index.id_map)
+            inner = faiss.downcast_index(index.index)
+            vectors = np.zeros((int(ids.max()) + 1, self.dimension), dtype=np.float32)
+            vectors[ids] = inner.reconstruct_n(0, count)
+        with open(self._path(VECTORS_FILE), 'wb') as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.manifest['vector_count'] = len(vectors)
+    
+    def _remap_vectors(self) -> None:
+        count = self.manifest['vector_count']
+        if count == 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode='r',
+                                  shape=(count, self.dimension))
+    
+    def _write_manifest(self) -> None:
+        self.manifest['commit'] = self.manifest.get('commit', 0) + 1
+        tmp_path = self._path(MANIFEST_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(MANIFEST_FILE))
+        _fsync_dir(self.index_dir)
+    
+    def _new_log(self, generation: int) -> dict:
+        return {'name': f"log-{generation}", 'count': 0, 'deleted': 0}
+    
+    def _empty_manifest(self) -> dict:
+        return {'version': MANIFEST_VERSION, 'generation': 0, 'dimension': self.dimension, 'vector_count': 0,
+                'base': None, 'logs': []}
+    
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
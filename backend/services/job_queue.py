@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, List, Optional, TextIO, Tuple
+
+from core.config import settings
+from services.document_processor import (
+    DocumentParser,
+    chunk_file_to_spool,
+    chunk_parts_to_spool,
+    extract_pdf_range,
+)
+from services.metrics import CHUNKS, record_stage
+from utils.processes import spawn_context
+
+
+def page_ranges(page_count: int, pages_per_task: int) -> List[Tuple[int, int]]:
+    """把 [0, page_count) 切成若干连续的页区间"""
+    step = max(1, pages_per_task)
+    return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+
+class IngestionJob:
+    """入库任务 - 记录单个文档从排队、解析到嵌入入库的进度"""
+    
+    def __init__(self, document_id: str, filename: str, content_type: str, file_path: str):
+        self.job_id = str(uuid.uuid4())
+        self.document_id = document_id
+        self.filename = filename
+        self.content_type = content_type
+        self.file_path = file_path
+        self.spool_path = f"{file_path}.chunks.jsonl"
+        self.part_paths: List[str] = []
+        
+        self.stage = 'queued'
+        self.pages_total: Optional[int] = None
+        self.chunks_total: Optional[int] = None
+        self.chunks_indexed = 0
+        self.error: Optional[str] = None
+        
+        self.created_at = time.time()
+        self.embedding_started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+    
+    @property
+    def done(self) -> bool:
+        return self.stage in ('completed', 'failed')
+    
+    def to_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        throughput = 0.0
+        if self.embedding_started_at is not None and end > self.embedding_started_at:
+            throughput = self.chunks_indexed / (end - self.embedding_started_at)
+        
+        return {
+            'job_id': self.job_id,
+            'document_id': self.document_id,
+            'filename': self.filename,
+            'stage': self.stage,
+            'pages_total': self.pages_total,
+            'chunks_total': self.chunks_total,
+            'chunks_indexed': self.chunks_indexed,
+            'elapsed_seconds': round(end - self.created_at, 3),
+            'chunks_per_second': round(throughput, 2),
+            'error': self.error,
+        }
+
+
+class IngestionJobQueue:
+    """异步入库队列 - 进程池并行解析分块，单个嵌入线程跨任务合批写入索引
+    
+    多个文件在进程池中同时解析；PDF 先按页区间拆分给多个进程提取文本，再按页序拼接分块。
+    """
+    
+    def __init__(self, vector_store, parse_workers: Optional[int] = None, batch_size: Optional[int] = None):
+        self.vector_store = vector_store
+        self.parse_workers = parse_workers or settings.ingest_parse_workers or os.cpu_count() or 1
+        self.batch_size = batch_size or settings.ingest_batch_size
+        
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._parts_lock = threading.Lock()
+        self._parts_remaining: dict = {}
+        self._ready: "queue.Queue[Optional[IngestionJob]]" = queue.Queue()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._embed_thread: Optional[threading.Thread] = None
+    
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.parse_workers,
+            mp_context=spawn_context()
+        )
+        self._embed_thread = threading.Thread(target=self._embed_loop, name="ingest-embedding", daemon=True)
+        self._embed_thread.start()
+    
+    def stop(self) -> None:
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._ready.put(None)
+        self._embed_thread.join(timeout=5)
+        self._embed_thread = None
+    
+    def submit(self, file_path: str, content_type: str, document_id: str, filename: str) -> IngestionJob:
+        if self._executor is None:
+            self.start()
+        
+        job = IngestionJob(document_id, filename, content_type, file_path)
+        with self._jobs_lock:
+            self._jobs[job.job_id] = job
+            self._evict_finished()
+        
+        job.stage = 'parsing'
+        if content_type == 'application/pdf':
+            self._submit(job, self._on_page_count, DocumentParser.pdf_page_count, file_path)
+        else:
+            self._submit_chunking(job)
+        return job
+    
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+    
+    def _submit(self, job: IngestionJob, on_result: Callable[[IngestionJob, object], None], fn, *args) -> None:
+        """提交到解析进程池，完成后在回调中推进任务；任一步失败则整个任务失败"""
+        executor = self._executor
+        if executor is None:
+            self._fail(job, RuntimeError("入库队列已停止"))
+            return
+        try:
+            future = executor.submit(fn, *args)
+        except RuntimeError as e:
+            self._fail(job, e)
+            return
+        future.add_done_callback(lambda f: self._on_done(job, f, on_result))
+    
+    def _on_done(self, job: IngestionJob, future: Future, on_result: Callable[[IngestionJob, object], None]) -> None:
+        if job.done:
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            self._fail(job, e)
+            return
+        on_result(job, result)
+    
+    def _submit_chunking(self, job: IngestionJob) -> None:
+        self._submit(
+            job, self._on_parsed, chunk_file_to_spool,
+            job.file_path, job.content_type, job.document_id, job.filename, job.spool_path,
+            settings.chunk_size, settings.chunk_overlap, settings.chunk_length_unit
+        )
+    
+    def _on_page_count(self, job: IngestionJob, page_count: int) -> None:
+        job.pages_total = page_count
+        ranges = page_ranges(page_count, settings.pdf_pages_per_task)
+        if len(ranges) <= 1:
+            self._submit_chunking(job)
+            return
+        
+        job.part_paths = [f"{job.file_path}.part{i}.jsonl" for i in range(len(ranges))]
+        with self._parts_lock:
+            self._parts_remaining[job.job_id] = len(ranges)
+        for (start, end), part_path in zip(ranges, job.part_paths):
+            self._submit(job, self._on_part_extracted, extract_pdf_range, job.file_path, start, end, part_path)
+    
+    def _on_part_extracted(self, job: IngestionJob, _page_count: int) -> None:
+        with self._parts_lock:
+            self._parts_remaining[job.job_id] -= 1
+            if self._parts_remaining[job.job_id] > 0:
+                return
+            del self._parts_remaining[job.job_id]
+        
+        # 所有页区间都已提取，按页序拼接后分块
+        self._submit(
+            job, self._on_parsed, chunk_parts_to_spool,
+            job.part_paths, job.document_id, job.filename, job.spool_path,
+            settings.chunk_size, settings.chunk_overlap, settings.chunk_length_unit
+        )
+    
+    def _on_parsed(self, job: IngestionJob, chunks_total: int) -> None:
+        # 解析在子进程中进行，这里按提交到分块完成的墙钟时间记录 (含进程池排队)
+        record_stage('ingest_parse', time.time() - job.created_at)
+        CHUNKS.inc(chunks_total, operation='chunked')
+        job.chunks_total = chunks_total
+        job.stage = 'embedding'
+        self._ready.put(job)
+    
+    def _embed_loop(self) -> None:
+        active: List[Tuple[IngestionJob, TextIO]] = []
+        
+        while True:
+            # 没有进行中的任务时阻塞等待，否则只收取已就绪的任务
+            try:
+                while True:
+                    job = self._ready.get(block=not active)
+                    if job is None:
+                        for job, reader in active:
+                            reader.close()
+                        return
+                    try:
+                        active.append((job, open(job.spool_path, 'r', encoding='utf-8')))
+                    except OSError as e:
+                        self._fail(job, e)
+            except queue.Empty:
+                pass
+            
+            owners: List[IngestionJob] = [job for job, _ in active]
+            try:
+                batch, owners, finished = self._fill_batch(active)
+                if batch:
+                    self.vector_store.add_chunks(batch)
+            except Exception as e:
+                for job in set(owners):
+                    self._fail(job, e)
+            else:
+                for job in owners:
+                    job.chunks_indexed += 1
+                for job in finished:
+                    self._complete(job)
+            
+            for job, reader in active:
+                if job.done:
+                    reader.close()
+            active = [(job, reader) for job, reader in active if not job.done]
+    
+    def _fill_batch(
+        self, active: List[Tuple[IngestionJob, TextIO]]
+    ) -> Tuple[List[dict], List[IngestionJob], List[IngestionJob]]:
+        """从各进行中的任务轮流读取文本块，组成一个跨任务的嵌入批次"""
+        batch: List[dict] = []
+        owners: List[IngestionJob] = []
+        finished = []
+        per_job = max(1, self.batch_size // max(1, len(active)))
+        
+        for job, reader in active:
+            if job.embedding_started_at is None:
+                job.embedding_started_at = time.time()
+            
+            taken = 0
+            while taken < per_job and len(batch) < self.batch_size:
+                line = reader.readline()
+                if not line:
+                    finished.append(job)
+                    break
+                batch.append(json.loads(line))
+                owners.append(job)
+                taken += 1
+        
+        return batch, owners, finished
+    
+    def _complete(self, job: IngestionJob) -> None:
+        job.stage = 'completed'
+        job.finished_at = time.time()
+        self._cleanup(job)
+    
+    def _fail(self, job: IngestionJob, error: Exception) -> None:
+        if job.done:
+            return
+        job.stage = 'failed'
+        job.error = str(error)
+        job.finished_at = time.time()
+        try:
+            self.vector_store.delete_document(job.document_id)
+        except Exception:
+            pass
+        self._cleanup(job)
+    
+    def _cleanup(self, job: IngestionJob) -> None:
+        with self._parts_lock:
+            self._parts_remaining.pop(job.job_id, None)
+        for path in (job.file_path, job.spool_path, *job.part_paths):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def _evict_finished(self) -> None:
+        """只保留最近的已结束任务记录"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - settings.ingest_job_history)]:
+            del self._jobs[job_id]
@@ -0,0 +1,260 @@
+import os
+import re
+import math
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+
+
+# 中日韩文字：汉字 (含扩展 A、兼容区)、假名、韩文音节
+CJK_RANGES = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af'
+# 一段连续 CJK 文字，或一个拉丁/数字词 (可带 . _ - : / 连接，如 E1234、v1.2.3、ERR_CONN_RESET)
+TOKEN_PATTERN = re.compile(rf'[{CJK_RANGES}]+|[0-9a-z]+(?:[._\-:/][0-9a-z]+)*')
+CJK_PATTERN = re.compile(rf'[{CJK_RANGES}]')
+WORD_SPLIT_PATTERN = re.compile(r'[._\-:/]')
+# 倒排索引快照文件 (与索引段文件同目录)
+SNAPSHOT_FILE = 'lexical.npz'
+
+
+def tokenize(text: str, for_query: bool = False) -> List[str]:
+    """CJK 感知的分词：CJK 文字切成单字 + 相邻二字，拉丁词保留整体并拆出子词
+
+    查询时长度 ≥ 2 的 CJK 片段只用二字词，避免高频单字拖慢倒排检索。
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if CJK_PATTERN.match(token):
+            bigrams = [token[i:i + 2] for i in range(len(token) - 1)]
+            if not for_query or not bigrams:
+                tokens.extend(token)
+            tokens.extend(bigrams)
+        else:
+            tokens.append(token)
+            parts = WORD_SPLIT_PATTERN.split(token)
+            if len(parts) > 1:
+                tokens.extend(parts)
+    return tokens
+
+
+class _Postings:
+    """单个词项的倒排表：向量 ID 与词频两个紧凑数组，按容量倍增追加"""
+    
+    __slots__ = ('ids', 'tfs', 'size')
+    
+    def __init__(self):
+        self.ids = np.empty(4, dtype=np.int32)
+        self.tfs = np.empty(4, dtype=np.uint16)
+        self.size = 0
+    
+    def extend(self, ids: List[int], tfs: List[int]) -> None:
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, 2 * len(self.ids))
+            self.ids = np.resize(self.ids, capacity)
+            self.tfs = np.resize(self.tfs, capacity)
+        self.ids[self.size:needed] = ids
+        self.tfs[self.size:needed] = np.minimum(tfs, np.iinfo(np.uint16).max)
+        self.size = needed
+    
+    @classmethod
+    def from_arrays(cls, ids: np.ndarray, tfs: np.ndarray) -> "_Postings":
+        postings = cls()
+        postings.ids = ids
+        postings.tfs = tfs
+        postings.size = len(ids)
+        return postings
+    
+    def remove(self, ids: np.ndarray) -> None:
+        keep = ~np.isin(self.ids[:self.size], ids)
+        self.ids = self.ids[:self.size][keep].copy()
+        self.tfs = self.tfs[:self.size][keep].copy()
+        self.size = len(self.ids)
+
+
+class LexicalIndex:
+    """BM25 稀疏检索 - 以向量 ID 为文档编号的倒排索引，随 VectorStore 增量更新"""
+    
+    def __init__(self, k1: Optional[float] = None, b: Optional[float] = None):
+        self.k1 = settings.bm25_k1 if k1 is None else k1
+        self.b = settings.bm25_b if b is None else b
+        self.postings: Dict[str, _Postings] = {}
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.doc_count = 0
+        self.total_length = 0
+    
+    def add(self, ids: Iterable[int], texts: Iterable[str]) -> None:
+        """加入一批文本；同一批次内按词项分组后一次性追加到倒排表"""
+        self.add_analyzed(self.analyze(ids, texts))
+    
+    @staticmethod
+    def analyze(ids: Iterable[int], texts: Iterable[str]) -> Tuple[dict, list]:
+        """分词并按词项分组 (不修改索引，可在锁外执行)，结果交给 add_analyzed"""
+        grouped: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = []
+        for vector_id, text in zip(ids, texts):
+            tokens = tokenize(text)
+            lengths.append((vector_id, len(tokens)))
+            for term, tf in Counter(tokens).items():
+                doc_ids, tfs = grouped.setdefault(term, ([], []))
+                doc_ids.append(vector_id)
+                tfs.append(tf)
+        return grouped, lengths
+    
+    def add_analyzed(self, analyzed: Tuple[dict, list]) -> None:
+        grouped, lengths = analyzed
+        if not lengths:
+            return
+        
+        max_id = max(vector_id for vector_id, _ in lengths)
+        if max_id >= len(self.doc_lengths):
+            self.doc_lengths = np.resize(self.doc_lengths, max(max_id + 1, 2 * len(self.doc_lengths)))
+        for vector_id, length in lengths:
+            self.doc_lengths[vector_id] = length
+            self.total_length += length
+        self.doc_count += len(lengths)
+        
+        for term, (doc_ids, tfs) in grouped.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = _Postings()
+            postings.extend(doc_ids, tfs)
+    
+    def remove(self, ids: Iterable[int], texts: Iterable[str]) -> None:
+        """移除一批文本；只改写这些文本出现过的词项的倒排表"""
+        affected: Dict[str, List[int]] = {}
+        for vector_id, text in zip(ids, texts):
+            for term in set(tokenize(text)):
+                affected.setdefault(term, []).append(vector_id)
+            self.total_length -= int(self.doc_lengths[vector_id])
+            self.doc_lengths[vector_id] = 0
+            self.doc_count -= 1
+        
+        for term, doc_ids in affected.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.remove(np.array(doc_ids, dtype=np.int32))
+            if postings.size == 0:
+                del self.postings[term]
+    
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        candidate_ids: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, float]]:
+        """BM25 检索，返回 [(向量 ID, 分数)]；candidate_ids 限定可返回的 ID 集合"""
+        if self.doc_count == 0 or top_k <= 0:
+            return []
+        
+        avg_length = self.total_length / self.doc_count if self.doc_count else 1.0
+        matched_ids = []
+        matched_scores = []
+        for term, query_tf in Counter(tokenize(query, for_query=True)).items():
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            
+            ids = postings.ids[:postings.size]
+            tfs = postings.tfs[:postings.size].astype(np.float32)
+            df = postings.size
+            idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[ids] / avg_length)
+            matched_ids.append(ids)
+            matched_scores.append(query_tf * idf * tfs * (self.k1 + 1) / (tfs + norm))
+        
+        if not matched_ids:
+            return []
+        
+        ids = np.concatenate(matched_ids)
+        scores = np.concatenate(matched_scores)
+        if len(matched_ids) > 1:
+            # 只在命中的文档上累加，代价与倒排表长度成正比，与语料规模无关
+            ids, inverse = np.unique(ids, return_inverse=True)
+            scores = np.bincount(inverse, weights=scores).astype(np.float32)
+        
+        if candidate_ids is not None:
+            keep = np.isin(ids, candidate_ids)
+            ids, scores = ids[keep], scores[keep]
+        
+        if len(ids) > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return [(int(ids[i]), float(scores[i])) for i in order]
+    
+    def clear(self) -> None:
+        self.postings = {}
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.doc_count = 0
+        self.total_length = 0
+    
+    def snapshot(self) -> dict:
+        """当前状态的只读视图，供锁外写盘；倒排表追加与删除都不改写已有的 [:size] 区间"""
+        return {
+            'postings': {term: (p.ids[:p.size], p.tfs[:p.size]) for term, p in self.postings.items()},
+            'doc_lengths': self.doc_lengths.copy(),
+            'doc_count': self.doc_count,
+            'total_length': self.total_length,
+        }
+    
+    def restore(self, path: str) -> Optional[Dict[str, Any]]:
+        """从 write_snapshot 写出的文件恢复，返回快照中的附加信息；文件不存在或损坏时返回 None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except Exception as e:
+            print(f"读取倒排索引快照失败: {e}")
+            return None
+        
+        terms = arrays.pop('terms').tobytes().decode('utf-8').split('\n') if len(arrays['offsets']) > 1 else []
+        offsets = arrays.pop('offsets')
+        ids, tfs = arrays.pop('ids'), arrays.pop('tfs')
+        self.postings = {
+            term: _Postings.from_arrays(ids[offsets[i]:offsets[i + 1]].copy(), tfs[offsets[i]:offsets[i + 1]].copy())
+            for i, term in enumerate(terms)
+        }
+        self.doc_lengths = arrays.pop('doc_lengths')
+        self.doc_count = int(arrays.pop('doc_count'))
+        self.total_length = int(arrays.pop('total_length'))
+        return arrays
+
+
+def write_snapshot(path: str, snapshot: dict, **extra: np.ndarray) -> None:
+    """把 LexicalIndex.snapshot() 写成单个 npz 文件 (先写临时文件再原子替换)；extra 为随快照保存的附加数组"""
+    postings = snapshot['postings']
+    sizes = np.fromiter((len(ids) for ids, _ in postings.values()), dtype=np.int64, count=len(postings))
+    offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            terms=np.frombuffer('\n'.join(postings).encode('utf-8'), dtype=np.uint8),
+            offsets=offsets,
+            ids=np.concatenate([ids for ids, _ in postings.values()] or [np.zeros(0, dtype=np.int32)]),
+            tfs=np.concatenate([tfs for _, tfs in postings.values()] or [np.zeros(0, dtype=np.uint16)]),
+            doc_lengths=snapshot['doc_lengths'],
+            doc_count=np.int64(snapshot['doc_count']),
+            total_length=np.int64(snapshot['total_length']),
+            **extra,
+        )
+    os.replace(tmp_path, path)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[int]], k: Optional[int] = None) -> List[Tuple[int, float]]:
+    """倒数排名融合：score = Σ 1 / (k + rank)，rank 从 1 开始"""
+    k = settings.rrf_k if k is None else k
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
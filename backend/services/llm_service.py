@@ -1,5 +1,95 @@
-from typing import List, Optional
+import asyncio
+import random
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, TypeVar
 from core.config import settings
+from services.context_packer import ContextPacker
+from services.metrics import TOKENS, timed
+
+
+T = TypeVar('T')
+
+# 值得重试的上游状态码：超时、冲突、限流与服务端错误
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """模型调用失败 - 携带错误类别、上游状态码与已尝试次数，供接口层返回结构化错误"""
+    
+    HTTP_STATUS = {'bad_request': 400, 'rate_limited': 429, 'unavailable': 503, 'timeout': 504}
+    
+    def __init__(
+        self,
+        code: str,
+        message: str,
+        status_code: Optional[int] = None,
+        retryable: bool = False,
+        retry_after: Optional[float] = None
+    ):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.attempts = 1
+    
+    @property
+    def http_status(self) -> int:
+        return self.HTTP_STATUS.get(self.code, 502)
+    
+    def to_dict(self) -> dict:
+        return {
+            'code': self.code,
+            'message': self.message,
+            'upstream_status': self.status_code,
+            'attempts': self.attempts,
+        }
+    
+    @classmethod
+    def from_exception(cls, error: Exception) -> "LLMError":
+        if isinstance(error, LLMError):
+            return error
+        if isinstance(error, asyncio.TimeoutError):
+            return cls('timeout', "模型调用超时", retryable=True)
+        
+        status_code = getattr(error, 'status_code', None)
+        if status_code is not None:
+            if status_code == 429:
+                code = 'rate_limited'
+            elif status_code >= 500:
+                code = 'upstream_error'
+            else:
+                code = 'bad_request'
+            return cls(code, str(error), status_code=status_code,
+                       retryable=status_code in RETRYABLE_STATUS_CODES,
+                       retry_after=_retry_after(error))
+        
+        try:
+            from openai import APIConnectionError, APITimeoutError
+        except ImportError:
+            return cls('internal', str(error))
+        if isinstance(error, APITimeoutError):
+            return cls('timeout', "模型调用超时", retryable=True)
+        if isinstance(error, APIConnectionError):
+            return cls('unavailable', f"无法连接模型服务: {error}", retryable=True)
+        return cls('internal', str(error))
+
+
+def _record_usage(response) -> None:
+    """记录接口返回的计费 token (兼容接口可能不返回 usage)"""
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        TOKENS.inc(getattr(usage, 'prompt_tokens', 0) or 0, type='prompt')
+        TOKENS.inc(getattr(usage, 'completion_tokens', 0) or 0, type='completion')
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
 
 
 class LLMService:
@@ -11,7 +101,15 @@ class LLMService:
         self.base_url = settings.openai_base_url
         self.temperature = settings.openai_temperature
         self.max_tokens = settings.openai_max_tokens
+        self.timeout = settings.llm_request_timeout
+        self.max_retries = settings.llm_max_retries
+        self.retry_base_delay = settings.llm_retry_base_delay
+        self.retry_max_delay = settings.llm_retry_max_delay
+        self.hedge_delay = settings.llm_hedge_delay_ms / 1000.0
         self._client = None
+        self._async_client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.context_packer = ContextPacker()
     
     @property
     def client(self):
@@ -23,27 +121,172 @@ class LLMService:
                 raise ImportError("请安装 openai: pip install openai")
         return self._client
     
+    @property
+    def async_client(self):
+        """共享连接池的异步客户端；重试由本服务负责，关闭 SDK 自带重试"""
+        if self._async_client is None:
+            try:
+                import httpx
+                from openai import AsyncOpenAI
+            except ImportError:
+                raise ImportError("请安装 openai: pip install openai")
+            try:
+                from openai import DefaultAsyncHttpxClient
+            except ImportError:
+                raise ImportError("openai 版本过低，需要 1.17.0 及以上: pip install -U 'openai>=1.17.0'")
+            http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=settings.llm_max_connections,
+                    max_keepalive_connections=settings.llm_max_connections
+                ),
+                timeout=self.timeout
+            )
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=0
+            )
+        return self._async_client
+    
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """限制同时在途的上游调用数 (含对冲请求与进行中的流)"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.llm_max_concurrency)
+        return self._semaphore
+    
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+    
+    @timed('llm')
     def generate_answer(self, query: str, context_chunks: List[dict]) -> str:
-        context = self._build_context(context_chunks)
-        prompt = self._build_prompt(query, context)
-        
         try:
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个智能助手，基于提供的文档上下文回答用户问题。"},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._build_messages(query, context_chunks),
                 temperature=self.temperature,
                 max_tokens=self.max_tokens
             )
+            _record_usage(response)
             return response.choices[0].message.content
         except Exception as e:
-            return f"生成回答时出错: {str(e)}"
+            raise LLMError.from_exception(e) from e
+    
+    @timed('llm')
+    async def agenerate_answer(self, query: str, context_chunks: List[dict]) -> str:
+        """异步生成回答：受并发上限约束，限流/5xx 指数退避重试，整体不超过请求截止时间"""
+        messages = self._build_messages(query, context_chunks)
+        
+        async def request() -> str:
+            async with self.semaphore:
+                response = await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens
+                )
+            _record_usage(response)
+            return response.choices[0].message.content
+        
+        return await self._call(request, hedge=True)
+    
+    async def stream_answer(self, query: str, context_chunks: List[dict]) -> AsyncIterator[str]:
+        """流式生成回答，逐段产出增量文本；建立连接阶段可重试，出错时抛出 LLMError"""
+        messages = self._build_messages(query, context_chunks)
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        
+        async def request():
+            return await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                stream=True
+            )
+        
+        with timed('llm'):
+            async with self.semaphore:
+                stream = await self._call(request, deadline=deadline)
+                try:
+                    async for chunk in stream:
+                        if asyncio.get_running_loop().time() > deadline:
+                            raise LLMError('timeout', "模型调用超时")
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            yield delta
+                except Exception as e:
+                    raise LLMError.from_exception(e) from e
+                finally:
+                    await stream.close()
+    
+    async def _call(
+        self,
+        request: Callable[[], Awaitable[T]],
+        deadline: Optional[float] = None,
+        hedge: bool = False
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        deadline = deadline if deadline is not None else loop.time() + self.timeout
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            try:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise LLMError('timeout', "模型调用超时")
+                attempt_request = self._hedged(request) if hedge and self.hedge_delay > 0 else request()
+                return await asyncio.wait_for(attempt_request, remaining)
+            except Exception as e:
+                error = LLMError.from_exception(e)
+                error.attempts = attempt
+                if not error.retryable or attempt > self.max_retries:
+                    raise error from e
+                
+                delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1))
+                delay = max(delay * random.uniform(0.5, 1.0), error.retry_after or 0)
+                if loop.time() + delay >= deadline:
+                    raise error from e
+                await asyncio.sleep(delay)
+    
+    async def _hedged(self, request: Callable[[], Awaitable[T]]) -> T:
+        """对冲请求：首个请求超过 hedge_delay 未返回时再发一个，取先成功者并取消另一个"""
+        tasks = {asyncio.ensure_future(request())}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if not done:
+                tasks.add(asyncio.ensure_future(request()))
+            
+            first_error: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    def _build_messages(self, query: str, context_chunks: List[dict]) -> List[dict]:
+        context = self._build_context(context_chunks)
+        return [
+            {"role": "system", "content": "你是一个智能助手，基于提供的文档上下文回答用户问题。"},
+            {"role": "user", "content": self._build_prompt(query, context)}
+        ]
     
     def _build_context(self, chunks: List[dict]) -> str:
+        """在 token 预算内打包上下文：合并相邻块、去掉重叠句，按检索得分取舍"""
         context_parts = []
-        for i, chunk in enumerate(chunks, 1):
+        for i, chunk in enumerate(self.context_packer.pack(chunks), 1):
             content = chunk.get('content', '')
             metadata = chunk.get('metadata', {})
             source = metadata.get('source', f'来源 {i}')
@@ -67,9 +310,22 @@ class MockLLMService:
     def __init__(self, **kwargs):
         pass
     
+    @timed('llm')
     def generate_answer(self, query: str, context_chunks: List[dict]) -> str:
         if not context_chunks:
             return "抱歉，我没有找到与您问题相关的文档内容。"
         
         context = '\n\n'.join([chunk.get('content', '')[:200] for chunk in context_chunks[:3]])
         return f"基于检索到的文档内容，我为您提供以下回答：\n\n{context}\n\n如需更详细的信息，请告诉我您想了解的具体方面。"
+    
+    async def agenerate_answer(self, query: str, context_chunks: List[dict]) -> str:
+        return self.generate_answer(query, context_chunks)
+    
+    async def stream_answer(self, query: str, context_chunks: List[dict]) -> AsyncIterator[str]:
+        answer = self.generate_answer(query, context_chunks)
+        for i in range(0, len(answer), 8):
+            yield answer[i:i + 8]
+            await asyncio.sleep(0)
+    
+    async def aclose(self) -> None:
+        pass
@@ -0,0 +1,300 @@
+import os
+import sys
+import math
+import time
+import bisect
+import inspect
+import functools
+import threading
+import contextvars
+from abc import ABC, abstractmethod
+from collections import Counter as FrequencyCounter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from core.config import settings
+
+
+# Prometheus 文本格式 (0.0.4)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# 耗时直方图的桶上界 (秒)：从缓存命中的亚毫秒级到 LLM 调用的数十秒
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Metric(ABC):
+    kind = ''
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+    
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+    
+    def _labels(self, key: tuple, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+    
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+    
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """该指标的样本行 (不含 HELP/TYPE 行)"""
+
+
+class Counter(_Metric):
+    """单调递增计数器，按标签组合分别计数"""
+    
+    kind = 'counter'
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+    
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if amount <= 0 or not settings.metrics_enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+    
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{self._labels(key)} {_format_value(value)}' for key, value in items]
+
+
+class Histogram(_Metric):
+    """累积桶直方图：每个标签组合保存各桶计数、总和与次数"""
+    
+    kind = 'histogram'
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[tuple, list] = {}
+    
+    def observe(self, value: float, **labels: str) -> None:
+        if not settings.metrics_enabled:
+            return
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # 末位存观测值总和
+                series = self._series[key] = [0] * len(self.buckets) + [0.0]
+            series[position] += 1
+            series[-1] += value
+    
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self._labels(key, (("le", _format_value(bound)),))} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(key)} {_format_value(series[-1])}')
+            lines.append(f'{self.name}_count{self._labels(key)} {cumulative}')
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+STAGE_SECONDS = Histogram('rag_stage_duration_seconds', '各处理阶段耗时 (秒)', ('stage',))
+REQUEST_SECONDS = Histogram('rag_http_request_duration_seconds', 'HTTP 请求耗时 (秒)', ('method', 'route', 'status'))
+CHUNKS = Counter('rag_chunks_total', '分块、写入与删除的文本块数', ('operation',))
+EMBEDDED_TEXTS = Counter('rag_embedded_texts_total', '送入嵌入模型编码的文本数')
+TOKENS = Counter('rag_tokens_total', '打包进提示词的上下文 token 与 LLM 接口计费 token', ('type',))
+CACHE_LOOKUPS = Counter('rag_cache_lookups_total', '缓存查询次数', ('cache', 'result'))
+RERANK_BUDGET_EXCEEDED = Counter('rag_rerank_budget_exceeded_total', '重排超出延迟预算、部分候选保持向量顺序的查询数')
+
+
+def render_metrics() -> str:
+    """所有指标的 Prometheus 文本格式；多 worker 部署时每个进程各自计数"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def record_cache_lookup(cache: str, hits: int, misses: int = 0) -> None:
+    CACHE_LOOKUPS.inc(hits, cache=cache, result='hit')
+    CACHE_LOOKUPS.inc(misses, cache=cache, result='miss')
+
+
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    'request_timings', default=None
+)
+
+
+@contextmanager
+def track_request() -> Iterator[Dict[str, float]]:
+    """在当前上下文内累计各阶段耗时，供响应头输出单个请求的耗时分解"""
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    """Server-Timing 响应头 (毫秒)，浏览器开发者工具可直接展示"""
+    parts = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in timings.items()]
+    parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
+
+
+class timed:
+    """阶段计时 - 作上下文管理器或装饰器 (同步函数与协程函数)，记入直方图与当前请求的耗时分解"""
+    
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._start = 0.0
+    
+    def __enter__(self) -> "timed":
+        self._start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        record_stage(self.stage, time.perf_counter() - self._start)
+    
+    def __call__(self, fn):
+        stage = self.stage
+        
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    record_stage(stage, time.perf_counter() - start)
+            return async_wrapper
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_stage(stage, time.perf_counter() - start)
+        return wrapper
+
+
+class SamplingProfiler:
+    """采样分析器 - 后台线程按固定间隔抓取所有线程的调用栈并计数
+
+    不挂钩函数调用，开销只取决于采样间隔；按墙钟采样，等待中的线程也会出现。
+    输出折叠栈格式 (每行 "帧;帧;... 次数")，可直接交给 flamegraph.pl 或 speedscope。
+    """
+    
+    MAX_DEPTH = 64
+    
+    def __init__(self, interval_ms: Optional[float] = None):
+        self.interval_ms = interval_ms or settings.profiler_interval_ms
+        self.started_at: Optional[float] = None
+        self.samples = 0
+        self._stacks: FrequencyCounter = FrequencyCounter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+    
+    def start(self) -> None:
+        """开始新一轮采样，清空上一轮的结果"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stacks.clear()
+            self.samples = 0
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+    
+    def stop(self) -> str:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        return self.folded()
+    
+    def status(self) -> dict:
+        return {
+            'running': self.running,
+            'interval_ms': self.interval_ms,
+            'samples': self.samples,
+            'started_at': self.started_at,
+        }
+    
+    def folded(self) -> str:
+        with self._lock:
+            items = self._stacks.most_common()
+        return ''.join(f'{stack} {count}\n' for stack, count in items)
+    
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval_ms / 1000.0):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident != own_ident:
+                        self._stacks[self._collapse(names.get(ident, str(ident)), frame)] += 1
+                self.samples += 1
+    
+    def _collapse(self, thread_name: str, frame) -> str:
+        parts = []
+        while frame is not None and len(parts) < self.MAX_DEPTH:
+            code = frame.f_code
+            parts.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        parts.append(thread_name)
+        return ';'.join(reversed(parts))
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,89 @@
+import time
+from typing import List, Optional, Tuple
+
+from core.config import settings
+from services.metrics import RERANK_BUDGET_EXCEEDED, timed
+
+
+# 预截断候选文本的字符上限 = token 上限 × 该倍数，避免分词器处理整段长文本 (最终由模型按 token 截断)
+CHARS_PER_TOKEN = 4
+
+
+class CrossEncoderReranker:
+    """交叉编码器重排 - 对向量检索的候选逐对 (查询, 文本块) 打分并重新排序
+
+    候选按向量顺序分批打分；预计下一批会超出单次查询的延迟预算时停止，
+    已打分的候选按重排分数排在前面，其余候选保持向量顺序。
+    返回的分数仍是余弦相似度，重排分数写入 metadata['rerank_score']。
+    """
+    
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        budget_ms: Optional[float] = None
+    ):
+        self.model_name = model_name or settings.rerank_model
+        self.batch_size = batch_size or settings.rerank_batch_size
+        self.max_tokens = max_tokens or settings.rerank_max_tokens
+        self.budget_ms = settings.rerank_budget_ms if budget_ms is None else budget_ms
+        self._model = None
+    
+    @property
+    def model(self):
+        if self._model is None:
+            # 推迟 import：未启用重排时进程不加载 torch
+            try:
+                from sentence_transformers import CrossEncoder
+            except ImportError:
+                raise ImportError("请安装 sentence-transformers: pip install sentence-transformers")
+            self._model = CrossEncoder(self.model_name, max_length=self.max_tokens)
+        return self._model
+    
+    def load(self) -> None:
+        """立即加载模型，避免首个重排请求承担加载开销"""
+        _ = self.model
+    
+    def warmup(self) -> None:
+        self.model.predict([("warmup", "warmup")])
+    
+    @timed('rerank')
+    def rerank(
+        self,
+        query: str,
+        results: List[Tuple[dict, float]],
+        top_k: int,
+        budget_ms: Optional[float] = None
+    ) -> List[Tuple[dict, float]]:
+        """results 为向量检索顺序的 [(文本块, 余弦)]，返回重排后的前 top_k 个"""
+        if len(results) <= 1:
+            return results[:top_k]
+        
+        budget = (self.budget_ms if budget_ms is None else budget_ms) / 1000.0
+        start = time.perf_counter()
+        deadline = start + budget if budget > 0 else None
+        max_chars = self.max_tokens * CHARS_PER_TOKEN
+        
+        scores: List[float] = []
+        batch_seconds = 0.0
+        while len(scores) < len(results):
+            now = time.perf_counter()
+            if deadline is not None and scores and now + batch_seconds > deadline:
+                RERANK_BUDGET_EXCEEDED.inc()
+                break
+            
+            batch = results[len(scores):len(scores) + self.batch_size]
+            pairs = [(query, chunk.get('content', '')[:max_chars]) for chunk, _ in batch]
+            scores.extend(float(score) for score in self.model.predict(pairs, batch_size=len(pairs)))
+            batch_seconds = time.perf_counter() - now
+        
+        scored = sorted(range(len(scores)), key=lambda i: -scores[i])
+        reranked = [self._with_score(results[i], scores[i]) for i in scored]
+        return (reranked + results[len(scores):])[:top_k]
+    
+    @staticmethod
+    def _with_score(result: Tuple[dict, float], rerank_score: float) -> Tuple[dict, float]:
+        chunk, score = result
+        metadata = {**chunk.get('metadata', {}), 'rerank_score': rerank_score}
+        return {**chunk, 'metadata': metadata}, score
@@ -0,0 +1,354 @@
+import os
+import json
+import zlib
+import signal
+import threading
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from core.config import settings
+from services.embedding_service import EmbeddingService
+from services.lexical_index import reciprocal_rank_fusion
+from services.metrics import CHUNKS, timed
+from services.vector_store import VectorStore, changed_keys, document_id_of
+from utils.processes import spawn_context
+
+
+SHARDS_FILE = 'shards.json'
+# 分片进程可被调用的 VectorStore 方法
+SHARD_METHODS = (
+    'add_embeddings', 'delete_document', 'search_candidates', 'get_chunk_count',
+    'list_documents', 'get_all_chunks', 'clear',
+)
+
+
+class ShardError(RuntimeError):
+    """分片进程执行失败或已退出"""
+
+
+def shard_of(document_id: str, shard_count: int) -> int:
+    """按文档 ID 的稳定哈希分配分片 (不使用进程内加盐的 hash())"""
+    return zlib.crc32(document_id.encode('utf-8')) % shard_count
+
+
+def _shard_main(conn: Connection, index_dir: str, dimension: int, overrides: dict) -> None:
+    """分片进程入口：持有一个只含向量的 VectorStore，按请求顺序执行方法调用"""
+    # 由主进程负责关闭分片，避免 Ctrl+C 时分片先于主进程退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    
+    store = VectorStore(index_dir=index_dir, dimension=dimension)
+    store.load()
+    conn.send(('ok', None))
+    
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        
+        method, args, kwargs = message
+        try:
+            if method == 'stats':
+                result = {
+                    'index_type': store.index_type,
+                    'chunk_count': store.get_chunk_count(),
+                    'lexical_ready': store.lexical_ready,
+                }
+            elif method in SHARD_METHODS:
+                result = getattr(store, method)(*args, **kwargs)
+            else:
+                raise ValueError(f"不支持的分片方法: {method}")
+            conn.send(('ok', result))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class _ShardClient:
+    """单个分片进程的管道端点；同一时刻只有一个请求在途"""
+    
+    def __init__(self, shard_index: int, process: multiprocessing.Process, conn: Connection):
+        self.shard_index = shard_index
+        self.process = process
+        self.conn = conn
+        self.lock = threading.Lock()
+    
+    def send(self, method: str, *args, **kwargs) -> None:
+        self.conn.send((method, args, kwargs))
+    
+    def receive(self):
+        try:
+            status, result = self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise ShardError(f"分片 {self.shard_index} 已退出: {e}")
+        if status != 'ok':
+            raise ShardError(f"分片 {self.shard_index}: {result}")
+        return result
+
+
+class ShardedVectorStore:
+    """分片向量存储 - N 个本地进程各持有一部分文档，路由进程散发查询并归并 top-k
+
+    文档按 document_id 的哈希分配到分片；嵌入在路由进程中计算，分片只接收向量。
+    混合检索时各分片返回融合前的向量候选与 BM25 候选，由路由统一做倒数排名融合。
+    """
+    
+    def __init__(self, embedding_service: Optional[EmbeddingService] = None, shard_count: Optional[int] = None):
+        self.embedding_service = embedding_service or EmbeddingService()
+        self.dimension = self.embedding_service.get_embedding_dimension()
+        self.shard_count = shard_count or settings.vector_store_shards
+        self.shards: List[_ShardClient] = []
+        self._change_listeners: List[Callable[[Set[str], Set[str]], None]] = []
+    
+    @property
+    def index_type(self) -> Optional[str]:
+        types = {stats['index_type'] for stats in self._scatter('stats') if stats['index_type']}
+        return ','.join(sorted(types)) if types else None
+    
+    @property
+    def lexical_ready(self) -> bool:
+        """各分片的倒排索引都已建立 (此前混合检索在分片内退回纯向量检索)"""
+        return all(stats['lexical_ready'] for stats in self._scatter('stats'))
+    
+    def load(self) -> None:
+        """启动分片进程并等待各分片加载完持久化索引"""
+        if self.shards:
+            return
+        self._check_layout()
+        
+        context = spawn_context()
+        overrides = settings.model_dump()
+        for shard_index in range(self.shard_count):
+            parent_conn, child_conn = context.Pipe()
+            index_dir = os.path.join(settings.index_dir, f"shard-{shard_index}")
+            process = context.Process(
+                target=_shard_main,
+                args=(child_conn, index_dir, self.dimension, overrides),
+                name=f"vector-shard-{shard_index}",
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self.shards.append(_ShardClient(shard_index, process, parent_conn))
+        
+        for shard in self.shards:
+            shard.receive()
+    
+    def close(self) -> None:
+        for shard in self.shards:
+            with shard.lock:
+                try:
+                    shard.conn.send(None)
+                except OSError:
+                    pass
+        for shard in self.shards:
+            shard.process.join(timeout=5)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.conn.close()
+        self.shards = []
+    
+    def add_change_listener(self, listener: Callable[[Set[str], Set[str]], None]) -> None:
+        """注册文档变更回调 listener(document_ids, filenames)，在写入或删除文本块后调用"""
+        self._change_listeners.append(listener)
+    
+    def _notify_change(self, document_ids: Set[str], filenames: Set[str]) -> None:
+        for listener in self._change_listeners:
+            listener(document_ids, filenames)
+    
+    def add_chunks(self, chunks: List[dict]) -> None:
+        if not chunks:
+            return
+        
+        embeddings = self.embedding_service.embed_texts([chunk['content'] for chunk in chunks])
+        rows: Dict[int, List[int]] = {}
+        for row, chunk in enumerate(chunks):
+            rows.setdefault(shard_of(document_id_of(chunk), self.shard_count), []).append(row)
+        
+        requests = {
+            shard_index: (([chunks[row] for row in shard_rows], embeddings[shard_rows]), {})
+            for shard_index, shard_rows in rows.items()
+        }
+        with timed('index_add'):
+            self._scatter_each('add_embeddings', requests)
+        CHUNKS.inc(len(chunks), operation='indexed')
+        self._notify_change(*changed_keys(chunks))
+    
+    def delete_document(self, document_id: str) -> int:
+        """删除单个文档的全部文本块，返回删除的块数"""
+        deleted = self._call(shard_of(document_id, self.shard_count), 'delete_document', document_id)
+        if deleted:
+            CHUNKS.inc(deleted, operation='deleted')
+            self._notify_change({document_id}, set())
+        return deleted
+    
+    def search(
+        self,
+        query: str,
+        top_k: Optional[int] = None,
+        filter_document_id: Optional[str] = None,
+        filters: Optional[Dict[str, str]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        hybrid: Optional[bool] = None
+    ) -> List[Tuple[dict, float]]:
+        query_embedding = self.embedding_service.embed_text(query)
+        return self.search_by_vector(query_embedding, top_k, filter_document_id, filters,
+                                     nprobe=nprobe, ef_search=ef_search, query=query, hybrid=hybrid)
+    
+    def search_by_vector(
+        self,
+        query_embedding: np.ndarray,
+        top_k: Optional[int] = None,
+        filter_document_id: Optional[str] = None,
+        filters: Optional[Dict[str, str]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        query: Optional[str] = None,
+        hybrid: Optional[bool] = None
+    ) -> List[Tuple[dict, float]]:
+        filters = dict(filters or {})
+        if filter_document_id:
+            filters['document_id'] = filter_document_id
+        
+        return self.search_batch(
+            np.asarray(query_embedding).reshape(1, -1), [top_k], [filters],
+            nprobe=nprobe, ef_search=ef_search, queries=[query], hybrid=hybrid
+        )[0]
+    
+    @timed('vector_search')
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        top_ks: Optional[List[Optional[int]]] = None,
+        filters: Optional[List[Optional[Dict[str, str]]]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        queries: Optional[List[Optional[str]]] = None,
+        hybrid: Optional[bool] = None
+    ) -> List[List[Tuple[dict, float]]]:
+        """把查询矩阵散发给各分片，按查询归并各分片的候选"""
+        n_queries = len(query_embeddings)
+        top_ks = [top_k or settings.similarity_top_k for top_k in (top_ks or [None] * n_queries)]
+        filters = filters or [None] * n_queries
+        if n_queries == 0:
+            return []
+        
+        # 全部查询都限定了文档时，只需访问这些文档所在的分片
+        targets = set(range(self.shard_count))
+        if all((row_filters or {}).get('document_id') for row_filters in filters):
+            targets = {shard_of(row_filters['document_id'], self.shard_count) for row_filters in filters}
+        
+        args = (query_embeddings, top_ks, filters, nprobe, ef_search, queries, hybrid)
+        responses = self._scatter_each('search_candidates', {shard_index: (args, {}) for shard_index in targets})
+        
+        results = []
+        for row in range(n_queries):
+            shard_candidates = [(shard_index, response[row]) for shard_index, response in responses.items()]
+            results.append(self._merge(shard_candidates, top_ks[row]))
+        return results
+    
+    def _merge(self, shard_candidates: list, top_k: int) -> List[Tuple[dict, float]]:
+        """归并各分片的候选；以 (分片, 向量 ID) 区分文本块"""
+        chunks: Dict[Tuple[int, int], Tuple[dict, float]] = {}
+        dense = []
+        lexical = []
+        hybrid = False
+        for shard_index, (dense_hits, lexical_hits) in shard_candidates:
+            for idx, chunk, similarity in dense_hits:
+                chunks[(shard_index, idx)] = (chunk, similarity)
+                dense.append(((shard_index, idx), similarity))
+            if lexical_hits is not None:
+                hybrid = True
+                for idx, chunk, score, similarity in lexical_hits:
+                    chunks[(shard_index, idx)] = (chunk, similarity)
+                    lexical.append(((shard_index, idx), score))
+        
+        dense.sort(key=lambda item: item[1], reverse=True)
+        if not hybrid:
+            return [chunks[key] for key, _ in dense[:top_k]]
+        
+        # 与单机检索相同：两路各取 top_k × 倍数后做倒数排名融合，分数仍为余弦相似度
+        fetch_k = top_k * settings.hybrid_fetch_multiplier
+        lexical.sort(key=lambda item: item[1], reverse=True)
+        fused = reciprocal_rank_fusion([
+            [key for key, _ in dense[:fetch_k]],
+            [key for key, _ in lexical[:fetch_k]],
+        ])[:top_k]
+        return [chunks[key] for key, _ in fused]
+    
+    def get_all_chunks(self) -> List[dict]:
+        return [chunk for chunks in self._scatter('get_all_chunks') for chunk in chunks]
+    
+    def get_chunk_count(self) -> int:
+        return sum(self._scatter('get_chunk_count'))
+    
+    def list_documents(self) -> List[dict]:
+        documents: Dict[str, dict] = {}
+        for shard_documents in self._scatter('list_documents'):
+            for document in shard_documents:
+                existing = documents.get(document['document_id'])
+                if existing is None:
+                    documents[document['document_id']] = dict(document)
+                else:
+                    existing['chunk_count'] += document['chunk_count']
+        return list(documents.values())
+    
+    def clear(self) -> None:
+        self._scatter('clear')
+    
+    def _call(self, shard_index: int, method: str, *args, **kwargs):
+        shard = self.shards[shard_index]
+        with shard.lock:
+            shard.send(method, *args, **kwargs)
+            return shard.receive()
+    
+    def _scatter(self, method: str, *args, **kwargs) -> list:
+        requests = {shard_index: (args, kwargs) for shard_index in range(self.shard_count)}
+        responses = self._scatter_each(method, requests)
+        return [responses[shard_index] for shard_index in range(self.shard_count)]
+    
+    def _scatter_each(self, method: str, requests: Dict[int, Tuple[tuple, dict]]) -> dict:
+        """先向所有目标分片发出请求再依次收取结果，各分片并行执行；按分片序号加锁避免死锁"""
+        shards = [self.shards[shard_index] for shard_index in sorted(requests)]
+        for shard in shards:
+            shard.lock.acquire()
+        try:
+            for shard in shards:
+                args, kwargs = requests[shard.shard_index]
+                shard.send(method, *args, **kwargs)
+            
+            responses = {}
+            error = None
+            # 即使某个分片失败也要收完其余分片的回复，保持管道上请求与回复一一对应
+            for shard in shards:
+                try:
+                    responses[shard.shard_index] = shard.receive()
+                except ShardError as e:
+                    error = error or e
+            if error is not None:
+                raise error
+            return responses
+        finally:
+            for shard in shards:
+                shard.lock.release()
+    
+    def _check_layout(self) -> None:
+        """分片数写入 index_dir/shards.json；文档按哈希取模分配，分片数不能在已有数据上改变"""
+        os.makedirs(settings.index_dir, exist_ok=True)
+        path = os.path.join(settings.index_dir, SHARDS_FILE)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                existing = json.load(f)['shard_count']
+            if existing != self.shard_count:
+                raise ValueError(f"索引目录已按 {existing} 个分片建立，不能改为 {self.shard_count} 个")
+            return
+        
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'shard_count': self.shard_count}, f)
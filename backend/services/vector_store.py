@@ -1,6 +1,7 @@
 import os
-import pickle
-from typing import List, Optional, Tuple
+import time
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
 import numpy as np
 
 try:
@@ -11,135 +12,845 @@ except ImportError:
 
 from core.config import settings
 from services.embedding_service import EmbeddingService
+from services.index_persistence import IndexPersistence
+from services.lexical_index import SNAPSHOT_FILE, LexicalIndex, reciprocal_rank_fusion, write_snapshot
+from services.metrics import CHUNKS, timed
+from services.ann_index import (
+    INDEX_TYPE_ALIASES,
+    QUANTIZED_INDEX_TYPES,
+    TRAINED_INDEX_TYPES,
+    LayeredIndex,
+    clone_index,
+    create_index,
+    id_selector,
+    index_type_of,
+    resolve_index_type,
+    search_parameters,
+    supports_remove,
+)
+from utils.rwlock import ReadWriteLock
+
+
+# 建立倒排索引、可用于预过滤检索的元数据字段
+FILTER_FIELDS = ('document_id', 'filename')
+# 后台建立倒排索引时每批的文本块数：锁外分词，锁内只合并倒排表
+LEXICAL_BATCH_SIZE = 512
+
+
+def document_id_of(chunk: dict) -> str:
+    """文本块所属文档 ID (chunk_id 形如 {document_id}_chunk_{n})"""
+    return chunk.get('chunk_id', '').split('_chunk_')[0]
+
+
+def changed_keys(chunks: List[dict]) -> Tuple[Set[str], Set[str]]:
+    """一批文本块涉及的 (文档 ID, 文件名) 集合，用于通知缓存失效"""
+    document_ids = {document_id_of(chunk) for chunk in chunks}
+    filenames = {chunk.get('metadata', {}).get('filename') for chunk in chunks}
+    filenames.discard(None)
+    return document_ids, filenames
 
 
 class VectorStore:
     """向量存储与检索服务 - 使用 FAISS 实现高效向量搜索"""
     
-    def __init__(self, embedding_service: Optional[EmbeddingService] = None):
-        self.embedding_service = embedding_service or EmbeddingService()
-        self.dimension = self.embedding_service.get_embedding_dimension()
-        self.index: Optional[faiss.IndexFlatIP] = None
-        self.chunks: List[dict] = []
-        self.document_ids: List[str] = []
+    def __init__(
+        self,
+        embedding_service: Optional[EmbeddingService] = None,
+        index_dir: Optional[str] = None,
+        dimension: Optional[int] = None
+    ):
+        # 只给出 dimension 时不加载嵌入模型，写入与检索都需传入已算好的向量 (分片进程使用)
+        self.embedding_service = embedding_service
+        if embedding_service is None and dimension is None:
+            self.embedding_service = EmbeddingService()
+        self.dimension = dimension or self.embedding_service.get_embedding_dimension()
+        self.index: Optional[faiss.Index] = None
+        self.index_type: Optional[str] = None
+        self.field_index: Dict[str, Dict[str, List[int]]] = {field: {} for field in FILTER_FIELDS}
+        self.lexical_index = LexicalIndex()
+        self.persistence = IndexPersistence(index_dir or settings.index_dir, self.dimension)
+        self.chunk_store = self.persistence.chunk_store
+        self._stale_ids: Set[int] = set()
+        # 加载后在后台重建倒排索引：[_lexical_cursor, _lexical_end) 内的 ID 尚未建立
+        self._lexical_cursor = 0
+        self._lexical_end = 0
+        # 倒排索引每次清空或重新加载时加一，后台线程据此丢弃过期的批次
+        self._lexical_generation = 0
+        # _lock 串行化写入与后台任务 (可在其中落盘)；_search_lock 的写锁只包住内存状态的修改，检索只取读锁
+        self._lock = threading.RLock()
+        self._search_lock = ReadWriteLock()
+        # 后台合并/重建各只允许一个：非阻塞获取，线程结束时释放
+        self._compaction_lock = threading.Lock()
+        self._migration_lock = threading.Lock()
+        self._migration_deletes: Optional[List[int]] = None
+        self._change_listeners: List[Callable[[Set[str], Set[str]], None]] = []
+        # 已跟进到的提交位置：向量行数、各日志段的删除条数与基线快照，用于跟进其他进程的写入
+        self._epoch = 0
+        self._synced_count = 0
+        self._seen_deletes: Dict[str, int] = {}
+        self._base_key: Optional[str] = None
+        self._lexical_thread: Optional[threading.Thread] = None
+        self._watcher: Optional[threading.Thread] = None
+    
+    @property
+    def document_index(self) -> Dict[str, List[int]]:
+        return self.field_index['document_id']
+    
+    @property
+    def deleted_count(self) -> int:
+        return self.chunk_store.deleted_count
+    
+    @property
+    def lexical_ready(self) -> bool:
+        return self._lexical_cursor >= self._lexical_end
+    
+    def add_change_listener(self, listener: Callable[[Set[str], Set[str]], None]) -> None:
+        """注册文档变更回调 listener(document_ids, filenames)，在写入或删除文本块后调用"""
+        self._change_listeners.append(listener)
+    
+    def _notify_change(self, chunks: List[dict]) -> None:
+        if not self._change_listeners:
+            return
+        document_ids, filenames = changed_keys(chunks)
+        for listener in self._change_listeners:
+            listener(document_ids, filenames)
     
     def _create_index(self) -> faiss.Index:
-        index = faiss.IndexFlatIP(self.dimension)
-        index = faiss.IndexIDMap(index)
-        return index
+        self.index_type = resolve_index_type(settings.vector_store_type, 0)
+        return create_index(self.index_type, self.dimension)
     
     def add_chunks(self, chunks: List[dict]) -> None:
         if not chunks:
             return
         
         texts = [chunk['content'] for chunk in chunks]
-        embeddings = self.embedding_service.embed_texts(texts)
+        self.add_embeddings(chunks, self.embedding_service.embed_texts(texts))
+    
+    @timed('index_add')
+    def add_embeddings(self, chunks: List[dict], embeddings: np.ndarray) -> None:
+        """写入文本块及其已计算好的向量 (与 chunks 一一对应)"""
+        if not chunks:
+            return
         
         norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
         norms = np.where(norms == 0, 1, norms)
-        normalized_embeddings = embeddings / norms
+        normalized_embeddings = (embeddings / norms).astype(np.float32)
         
-        if self.index is None:
-            self.index = self._create_index()
+        with self._lock, self.persistence.write_lock():
+            self._sync_locked()
+            start_id = len(self.chunk_store)
+            ids = np.arange(start_id, start_id + len(chunks), dtype=np.int64)
+            self._save_index(ids, normalized_embeddings, chunks)
+            with self._search_lock.write():
+                self._add_vectors(ids, normalized_embeddings, chunks)
+            self._mark_synced()
         
-        start_id = len(self.chunks)
-        ids = np.array(range(start_id, start_id + len(chunks)))
+        CHUNKS.inc(len(chunks), operation='indexed')
+        self._notify_change(chunks)
+        self._maybe_compact()
+        self._maybe_migrate()
+    
+    def _add_vectors(self, ids: np.ndarray, embeddings: Optional[np.ndarray], chunks: List[dict]) -> None:
+        """把已写入 chunk_store 的一批文本块加入向量索引、倒排索引与字段索引；embeddings 为 None 时不更新向量索引"""
+        if embeddings is not None:
+            if self.index is None:
+                self.index = self._create_index()
+            self.index.add_with_ids(embeddings, ids)
+        self.lexical_index.add(ids.tolist(), (chunk['content'] for chunk in chunks))
         
-        self.index.add_with_ids(normalized_embeddings, ids)
-        self.chunks.extend(chunks)
+        for vector_id in ids.tolist():
+            self._index_fields(vector_id)
+    
+    def _field_values(self, vector_id: int) -> Dict[str, Optional[str]]:
+        return {
+            'document_id': self.chunk_store.document_id(vector_id),
+            'filename': self.chunk_store.filename(vector_id),
+        }
+    
+    def _index_fields(self, vector_id: int) -> None:
+        for field, value in self._field_values(vector_id).items():
+            if value is not None:
+                self.field_index[field].setdefault(value, []).append(vector_id)
+    
+    def _build_field_index(self) -> None:
+        """由字符串编号列一次性分组建立字段倒排索引"""
+        self.field_index = {field: {} for field in FILTER_FIELDS}
+        live_ids = self.chunk_store.live_ids()
+        columns = {'document_id': 'document', 'filename': 'filename'}
+        for field, column in columns.items():
+            codes = np.asarray(self.chunk_store.column(column))[live_ids]
+            order = np.argsort(codes, kind='stable')
+            codes, ids = codes[order], live_ids[order]
+            values, starts = np.unique(codes, return_index=True)
+            for code, group in zip(values.tolist(), np.split(ids, starts[1:])):
+                if code >= 0:
+                    self.field_index[field].setdefault(self.chunk_store.strings[code], []).extend(group.tolist())
+    
+    def delete_document(self, document_id: str) -> int:
+        """删除单个文档的全部文本块，返回删除的块数"""
+        with self._lock, self.persistence.write_lock():
+            self._sync_locked()
+            ids = self.document_index.get(document_id)
+            if not ids:
+                return 0
+            
+            ids = np.array(ids, dtype=np.int64)
+            removed = [self.chunk_store.get(vector_id) for vector_id in ids.tolist()]
+            self.persistence.append_tombstones(ids)
+            with self._search_lock.write():
+                self._remove_vectors(ids)
+            self._mark_synced()
         
-        for chunk in chunks:
-            doc_id = chunk.get('chunk_id', '').split('_chunk_')[0]
-            self.document_ids.append(doc_id)
+        CHUNKS.inc(len(ids), operation='deleted')
+        self._notify_change(removed)
+        self._maybe_compact()
+        self._maybe_migrate()
+        return len(ids)
+    
+    def _remove_vectors(self, ids: np.ndarray, update_index: bool = True) -> List[dict]:
+        """从索引中移除向量，并在 chunk_store 中标记删除；返回本次新删除的文本块"""
+        if update_index and self.index is not None and len(ids):
+            if isinstance(self.index, LayeredIndex):
+                # 内存映射的基线不可修改，基线中的向量检索时排除
+                self.index.remove_ids(ids)
+                self._stale_ids.update(i for i in ids.tolist() if i not in self.index.delta_ids)
+            elif supports_remove(self.index_type):
+                self.index.remove_ids(ids)
+            else:
+                # HNSW 不支持删除：检索时通过 IDSelector 排除，重建索引时清理
+                self._stale_ids.update(ids.tolist())
+        if self._migration_deletes is not None:
+            self._migration_deletes.extend(ids.tolist())
+        
+        newly_deleted = self.chunk_store.mark_deleted(ids).tolist()
+        removed = set(newly_deleted)
+        # 后台重建尚未覆盖到的 ID 不在倒排索引中
+        indexed = [vector_id for vector_id in removed
+                   if not self._lexical_cursor <= vector_id < self._lexical_end]
+        self.lexical_index.remove(indexed, (self.chunk_store.content(vector_id) for vector_id in indexed))
+        
+        affected = set()
+        for vector_id in removed:
+            for field, value in self._field_values(vector_id).items():
+                if value is not None:
+                    affected.add((field, value))
         
-        self._save_index()
+        for field, value in affected:
+            postings = self.field_index[field]
+            remaining = [i for i in postings.get(value, []) if i not in removed]
+            if remaining:
+                postings[value] = remaining
+            else:
+                postings.pop(value, None)
+        
+        return [self._removed_chunk(vector_id) for vector_id in newly_deleted]
+    
+    def _removed_chunk(self, vector_id: int) -> dict:
+        """已删除文本块的最小描述 (chunk_id 与文件名)，用于通知缓存失效"""
+        return {
+            'chunk_id': f"{self.chunk_store.document_id(vector_id)}_chunk_",
+            'metadata': {'filename': self.chunk_store.filename(vector_id)},
+        }
     
     def search(
         self, 
         query: str, 
         top_k: Optional[int] = None,
-        filter_document_id: Optional[str] = None
+        filter_document_id: Optional[str] = None,
+        filters: Optional[Dict[str, str]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        hybrid: Optional[bool] = None
     ) -> List[Tuple[dict, float]]:
-        top_k = top_k or settings.similarity_top_k
-        
-        if self.index is None or len(self.chunks) == 0:
+        if self.index is None or self.get_chunk_count() == 0:
             return []
         
         query_embedding = self.embedding_service.embed_text(query)
+        return self.search_by_vector(query_embedding, top_k, filter_document_id, filters,
+                                     nprobe=nprobe, ef_search=ef_search, query=query, hybrid=hybrid)
+    
+    def search_by_vector(
+        self,
+        query_embedding: np.ndarray,
+        top_k: Optional[int] = None,
+        filter_document_id: Optional[str] = None,
+        filters: Optional[Dict[str, str]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        query: Optional[str] = None,
+        hybrid: Optional[bool] = None
+    ) -> List[Tuple[dict, float]]:
+        """向量检索；提供查询文本且启用混合检索时，与 BM25 结果做倒数排名融合
+        
+        融合只决定排序，返回的分数仍是查询与文本块的余弦相似度。
+        """
+        filters = dict(filters or {})
+        if filter_document_id:
+            filters['document_id'] = filter_document_id
+        
+        return self.search_batch(
+            query_embedding.reshape(1, -1), [top_k], [filters],
+            nprobe=nprobe, ef_search=ef_search, queries=[query], hybrid=hybrid
+        )[0]
+    
+    @timed('vector_search')
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        top_ks: Optional[List[Optional[int]]] = None,
+        filters: Optional[List[Optional[Dict[str, str]]]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        queries: Optional[List[Optional[str]]] = None,
+        hybrid: Optional[bool] = None
+    ) -> List[List[Tuple[dict, float]]]:
+        """批量检索 N×d 查询矩阵，按查询返回结果；过滤条件相同的查询共用一次 FAISS search"""
+        embeddings, top_ks = self._prepare_queries(query_embeddings, top_ks)
+        
+        # 写入可能在线程池中进行，检索期间持读锁保证索引与倒排表一致；落盘不占用读写锁
+        with self._search_lock.read():
+            candidates = self._search_candidates(embeddings, top_ks, filters, nprobe, ef_search, queries, hybrid)
+            results = []
+            for row, (dense, lexical) in enumerate(candidates):
+                if lexical is None:
+                    results.append([(self.chunk_store.get(idx), score) for idx, score in dense])
+                else:
+                    results.append(self._fuse(embeddings[row], dense, lexical, top_ks[row]))
+        return results
+    
+    def search_candidates(
+        self,
+        query_embeddings: np.ndarray,
+        top_ks: Optional[List[Optional[int]]] = None,
+        filters: Optional[List[Optional[Dict[str, str]]]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        queries: Optional[List[Optional[str]]] = None,
+        hybrid: Optional[bool] = None
+    ) -> List[Tuple[List[Tuple[int, dict, float]], Optional[List[Tuple[int, dict, float, float]]]]]:
+        """返回融合前的候选，供分片汇总后统一融合
+        
+        每个查询为 (向量候选 [(ID, 文本块, 余弦)], BM25 候选 [(ID, 文本块, BM25 分数, 余弦)] 或 None)。
+        """
+        embeddings, top_ks = self._prepare_queries(query_embeddings, top_ks)
+        
+        with self._search_lock.read():
+            candidates = self._search_candidates(embeddings, top_ks, filters, nprobe, ef_search, queries, hybrid)
+            results = []
+            for row, (dense, lexical) in enumerate(candidates):
+                dense_hits = [(idx, self.chunk_store.get(idx), score) for idx, score in dense]
+                lexical_hits = None
+                if lexical is not None:
+                    ids = np.array([idx for idx, _ in lexical], dtype=np.int64)
+                    similarities = self._similarities(embeddings[row], ids).tolist()
+                    lexical_hits = [
+                        (idx, self.chunk_store.get(idx), score, similarity)
+                        for (idx, score), similarity in zip(lexical, similarities)
+                    ]
+                results.append((dense_hits, lexical_hits))
+        return results
+    
+    def _prepare_queries(
+        self,
+        query_embeddings: np.ndarray,
+        top_ks: Optional[List[Optional[int]]]
+    ) -> Tuple[np.ndarray, List[int]]:
+        n_queries = len(query_embeddings)
+        top_ks = [top_k or settings.similarity_top_k for top_k in (top_ks or [None] * n_queries)]
+        embeddings = np.asarray(query_embeddings, dtype=np.float32).reshape(n_queries, -1)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms), top_ks
+    
+    def _search_candidates(
+        self,
+        embeddings: np.ndarray,
+        top_ks: List[int],
+        filters: Optional[List[Optional[Dict[str, str]]]],
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        queries: Optional[List[Optional[str]]],
+        hybrid: Optional[bool]
+    ) -> List[Tuple[List[Tuple[int, float]], Optional[List[Tuple[int, float]]]]]:
+        """按过滤条件分组检索，返回每个查询的向量候选与 BM25 候选 (未启用混合检索时为 None)；调用方持读锁"""
+        n_queries = len(embeddings)
+        filters = filters or [None] * n_queries
+        queries = queries or [None] * n_queries
+        hybrid = settings.hybrid_search_enabled if hybrid is None else hybrid
+        candidates: List[Tuple[List[Tuple[int, float]], Optional[List[Tuple[int, float]]]]] = [
+            ([], None) for _ in range(n_queries)
+        ]
         
-        query_norm = np.linalg.norm(query_embedding)
-        if query_norm > 0:
-            query_embedding = query_embedding / query_norm
+        if self.index is None or self.get_chunk_count() == 0 or n_queries == 0:
+            return candidates
         
-        query_embedding = query_embedding.reshape(1, -1).astype(np.float32)
+        groups: Dict[Tuple[Tuple[str, str], ...], List[int]] = {}
+        for row, row_filters in enumerate(filters):
+            key = tuple(sorted((field, value) for field, value in (row_filters or {}).items() if value))
+            groups.setdefault(key, []).append(row)
         
-        search_k = min(top_k * 2, self.index.ntotal)
-        scores, indices = self.index.search(query_embedding, search_k)
+        stale_ids = np.fromiter(self._stale_ids, dtype=np.int64) if self._stale_ids else None
         
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < 0 or idx >= len(self.chunks):
+        for key, rows in groups.items():
+            candidate_ids = self._candidate_ids(dict(key))
+            if candidate_ids is not None and len(candidate_ids) == 0:
                 continue
             
-            chunk = self.chunks[idx]
-            
-            if filter_document_id:
-                chunk_doc_id = chunk.get('chunk_id', '').split('_chunk_')[0]
-                if chunk_doc_id != filter_document_id:
-                    continue
+            # 预过滤：只在满足条件的向量 ID 子集内检索，保证过滤后的 top-k 完整
+            selector = id_selector(candidate_ids, stale_ids)
+            params = search_parameters(self.index_type, selector, nprobe=nprobe, ef_search=ef_search)
             
-            results.append((chunk, float(score)))
+            # 倒排索引仍在后台重建时退回纯向量检索
+            use_lexical = [bool(hybrid and queries[row] and self.lexical_ready) for row in rows]
+            fetch_ks = [
+                top_ks[row] * settings.hybrid_fetch_multiplier if lexical else top_ks[row]
+                for row, lexical in zip(rows, use_lexical)
+            ]
+            # 量化基线 + 增量层时两层分数尺度不同，必须重排
+            rescore = self.index_type in QUANTIZED_INDEX_TYPES and (
+                settings.rescore_multiplier > 1 or isinstance(self.index, LayeredIndex)
+            )
+            search_k = max(fetch_ks) * (settings.rescore_multiplier if rescore else 1)
+            search_k = min(search_k, self.index.ntotal if candidate_ids is None else len(candidate_ids))
+            scores, indices = self.index.search(embeddings[rows], search_k, params=params)
             
-            if len(results) >= top_k:
-                break
+            for position, row in enumerate(rows):
+                fetch_k = fetch_ks[position]
+                limit = scores.shape[1] if rescore else fetch_k
+                dense = [
+                    (int(idx), float(score))
+                    for score, idx in zip(scores[position][:limit], indices[position][:limit])
+                    if 0 <= idx < len(self.chunk_store) and not self.chunk_store.deleted[idx]
+                ]
+                if rescore:
+                    dense = self._rescore(embeddings[row], dense)[:fetch_k]
+                lexical = None
+                if use_lexical[position]:
+                    lexical = self.lexical_index.search(queries[row], fetch_k, candidate_ids)
+                candidates[row] = (dense, lexical)
         
-        return results
+        return candidates
+    
+    def _similarities(self, query_embedding: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """用内存映射的全精度向量计算余弦相似度；按 ID 升序读取，磁盘访问更连续"""
+        order = np.argsort(ids)
+        similarities = np.empty(len(ids), dtype=np.float32)
+        if len(ids):
+            similarities[order] = np.asarray(self.persistence.vectors[ids[order]]) @ query_embedding
+        return similarities
+    
+    def _rescore(self, query_embedding: np.ndarray, candidates: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+        """用全精度向量重新计算量化索引候选的相似度并排序"""
+        ids = np.array([idx for idx, _ in candidates], dtype=np.int64)
+        scores = self._similarities(query_embedding, ids)
+        ranked = np.argsort(-scores, kind='stable')
+        return [(int(ids[i]), float(scores[i])) for i in ranked]
+    
+    def _fuse(
+        self,
+        query_embedding: np.ndarray,
+        dense: List[Tuple[int, float]],
+        lexical: List[Tuple[int, float]],
+        top_k: int
+    ) -> List[Tuple[dict, float]]:
+        fused = reciprocal_rank_fusion([[idx for idx, _ in dense], [idx for idx, _ in lexical]])[:top_k]
+        
+        # 只由 BM25 召回的文本块，用全精度向量补算相似度
+        similarities = dict(dense)
+        missing = np.array([idx for idx, _ in fused if idx not in similarities], dtype=np.int64)
+        if len(missing):
+            similarities.update(zip(missing.tolist(), self._similarities(query_embedding, missing).tolist()))
+        
+        return [(self.chunk_store.get(idx), float(similarities[idx])) for idx, _ in fused]
+    
+    def _candidate_ids(self, filters: Dict[str, str]) -> Optional[np.ndarray]:
+        """按倒排索引求各过滤条件的向量 ID 交集；无过滤条件时返回 None"""
+        filters = {field: value for field, value in filters.items() if value}
+        if not filters:
+            return None
+        
+        postings = []
+        for field, value in filters.items():
+            if field not in self.field_index:
+                raise ValueError(f"不支持的过滤字段: {field}")
+            postings.append(self.field_index[field].get(value, []))
+        
+        postings.sort(key=len)
+        candidates = np.array(postings[0], dtype=np.int64)
+        for other in postings[1:]:
+            candidates = np.intersect1d(candidates, np.array(other, dtype=np.int64), assume_unique=True)
+        return candidates
     
     def get_all_chunks(self) -> List[dict]:
-        return self.chunks
+        return [chunk for _, chunk in self.chunk_store.iter_live()]
     
     def get_chunk_count(self) -> int:
-        return len(self.chunks)
+        return self.chunk_store.live_count
+    
+    def list_documents(self) -> List[dict]:
+        """按元数据中的 document_id 汇总文档 (文件名、块数)，只读取编号列，不解码文本块"""
+        with self._search_lock.read():
+            live_ids = self.chunk_store.live_ids()
+            codes = np.asarray(self.chunk_store.column('meta_document_id'))[live_ids]
+            filenames = np.asarray(self.chunk_store.column('filename'))[live_ids]
+        
+        values, first, counts = np.unique(codes, return_index=True, return_counts=True)
+        strings = self.chunk_store.strings
+        documents = []
+        for code, row, count in sorted(zip(values.tolist(), first.tolist(), counts.tolist()), key=lambda x: x[1]):
+            filename = int(filenames[row])
+            documents.append({
+                'document_id': strings[code] if code >= 0 else 'unknown',
+                'filename': strings[filename] if filename >= 0 else 'Unknown',
+                'chunk_count': count,
+            })
+        return documents
     
     def clear(self) -> None:
-        self.index = None
-        self.chunks = []
-        self.document_ids = []
+        with self._lock, self._search_lock.write():
+            self.index = None
+            self.index_type = None
+            self._stale_ids = set()
+            self.field_index = {field: {} for field in FILTER_FIELDS}
+            self.lexical_index.clear()
+            self._lexical_generation += 1
+            self._lexical_cursor = self._lexical_end = 0
+            self.persistence.clear()
+            self._mark_synced()
+    
+    def compact(self) -> None:
+        """将日志段合并为新的基线快照；写盘在锁外进行，不阻塞写入与检索"""
+        with self._lock:
+            if self.index is None:
+                return
+            with self.persistence.write_lock():
+                self._sync_locked()
+                generation = self.persistence.rotate()
+                self._mark_synced()
+            deleted_ids = self.chunk_store.deleted_ids()
+            if isinstance(self.index, LayeredIndex):
+                # 基线只读映射：合并时从文件读取一份可修改的副本，再并入增量层
+                layered = self.index
+                base_key = self._base_key
+                delta_ids = np.array(sorted(layered.delta_ids), dtype=np.int64)
+                stale_ids = np.fromiter(self._stale_ids, dtype=np.int64) if self._stale_ids else None
+                index = None
+            else:
+                index = clone_index(self.index)
+        
+        if index is None:
+            # 持写锁读取，避免其他进程提交新快照时清理掉正在读取的文件 (与非映射模式下持锁复制索引的开销相当)
+            with self.persistence.write_lock():
+                if self.persistence.base_key != base_key:
+                    return
+                base, _ = self.persistence.read_base()
+            if stale_ids is not None and supports_remove(index_type_of(base)):
+                base.remove_ids(stale_ids)
+            if len(delta_ids):
+                base.add_with_ids(np.asarray(self.persistence.vectors[delta_ids]), delta_ids)
+            index = base
+        
+        if self.persistence.write_base(generation, index, deleted_ids) and settings.index_mmap:
+            # 切换到内存映射的新快照，释放本进程持有的索引副本
+            self.refresh(force=True)
+        self.save_lexical_index()
+    
+    def refresh(self, force: bool = False) -> bool:
+        """跟进其他进程 (如 uvicorn 的其他 worker) 已提交的写入、删除与新快照，返回是否有变化"""
+        if not force and not self.persistence.manifest_changed():
+            return False
+        
+        with self._lock, self.persistence.write_lock():
+            return self._sync_locked(force)
+    
+    def _sync_locked(self, force: bool = False) -> bool:
+        """持有写锁时把内存状态追平到磁盘上的清单；基线快照变化时原子替换索引"""
+        with self._search_lock.write():
+            return self._apply_manifest(force)
+    
+    def _apply_manifest(self, force: bool) -> bool:
+        manifest = self.persistence.manifest
+        count = manifest['vector_count']
+        if self.persistence.epoch != self._epoch:
+            # 其他进程清空了索引
+            self._load_index()
+            self._notify_change([])
+            return True
+        
+        swap = force or self.persistence.base_key != self._base_key
+        changed: List[dict] = []
+        
+        # 新快照会包含这些向量，只需更新倒排索引与字段索引
+        batch_size = 4096
+        for start in range(self._synced_count, count, batch_size):
+            ids = np.arange(start, min(start + batch_size, count), dtype=np.int64)
+            embeddings = None if swap else np.asarray(self.persistence.vectors[ids])
+            chunks = [self.chunk_store.get(vector_id) for vector_id in ids.tolist()]
+            self._add_vectors(ids, embeddings, chunks)
+            changed.extend(chunks)
         
-        index_file = os.path.join(settings.index_dir, 'faiss.index')
-        chunks_file = os.path.join(settings.index_dir, 'chunks.pkl')
+        for log in manifest['logs']:
+            seen = self._seen_deletes.get(log['name'], 0)
+            if log.get('deleted', 0) > seen:
+                deleted = self.persistence.read_deletes(log, seen)
+                changed.extend(self._remove_vectors(deleted, update_index=not swap))
         
-        for f in [index_file, chunks_file]:
-            if os.path.exists(f):
-                os.remove(f)
+        if swap:
+            base, base_deleted = self.persistence.read_base(settings.index_mmap)
+            changed.extend(self._remove_vectors(base_deleted, update_index=False))
+            self._open_index(base, base_deleted)
+        
+        self._mark_synced()
+        if changed:
+            self._notify_change(changed)
+        return bool(changed) or swap
+    
+    def _mark_synced(self) -> None:
+        manifest = self.persistence.manifest
+        self._epoch = self.persistence.epoch
+        self._synced_count = manifest['vector_count']
+        self._seen_deletes = {log['name']: log.get('deleted', 0) for log in manifest['logs']}
+        self._base_key = self.persistence.base_key
     
-    def _save_index(self) -> None:
-        if self.index is None:
+    def _open_index(self, base: Optional["faiss.Index"], base_deleted: np.ndarray) -> None:
+        """由基线快照与日志段中的向量建立检索索引；chunk_store 的删除标记需已是最新"""
+        index = base
+        self.index_type = index_type_of(base) if base is not None else None
+        if base is not None and settings.index_mmap:
+            index = LayeredIndex(base, self.dimension)
+        
+        for ids, embeddings, _ in self.persistence.iter_logs():
+            if len(ids):
+                if index is None:
+                    index = self._create_index()
+                index.add_with_ids(embeddings, ids)
+        
+        deleted = self.chunk_store.deleted_ids()
+        stale_ids = deleted
+        if isinstance(index, LayeredIndex):
+            index.remove_ids(deleted)
+            stale_ids = deleted[~np.isin(deleted, list(index.delta_ids))]
+            if supports_remove(self.index_type):
+                stale_ids = np.setdiff1d(stale_ids, base_deleted)
+        elif supports_remove(self.index_type):
+            if index is not None:
+                index.remove_ids(np.setdiff1d(deleted, base_deleted))
+            stale_ids = np.empty(0, dtype=np.int64)
+        
+        self.index = index
+        self._stale_ids = set(stale_ids.tolist())
+    
+    def _maybe_compact(self) -> None:
+        if (self.persistence.pending_count < settings.index_compaction_threshold
+                and self.persistence.pending_deletes < settings.index_tombstone_threshold):
+            return
+        if not self._compaction_lock.acquire(blocking=False):
             return
         
-        index_file = os.path.join(settings.index_dir, 'faiss.index')
-        chunks_file = os.path.join(settings.index_dir, 'chunks.pkl')
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"索引合并失败: {e}")
+            finally:
+                self._compaction_lock.release()
         
-        faiss.write_index(self.index, index_file)
+        threading.Thread(target=run, name="index-compaction", daemon=True).start()
+    
+    def rebuild_index(self, index_type: Optional[str] = None) -> None:
+        """用全精度向量重建索引 (可切换索引类型)；构建在锁外进行，完成后原子替换"""
+        with self._lock:
+            live_ids = self.chunk_store.live_ids()
+            built_upto = len(self.chunk_store)
+            index_type = index_type or resolve_index_type(settings.vector_store_type, len(live_ids))
+            self._migration_deletes = []
         
-        with open(chunks_file, 'wb') as f:
-            pickle.dump({'chunks': self.chunks, 'document_ids': self.document_ids}, f)
+        try:
+            vectors = self.persistence.vectors
+            index = create_index(index_type, self.dimension, len(live_ids))
+            
+            if index_type in TRAINED_INDEX_TYPES:
+                sample_size = min(len(live_ids), settings.ann_training_sample_size)
+                sample = np.sort(np.random.default_rng(0).choice(live_ids, sample_size, replace=False))
+                index.train(np.asarray(vectors[sample]))
+            
+            batch_size = 65536
+            for start in range(0, len(live_ids), batch_size):
+                batch = live_ids[start:start + batch_size]
+                index.add_with_ids(np.asarray(vectors[batch]), batch)
+            
+            with self._lock, self._search_lock.write():
+                # 追平构建期间的新增与删除
+                tail_ids = self.chunk_store.live_ids(built_upto)
+                if len(tail_ids):
+                    index.add_with_ids(np.asarray(self.persistence.vectors[tail_ids]), tail_ids)
+                
+                stale_ids = set()
+                deleted = np.array(self._migration_deletes, dtype=np.int64)
+                if len(deleted):
+                    if supports_remove(index_type):
+                        index.remove_ids(deleted)
+                    else:
+                        stale_ids = set(deleted.tolist())
+                
+                self.index = index
+                self.index_type = index_type
+                self._stale_ids = stale_ids
+        finally:
+            self._migration_deletes = None
     
-    def _load_index(self) -> None:
-        index_file = os.path.join(settings.index_dir, 'faiss.index')
-        chunks_file = os.path.join(settings.index_dir, 'chunks.pkl')
+    def _maybe_migrate(self) -> None:
+        """按语料规模自动切换索引类型，或在 HNSW 墓碑过多时重建"""
+        if self.index is None or self._migration_lock.locked():
+            return
+        
+        target = resolve_index_type(settings.vector_store_type, self.get_chunk_count())
+        configured = INDEX_TYPE_ALIASES.get(settings.vector_store_type, settings.vector_store_type)
+        if target == 'flat' and configured != 'flat':
+            target = self.index_type
+        
+        if target == self.index_type and len(self._stale_ids) < settings.index_tombstone_threshold:
+            return
         
-        if not os.path.exists(index_file) or not os.path.exists(chunks_file):
+        if not self._migration_lock.acquire(blocking=False):
             return
         
+        def run():
+            try:
+                self.rebuild_index(target)
+                self.compact()
+            except Exception as e:
+                print(f"索引重建失败: {e}")
+            finally:
+                self._migration_lock.release()
+        
+        threading.Thread(target=run, name="index-migration", daemon=True).start()
+    
+    @timed('index_persist')
+    def _save_index(self, ids: np.ndarray, embeddings: np.ndarray, chunks: List[dict]) -> None:
+        """增量持久化：仅追加本次新增的向量与文本块"""
+        self.persistence.append(ids, embeddings, chunks)
+    
+    def load(self) -> None:
+        """从磁盘加载已持久化的索引与文本块元数据"""
+        with self._lock, self.persistence.write_lock():
+            self._load_index()
+        self._start_watcher()
+        self._maybe_migrate()
+    
+    def _load_index(self) -> None:
+        """加载索引；调用方持有写锁"""
+        with self._search_lock.write():
+            self._open_persisted()
+    
+    def _open_persisted(self) -> None:
         try:
-            self.index = faiss.read_index(index_file)
-            with open(chunks_file, 'rb') as f:
-                data = pickle.load(f)
-                self.chunks = data.get('chunks', [])
-                self.document_ids = data.get('document_ids', [])
+            index, base_deleted = self.persistence.load(settings.index_mmap)
+            self.chunk_store.mark_deleted(base_deleted)
+            for _, _, deleted in self.persistence.iter_logs():
+                self.chunk_store.mark_deleted(deleted)
+            self._open_index(index, base_deleted)
+            self._build_field_index()
+            self._mark_synced()
+            
+            # 倒排索引从快照恢复，快照之后写入的部分由后台线程从 chunk_store 建立，期间混合检索退回纯向量检索
+            self.lexical_index.clear()
+            self._lexical_generation += 1
+            self._lexical_cursor = self._restore_lexical_index()
+            self._lexical_end = len(self.chunk_store)
+            if self._lexical_end and not (self._lexical_thread and self._lexical_thread.is_alive()):
+                self._lexical_thread = threading.Thread(
+                    target=self._build_lexical_index, name="lexical-index", daemon=True
+                )
+                self._lexical_thread.start()
         except Exception as e:
             print(f"加载索引失败: {e}")
             self.index = None
-            self.chunks = []
-            self.document_ids = []
+            self.index_type = None
+            self._stale_ids = set()
+            self.field_index = {field: {} for field in FILTER_FIELDS}
+            self.lexical_index.clear()
+            self._lexical_generation += 1
+            self._lexical_cursor = self._lexical_end = 0
+    
+    def _start_watcher(self) -> None:
+        """后台定期检查清单，跟进同一索引目录下其他进程的提交"""
+        if settings.index_watch_interval <= 0 or self._watcher is not None:
+            return
+        
+        def run():
+            while True:
+                time.sleep(settings.index_watch_interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"跟进索引更新失败: {e}")
+        
+        self._watcher = threading.Thread(target=run, name="index-watcher", daemon=True)
+        self._watcher.start()
+    
+    def _build_lexical_index(self) -> None:
+        """分批建立倒排索引：锁内只读取文本、合并倒排表，分词在锁外进行，不阻塞写入与检索"""
+        built = False
+        while True:
+            with self._lock:
+                if self.lexical_ready:
+                    break
+                generation = self._lexical_generation
+                start = self._lexical_cursor
+                end = min(start + LEXICAL_BATCH_SIZE, self._lexical_end)
+                ids = self.chunk_store.live_ids(start, end).tolist()
+                texts = [self.chunk_store.content(vector_id) for vector_id in ids]
+            
+            analyzed = LexicalIndex.analyze(ids, texts)
+            
+            with self._lock, self._search_lock.write():
+                if generation != self._lexical_generation:
+                    # 分词期间索引被清空或重新加载
+                    continue
+                self.lexical_index.add_analyzed(analyzed)
+                self._lexical_cursor = end
+                # 分词期间删除的 ID 当时尚未建立，_remove_vectors 跳过了它们
+                dropped = [i for i, vector_id in enumerate(ids) if self.chunk_store.deleted[vector_id]]
+                self.lexical_index.remove([ids[i] for i in dropped], (texts[i] for i in dropped))
+                built = True
+        
+        if built:
+            self.save_lexical_index()
+    
+    @property
+    def _lexical_snapshot_path(self) -> str:
+        return os.path.join(self.persistence.index_dir, SNAPSHOT_FILE)
+    
+    def save_lexical_index(self) -> None:
+        """把倒排索引写成快照，重启时只需为快照之后写入的文本块分词；写盘在锁外进行"""
+        with self._lock:
+            if not self.lexical_ready or self._synced_count == 0:
+                return
+            snapshot = self.lexical_index.snapshot()
+            count = self._synced_count
+            epoch = self._epoch
+            deleted = self.chunk_store.deleted_ids()
+        
+        try:
+            write_snapshot(
+                self._lexical_snapshot_path, snapshot,
+                epoch=np.int64(epoch), count=np.int64(count), deleted=deleted[deleted < count]
+            )
+        except OSError as e:
+            print(f"保存倒排索引快照失败: {e}")
+    
+    def _restore_lexical_index(self) -> int:
+        """从快照恢复倒排索引，返回快照覆盖的向量 ID 数；快照之后删除的 ID 随即移出"""
+        extra = self.lexical_index.restore(self._lexical_snapshot_path)
+        if extra is None:
+            return 0
+        count = int(extra['count'])
+        if int(extra['epoch']) != self._epoch or count > len(self.chunk_store):
+            # 快照属于已清空的索引，或领先于当前已提交的数据
+            self.lexical_index.clear()
+            return 0
+        
+        deleted = np.setdiff1d(self.chunk_store.deleted_ids(), extra['deleted'])
+        deleted = deleted[deleted < count].tolist()
+        self.lexical_index.remove(deleted, (self.chunk_store.content(vector_id) for vector_id in deleted))
+        return count
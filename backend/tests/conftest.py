@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeBackend:
+    """替代真实推理后端：用 MockEmbeddingService 编码，并记录每次 encode 的文本"""
+    
+    def __init__(self, dimension: int):
+        from services.embedding_service import MockEmbeddingService
+        self.mock = MockEmbeddingService(dimension)
+        self.calls = []
+    
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        return self.mock.embed_texts(texts)
+
+
+@pytest.fixture
+def fake_backend(tmp_path, monkeypatch):
+    """EmbeddingService 使用假后端；索引与嵌入缓存写入临时目录"""
+    from core.config import settings
+    from services import embedding_service
+    
+    monkeypatch.setattr(settings, 'index_dir', str(tmp_path / 'index'))
+    monkeypatch.setattr(settings, 'embedding_dimension', 32)
+    backends = []
+    
+    def create_backend(backend=None, model_name=None):
+        backends.append(FakeBackend(settings.embedding_dimension))
+        return backends[-1]
+    
+    monkeypatch.setattr(embedding_service, 'create_backend', create_backend)
+    return backends
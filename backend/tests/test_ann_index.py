@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from core.config import settings
+from services.ann_index import MIN_POINTS_PER_CENTROID, LayeredIndex, create_index, resolve_index_type
+from services.vector_store import VectorStore
+
+DIMENSION = 16
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def test_layered_binary_base_keeps_delta_candidates():
+    rng = np.random.default_rng(0)
+    query = _normalize(rng.standard_normal((1, DIMENSION)))
+    # 与查询符号完全一致 (汉明距离 0，估计分数 1.0)，但精确内积很低
+    signs = np.sign(query[0])
+    base_vectors = np.tile(signs * 0.01, (8, 1))
+    base_vectors[:, 0] = np.arange(1, 9) * signs[0]
+    base = create_index('binary', DIMENSION)
+    base.add_with_ids(_normalize(base_vectors), np.arange(8, dtype=np.int64))
+    
+    layered = LayeredIndex(base, DIMENSION)
+    delta_vectors = _normalize(query + 0.1 * rng.standard_normal((3, DIMENSION)))
+    layered.add_with_ids(delta_vectors, np.arange(100, 103, dtype=np.int64))
+    
+    scores, ids = layered.search(query, 3)
+    assert {100, 101, 102} <= set(ids[0].tolist())
+    assert len(set(ids[0].tolist()) & set(range(8))) == 3
+
+
+def test_layered_flat_base_merges_top_k():
+    rng = np.random.default_rng(1)
+    vectors = _normalize(rng.standard_normal((40, DIMENSION)))
+    base = create_index('flat', DIMENSION)
+    base.add_with_ids(vectors[:30], np.arange(30, dtype=np.int64))
+    layered = LayeredIndex(base, DIMENSION)
+    layered.add_with_ids(vectors[30:], np.arange(30, 40, dtype=np.int64))
+    
+    query = vectors[35:36]
+    scores, ids = layered.search(query, 5)
+    expected = np.argsort(-(vectors @ query[0]), kind='stable')[:5]
+    assert ids.shape == (1, 5)
+    assert ids[0].tolist() == expected.tolist()
+
+
+def test_resolve_index_type_by_corpus_size(monkeypatch):
+    monkeypatch.setattr(settings, 'ann_auto_threshold', 1000)
+    monkeypatch.setattr(settings, 'ann_auto_index_type', 'hnsw')
+    monkeypatch.setattr(settings, 'ivf_nlist', 4)
+    
+    assert resolve_index_type('faiss', 10) == 'flat'
+    assert resolve_index_type('auto', 999) == 'flat'
+    assert resolve_index_type('auto', 1000) == 'hnsw'
+    # 训练样本不足时退回 flat
+    assert resolve_index_type('ivf_flat', 4 * MIN_POINTS_PER_CENTROID - 1) == 'flat'
+    assert resolve_index_type('ivf_flat', 4 * MIN_POINTS_PER_CENTROID) == 'ivf_flat'
+    with pytest.raises(ValueError):
+        resolve_index_type('annoy', 10)
+
+
+@pytest.mark.parametrize('index_type', ['ivf_flat', 'hnsw'])
+def test_store_migrates_and_excludes_deleted(tmp_path, monkeypatch, index_type):
+    monkeypatch.setattr(settings, 'vector_store_type', index_type)
+    monkeypatch.setattr(settings, 'ivf_nlist', 4)
+    monkeypatch.setattr(settings, 'ivf_nprobe', 4)
+    monkeypatch.setattr(settings, 'index_watch_interval', 0)
+    monkeypatch.setattr(settings, 'hybrid_search_enabled', False)
+    store = VectorStore(index_dir=str(tmp_path), dimension=DIMENSION)
+    store.load()
+    
+    count = 4 * MIN_POINTS_PER_CENTROID
+    vectors = _normalize(np.random.default_rng(3).standard_normal((count, DIMENSION)))
+    chunks = [{'chunk_id': f'doc{i % 2}_chunk_{i}', 'content': f'text {i}', 'metadata': {'document_id': f'doc{i % 2}'}}
+              for i in range(count)]
+    store.add_embeddings(chunks, vectors)
+    # 达到训练规模后在后台重建为目标索引类型
+    assert store._migration_lock.acquire(timeout=30)
+    store._migration_lock.release()
+    assert store.index_type == index_type
+    
+    for row in (0, 1, 2):
+        chunk, score = store.search_by_vector(vectors[row], top_k=1)[0]
+        assert chunk['chunk_id'] == chunks[row]['chunk_id']
+        assert score > 0.99
+    
+    store.delete_document('doc0')
+    results = store.search_by_vector(vectors[0], top_k=10)
+    assert len(results) == 10
+    assert all(chunk['chunk_id'].startswith('doc1_') for chunk, _ in results)
@@ -0,0 +1,90 @@
+import numpy as np
+
+from services.answer_cache import SemanticAnswerCache
+
+DIMENSION = 16
+SCOPE = (5, None, None, None, None, None, None)
+
+
+def _embedding(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(DIMENSION).astype(np.float32)
+
+
+def _sources(document_id: str):
+    return [{'chunk_id': f'{document_id}_chunk_0', 'document_id': document_id,
+             'metadata': {'filename': f'{document_id}.txt'}}]
+
+
+def _cache(**kwargs) -> SemanticAnswerCache:
+    options = {'capacity': 8, 'threshold': 0.95, 'ttl_seconds': 60}
+    options.update(kwargs)
+    return SemanticAnswerCache(DIMENSION, **options)
+
+
+def test_lookup_matches_similar_question_in_same_scope():
+    cache = _cache()
+    query = _embedding(0)
+    cache.store(query, SCOPE, '回答', _sources('a'), cache.epoch)
+    
+    # 同方向、不同模长且带少量噪声的向量视为相近问题
+    similar = 3 * query + 0.01 * _embedding(1)
+    assert cache.lookup(similar, SCOPE) == ('回答', _sources('a'))
+    assert cache.lookup(similar, (1,) + SCOPE[1:]) is None
+    assert cache.lookup(_embedding(2), SCOPE) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_store_skips_empty_sources_and_stale_epoch():
+    cache = _cache()
+    cache.store(_embedding(0), SCOPE, '回答', [], cache.epoch)
+    assert len(cache) == 0
+    
+    epoch = cache.epoch
+    cache.invalidate(['other'])
+    cache.store(_embedding(0), SCOPE, '回答', _sources('a'), epoch)
+    assert len(cache) == 0
+
+
+def test_invalidate_by_document_and_filename():
+    cache = _cache()
+    cache.store(_embedding(0), SCOPE, 'a', _sources('a'), cache.epoch)
+    cache.store(_embedding(1), SCOPE, 'b', _sources('b'), cache.epoch)
+    cache.store(_embedding(2), SCOPE, 'c', _sources('c'), cache.epoch)
+    
+    cache.invalidate(document_ids=['a'])
+    assert cache.lookup(_embedding(0), SCOPE) is None
+    cache.invalidate(filenames=['b.txt'])
+    assert cache.lookup(_embedding(1), SCOPE) is None
+    assert cache.lookup(_embedding(2), SCOPE) == ('c', _sources('c'))
+    assert len(cache) == 1
+    assert set(cache.by_document) == {'c'}
+    assert set(cache.by_filename) == {'c.txt'}
+
+
+def test_expired_entries_are_dropped():
+    cache = _cache(ttl_seconds=60)
+    cache.store(_embedding(0), SCOPE, '回答', _sources('a'), cache.epoch)
+    next(iter(cache.entries.values())).created_at -= 61
+    
+    assert cache.lookup(_embedding(0), SCOPE) is None
+    assert len(cache) == 0
+    assert cache.index.ntotal == 0
+
+
+def test_capacity_evicts_least_recently_used():
+    cache = _cache(capacity=2)
+    cache.store(_embedding(0), SCOPE, 'a', _sources('a'), cache.epoch)
+    cache.store(_embedding(1), SCOPE, 'b', _sources('b'), cache.epoch)
+    assert cache.lookup(_embedding(0), SCOPE) is not None
+    
+    cache.store(_embedding(2), SCOPE, 'c', _sources('c'), cache.epoch)
+    assert cache.lookup(_embedding(1), SCOPE) is None
+    assert cache.lookup(_embedding(0), SCOPE) == ('a', _sources('a'))
+    assert cache.lookup(_embedding(2), SCOPE) == ('c', _sources('c'))
+
+
+def test_zero_capacity_disables_cache():
+    cache = _cache(capacity=0)
+    cache.store(_embedding(0), SCOPE, '回答', _sources('a'), cache.epoch)
+    assert len(cache) == 0
+    assert cache.lookup(_embedding(0), SCOPE) is None
@@ -0,0 +1,38 @@
+from core.config import settings
+from services.container import ServiceContainer
+
+
+def test_services_are_built_once_and_warmed(fake_backend, monkeypatch):
+    monkeypatch.setattr(settings, 'vector_store_shards', 0)
+    monkeypatch.setattr(settings, 'index_watch_interval', 0)
+    container = ServiceContainer()
+    container.startup()
+    try:
+        assert container.ready
+        first = container.get_services()
+        assert container.get_services() == first
+        embedding_service, vector_store, llm_service = first
+        assert vector_store.embedding_service is embedding_service
+        # 启动时加载一次模型并预热编码
+        assert len(fake_backend) == 1
+        assert fake_backend[0].calls == [['warmup']]
+        
+        embedding_service.embed_text('warmup')
+        assert fake_backend[0].calls == [['warmup']]
+    finally:
+        container.shutdown()
+    assert not container.ready
+
+
+def test_get_services_builds_lazily(fake_backend, monkeypatch):
+    monkeypatch.setattr(settings, 'vector_store_shards', 0)
+    monkeypatch.setattr(settings, 'index_watch_interval', 0)
+    container = ServiceContainer()
+    assert container.vector_store is None
+    
+    embedding_service, vector_store, _ = container.get_services()
+    assert vector_store is container.vector_store
+    assert container.answer_cache is not None
+    assert container.get_services()[0] is embedding_service
+    assert len(fake_backend) == 1
+    container.shutdown()
@@ -0,0 +1,37 @@
+from services.context_packer import ContextPacker
+from services.document_processor import TextChunker
+
+
+def _pack_all(text: str, chunk_size: int, chunk_overlap: int) -> str:
+    chunks = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap).chunk_text(text, 'doc')
+    assert len(chunks) > 1
+    passages = ContextPacker(token_budget=100000).pack(chunks)
+    assert len(passages) == 1
+    return passages[0]['content']
+
+
+def test_merges_newline_separated_chunks_without_duplicates():
+    lines = ['Line one is here', 'Line two is here', 'Line three is here', 'Line four is here', 'Line five is here']
+    packed = _pack_all('\n'.join(lines), chunk_size=40, chunk_overlap=20)
+    assert packed == ' '.join(lines)
+
+
+def test_merges_cjk_chunks_without_duplicates():
+    sentences = ['第一句话。', '第二句话！', '第三句话？', '第四句话。', '第五句话。']
+    packed = _pack_all(''.join(sentences), chunk_size=12, chunk_overlap=6)
+    assert packed == ' '.join(sentences)
+
+
+def test_merges_split_long_sentence_windows():
+    sentence = 'abcdefghijklmnopqrstuvwxyz' * 4
+    packed = _pack_all(sentence, chunk_size=30, chunk_overlap=10)
+    assert packed == sentence
+
+
+def test_legacy_chunks_without_overlap_metadata():
+    chunks = [
+        {'chunk_id': 'doc_chunk_0', 'content': '第一句。 第二句。', 'metadata': {}},
+        {'chunk_id': 'doc_chunk_1', 'content': '第二句。 第三句。', 'metadata': {}},
+    ]
+    passages = ContextPacker(token_budget=100000).pack(chunks)
+    assert [passage['content'] for passage in passages] == ['第一句。 第二句。 第三句。']
@@ -0,0 +1,130 @@
+import json
+
+import pytest
+
+from services.context_packer import TokenCounter
+from services.document_processor import (
+    DocumentParser,
+    TextChunker,
+    chunk_file_to_spool,
+    chunk_parts_to_spool,
+    extract_pdf_range,
+)
+from services.job_queue import page_ranges
+
+
+def _sentences(count: int) -> str:
+    return '\n'.join(f'第 {i} 句话讲的是向量检索与分块。' for i in range(count))
+
+
+def test_text_file_streams_in_line_pieces(tmp_path, monkeypatch):
+    monkeypatch.setattr(DocumentParser, 'PIECE_SIZE', 256)
+    path = tmp_path / 'doc.txt'
+    text = _sentences(200)
+    path.write_text(text, encoding='utf-8')
+    
+    pieces = list(DocumentParser.iter_txt(str(path)))
+    assert len(pieces) > 1
+    assert '\n'.join(pieces) == text
+    assert all(len(piece) < 256 + 64 for piece in pieces)
+
+
+def test_streamed_chunks_match_whole_text():
+    text = _sentences(120)
+    lines = text.split('\n')
+    pieces = ['\n'.join(lines[i:i + 7]) for i in range(0, len(lines), 7)]
+    chunker = TextChunker(chunk_size=120, chunk_overlap=30)
+    
+    streamed = list(chunker.iter_chunks(pieces, 'doc'))
+    assert streamed == chunker.chunk_text(text, 'doc')
+    assert [chunk['chunk_id'] for chunk in streamed] == [f'doc_chunk_{i}' for i in range(len(streamed))]
+
+
+def test_chunk_file_to_spool(tmp_path):
+    path = tmp_path / 'doc.md'
+    path.write_text('# 标题\n\n**向量**检索见 [文档](http://example.com)。\n```\ncode\n```\n结束。', encoding='utf-8')
+    spool = tmp_path / 'doc.chunks.jsonl'
+    
+    count = chunk_file_to_spool(str(path), 'text/markdown', 'doc', 'doc.md', str(spool), chunk_size=100, chunk_overlap=0)
+    chunks = [json.loads(line) for line in spool.read_text(encoding='utf-8').splitlines()]
+    assert count == len(chunks) == 1
+    assert chunks[0]['content'] == '标题 向量检索见 文档。 结束。'
+    assert chunks[0]['metadata']['document_id'] == 'doc'
+    assert chunks[0]['metadata']['filename'] == 'doc.md'
+
+
+def test_pdf_page_ranges_chunk_like_whole_file(tmp_path, monkeypatch):
+    pages = [f'第 {page} 页。' + '向量检索与分块。' * (page % 3 + 1) for page in range(1, 12)]
+    
+    def iter_pdf_pages(file_path, start=0, end=None):
+        end = len(pages) if end is None else min(end, len(pages))
+        for index in range(start, end):
+            yield index + 1, pages[index]
+    
+    monkeypatch.setattr(DocumentParser, 'iter_pdf_pages', staticmethod(iter_pdf_pages))
+    path = str(tmp_path / 'doc.pdf')
+    whole = tmp_path / 'whole.jsonl'
+    chunk_file_to_spool(path, 'application/pdf', 'doc', 'doc.pdf', str(whole), chunk_size=60, chunk_overlap=10)
+    
+    part_paths = []
+    for i, (start, end) in enumerate(page_ranges(len(pages), 4)):
+        part_paths.append(str(tmp_path / f'part{i}.jsonl'))
+        assert extract_pdf_range(path, start, end, part_paths[-1]) == end - start
+    merged = tmp_path / 'merged.jsonl'
+    count = chunk_parts_to_spool(part_paths, 'doc', 'doc.pdf', str(merged), chunk_size=60, chunk_overlap=10)
+    
+    chunks = [json.loads(line) for line in merged.read_text(encoding='utf-8').splitlines()]
+    assert count == len(chunks) > len(part_paths)
+    assert merged.read_text(encoding='utf-8') == whole.read_text(encoding='utf-8')
+    assert chunks[0]['metadata']['page_start'] == 1
+    assert chunks[-1]['metadata']['page_end'] == len(pages)
+
+
+def test_chunks_respect_size_and_carry_overlap():
+    chunker = TextChunker(chunk_size=60, chunk_overlap=20)
+    chunks = chunker.chunk_text(_sentences(30), 'doc')
+    
+    assert all(chunk['metadata']['char_count'] == len(chunk['content']) <= 60 for chunk in chunks)
+    assert chunks[0]['metadata']['overlap_chars'] == 0
+    overlaps = [chunk['metadata']['overlap_chars'] for chunk in chunks[1:]]
+    assert all(0 < overlap <= 20 for overlap in overlaps)
+    for previous, chunk, overlap in zip(chunks, chunks[1:], overlaps):
+        assert previous['content'][-overlap:] == chunk['content'][:overlap]
+
+
+def test_long_sentence_split_into_numbered_windows():
+    sentence = 'x' * 250
+    chunker = TextChunker(chunk_size=100, chunk_overlap=20)
+    chunks = chunker.chunk_text(f'开头一句。{sentence}\n结尾一句。', 'doc')
+    
+    assert [chunk['chunk_id'] for chunk in chunks] == [f'doc_chunk_{i}' for i in range(5)]
+    assert chunks[0]['content'] == '开头一句。'
+    windows = chunks[1:4]
+    assert [chunk['metadata']['position'] for chunk in windows] == [0, 80, 160]
+    assert [chunk['metadata']['overlap_chars'] for chunk in windows] == [0, 20, 20]
+    assert all(chunk['metadata']['is_split'] for chunk in windows)
+    assert ''.join(chunk['content'][chunk['metadata']['overlap_chars']:] for chunk in windows) == sentence
+    assert chunks[4]['content'] == '结尾一句。'
+    assert chunks[4]['metadata']['overlap_chars'] == 0
+
+
+def test_chunks_record_page_span():
+    pieces = [(1, '第一页的第一句。第一页的第二句。'), (2, '第二页的句子。'), (3, '第三页的句子。')]
+    chunks = list(TextChunker(chunk_size=24, chunk_overlap=0).iter_chunks(pieces, 'doc'))
+    
+    spans = [(chunk['metadata']['page_start'], chunk['metadata']['page_end']) for chunk in chunks]
+    assert spans == [(1, 2), (3, 3)]
+
+
+def test_token_length_unit():
+    counter = TokenCounter()
+    chunker = TextChunker(chunk_size=40, chunk_overlap=10, length_unit='tokens')
+    chunks = chunker.chunk_text(_sentences(40) + '\nThe quick brown fox jumps over the lazy dog.', 'doc')
+    
+    assert len(chunks) > 1
+    for chunk in chunks:
+        sentences = chunker._split_into_sentences(chunk['content'].replace('。 ', '。\n'))
+        assert sum(counter.count_batch(sentences)) <= 40
+    
+    with pytest.raises(ValueError):
+        TextChunker(length_unit='words')
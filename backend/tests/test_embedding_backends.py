@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from core.config import settings
+from services.embedding_backends import (
+    TOKENIZER_FILE,
+    OnnxBackend,
+    cache_key,
+    cosine_parity,
+    create_backend,
+    find_tokenizer,
+)
+
+
+class FakeTokenizer:
+    """每个字符一个 token，token ID 为字符本身的数字"""
+    
+    def encode_batch(self, texts):
+        return [
+            SimpleNamespace(ids=[int(c) for c in text], attention_mask=[1] * len(text), type_ids=[0] * len(text))
+            for text in texts
+        ]
+
+
+class FakeSession:
+    """输出 token 向量 [token ID, 1]，并记录每批的输入形状"""
+    
+    def __init__(self):
+        self.feeds = []
+    
+    def run(self, output_names, feeds):
+        self.feeds.append({name: value.shape for name, value in feeds.items()})
+        input_ids = feeds['input_ids'].astype(np.float32)
+        return [np.stack([input_ids, np.ones_like(input_ids)], axis=-1)]
+
+
+def _onnx_backend(batch_size: int) -> OnnxBackend:
+    # 跳过 __init__：测试不需要 onnxruntime 与 tokenizers
+    backend = OnnxBackend.__new__(OnnxBackend)
+    backend.batch_size = batch_size
+    backend.session = FakeSession()
+    backend.tokenizer = FakeTokenizer()
+    backend.input_names = {'input_ids', 'attention_mask'}
+    backend.output_names = ['last_hidden_state']
+    return backend
+
+
+def test_onnx_encode_buckets_by_length_and_mean_pools():
+    backend = _onnx_backend(batch_size=2)
+    texts = ['1', '3333', '22', '444444', '5']
+    embeddings = backend.encode(texts)
+    
+    assert [feeds['input_ids'] for feeds in backend.session.feeds] == [(2, 6), (2, 2), (1, 1)]
+    assert all('token_type_ids' not in feeds for feeds in backend.session.feeds)
+    for text, embedding in zip(texts, embeddings):
+        expected = np.array([int(text[0]), 1], dtype=np.float32)
+        np.testing.assert_allclose(embedding, expected / np.linalg.norm(expected), rtol=1e-6)
+    assert backend.encode([]).shape == (0, 0)
+
+
+def test_find_tokenizer_in_model_or_parent_directory(tmp_path):
+    model_dir = tmp_path / 'model' / 'onnx'
+    model_dir.mkdir(parents=True)
+    model_path = str(model_dir / 'model.onnx')
+    with pytest.raises(FileNotFoundError):
+        find_tokenizer(model_path)
+    
+    (tmp_path / 'model' / TOKENIZER_FILE).write_text('{}')
+    assert find_tokenizer(model_path) == str(tmp_path / 'model' / TOKENIZER_FILE)
+    (model_dir / TOKENIZER_FILE).write_text('{}')
+    assert find_tokenizer(model_path) == str(model_dir / TOKENIZER_FILE)
+
+
+def test_create_backend_rejects_bad_configuration(monkeypatch):
+    monkeypatch.setattr(settings, 'embedding_onnx_path', '')
+    with pytest.raises(ValueError):
+        create_backend('onnx')
+    with pytest.raises(ValueError):
+        create_backend('tensorflow')
+
+
+def test_cache_key_per_onnx_model_file(monkeypatch):
+    monkeypatch.setattr(settings, 'embedding_onnx_path', '/models/onnx/model_qint8_avx512.onnx')
+    assert cache_key('all-MiniLM-L6-v2', 'onnx') == 'all-MiniLM-L6-v2@onnx-model_qint8_avx512'
+    assert cache_key('all-MiniLM-L6-v2', 'torch') == 'all-MiniLM-L6-v2'
+
+
+def test_cosine_parity():
+    reference = np.array([[1, 0], [0, 2]], dtype=np.float32)
+    parity = cosine_parity(np.array([[2, 0], [1, 1]], dtype=np.float32), reference)
+    assert parity['texts'] == 2
+    assert parity['min_cosine'] == pytest.approx(np.sqrt(0.5))
+    assert parity['mean_cosine'] == pytest.approx((1 + np.sqrt(0.5)) / 2)
@@ -0,0 +1,100 @@
+import multiprocessing
+
+import numpy as np
+
+from services.embedding_cache import EmbeddingCache, content_key
+
+MODEL = 'test-model'
+DIMENSION = 8
+
+
+def _vector(text: str) -> np.ndarray:
+    seed = int.from_bytes(content_key(MODEL, text)[:4], 'little')
+    return np.random.default_rng(seed).standard_normal(DIMENSION).astype(np.float32)
+
+
+def _put(cache: EmbeddingCache, texts):
+    cache.put_many([content_key(MODEL, text) for text in texts], np.stack([_vector(text) for text in texts]))
+
+
+def _assert_cached(cache: EmbeddingCache, texts):
+    result, misses, _ = cache.get_many(texts)
+    assert misses == []
+    for text, vector in zip(texts, result):
+        np.testing.assert_array_equal(vector, _vector(text))
+
+
+def _writer(cache_dir: str, prefix: str, rounds: int) -> None:
+    cache = EmbeddingCache(cache_dir, MODEL, DIMENSION)
+    for i in range(rounds):
+        _put(cache, [f'{prefix}-{i}', f'shared-{i}'])
+    _assert_cached(cache, [f'{prefix}-{i}' for i in range(rounds)])
+
+
+def test_two_instances_on_one_directory(tmp_path):
+    first = EmbeddingCache(str(tmp_path), MODEL, DIMENSION)
+    second = EmbeddingCache(str(tmp_path), MODEL, DIMENSION)
+    
+    _put(first, ['alpha'])
+    _put(second, ['beta'])
+    _put(first, ['gamma'])
+    
+    for cache in (first, second, EmbeddingCache(str(tmp_path), MODEL, DIMENSION)):
+        _assert_cached(cache, ['alpha', 'beta', 'gamma'])
+
+
+def test_two_writer_processes(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    rounds = 50
+    writers = [context.Process(target=_writer, args=(str(tmp_path), prefix, rounds)) for prefix in ('a', 'b')]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+        assert process.exitcode == 0
+    
+    texts = [f'{prefix}-{i}' for prefix in ('a', 'b', 'shared') for i in range(rounds)]
+    _assert_cached(EmbeddingCache(str(tmp_path), MODEL, DIMENSION), texts)
+
+
+def test_truncates_partial_append(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, DIMENSION)
+    _put(cache, ['alpha', 'beta'])
+    with open(cache.vectors_file, 'ab') as f:
+        f.write(b'\0' * (DIMENSION * 4 + 3))
+    
+    reopened = EmbeddingCache(str(tmp_path), MODEL, DIMENSION)
+    _put(reopened, ['gamma'])
+    _assert_cached(EmbeddingCache(str(tmp_path), MODEL, DIMENSION), ['alpha', 'beta', 'gamma'])
+
+
+def test_contiguous_hits_share_memory_with_mapping(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, DIMENSION)
+    _put(cache, ['alpha', 'beta', 'gamma'])
+    
+    view, misses, _ = cache.get_many(['beta', 'gamma'])
+    assert misses == []
+    assert np.shares_memory(view, cache._vectors)
+    assert not view.flags.writeable
+    
+    copy, misses, _ = cache.get_many(['gamma', 'alpha', 'delta'])
+    assert misses == [2]
+    assert copy.flags.writeable
+    np.testing.assert_array_equal(copy[2], np.zeros(DIMENSION, dtype=np.float32))
+    np.testing.assert_array_equal(copy[0], _vector('gamma'))
+
+
+def test_embedding_service_encodes_only_misses(fake_backend):
+    from services.embedding_service import EmbeddingService
+    
+    service = EmbeddingService()
+    first = service.embed_texts(['alpha', 'beta'])
+    second = service.embed_texts(['beta', 'gamma', 'alpha'])
+    assert fake_backend[0].calls == [['alpha', 'beta'], ['gamma']]
+    np.testing.assert_array_equal(second[0], first[1])
+    np.testing.assert_array_equal(second[2], first[0])
+    
+    # 新实例 (如重启后) 从磁盘缓存读取，不加载模型
+    restarted = EmbeddingService()
+    np.testing.assert_array_equal(restarted.embed_texts(['gamma', 'alpha']), second[[1, 2]])
+    assert len(fake_backend) == 1
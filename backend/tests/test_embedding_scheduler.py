@@ -0,0 +1,64 @@
+import asyncio
+
+import numpy as np
+
+from services.embedding_scheduler import EmbeddingScheduler
+from services.embedding_service import EmbeddingService
+
+
+def test_concurrent_queries_share_one_batch(fake_backend):
+    service = EmbeddingService()
+    texts = [f'问题 {i}' for i in range(5)]
+    
+    async def run():
+        scheduler = EmbeddingScheduler(service, max_batch_size=8, batch_window_ms=50)
+        try:
+            return await asyncio.gather(*(scheduler.embed_text(text) for text in texts))
+        finally:
+            await scheduler.stop()
+    
+    embeddings = asyncio.run(run())
+    assert fake_backend[0].calls == [texts]
+    for text, embedding in zip(texts, embeddings):
+        np.testing.assert_array_equal(embedding, fake_backend[0].mock.embed_text(text))
+
+
+def test_batches_respect_max_size_and_query_cache(fake_backend):
+    service = EmbeddingService()
+    texts = [f'q{i}' for i in range(5)]
+    
+    async def run():
+        scheduler = EmbeddingScheduler(service, max_batch_size=2, batch_window_ms=50)
+        try:
+            await asyncio.gather(*(scheduler.embed_text(text) for text in texts))
+            # 已编码的查询命中 LRU，不再进入模型
+            await scheduler.embed_text('q0')
+            return await scheduler.embed_texts(['q1', 'q9'])
+        finally:
+            await scheduler.stop()
+    
+    embeddings = asyncio.run(run())
+    calls = fake_backend[0].calls
+    assert [len(batch) for batch in calls] == [2, 2, 1, 1]
+    assert sorted(text for batch in calls[:3] for text in batch) == texts
+    assert calls[3] == ['q9']
+    assert embeddings.shape == (2, 32)
+
+
+def test_encode_error_reaches_every_waiter(fake_backend, monkeypatch):
+    service = EmbeddingService()
+    
+    def fail(texts):
+        raise RuntimeError('模型失败')
+    
+    monkeypatch.setattr(service.model, 'encode', fail)
+    
+    async def run():
+        scheduler = EmbeddingScheduler(service, max_batch_size=8, batch_window_ms=20)
+        try:
+            return await asyncio.gather(*(scheduler.embed_text(f'x{i}') for i in range(3)), return_exceptions=True)
+        finally:
+            await scheduler.stop()
+    
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
@@ -0,0 +1,31 @@
+import numpy as np
+
+from services.embedding_service import MockEmbeddingService
+
+
+def test_mock_embeddings_are_deterministic_and_normalized():
+    service = MockEmbeddingService(dimension=64)
+    texts = ['向量检索', 'Error E1234', '']
+    embeddings = service.embed_texts(texts)
+    assert embeddings.shape == (3, 64)
+    np.testing.assert_array_equal(embeddings, MockEmbeddingService(dimension=64).embed_texts(texts))
+    np.testing.assert_allclose(np.linalg.norm(embeddings[:2], axis=1), 1.0, rtol=1e-5)
+    np.testing.assert_array_equal(embeddings[0], service.embed_text('向量检索'))
+
+
+def test_mock_embeddings_when_lowercase_changes_length():
+    service = MockEmbeddingService(dimension=64)
+    embeddings = service.embed_texts(['İstanbul', 'beta', 'İİİ'])
+    assert embeddings.shape == (3, 64)
+    np.testing.assert_array_equal(embeddings[1], service.embed_text('beta'))
+    np.testing.assert_array_equal(embeddings[0], service.embed_text('i̇stanbul'))
+
+
+def test_mock_embeddings_with_nul_in_text():
+    service = MockEmbeddingService(dimension=64)
+    texts = ['a\0b', '\0', 'beta', '']
+    embeddings = service.embed_texts(texts)
+    for text, embedding in zip(texts, embeddings):
+        np.testing.assert_array_equal(embedding, service.embed_text(text))
+    assert np.linalg.norm(embeddings[1]) > 0
+    np.testing.assert_array_equal(embeddings[3], np.zeros(64, dtype=np.float32))
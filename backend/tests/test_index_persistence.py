@@ -0,0 +1,106 @@
+import os
+import pickle
+
+import faiss
+import numpy as np
+import pytest
+
+from services.index_persistence import LEGACY_CHUNKS_FILE, LEGACY_INDEX_FILE, IndexPersistence
+from services.vector_store import VectorStore
+
+DIMENSION = 8
+
+
+def _legacy_index(index_dir: str, count: int) -> np.ndarray:
+    """按旧版整文件格式写入 faiss.index 与 chunks.pkl"""
+    vectors = np.random.default_rng(0).standard_normal((count, DIMENSION)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = faiss.IndexIDMap(faiss.IndexFlatIP(DIMENSION))
+    index.add_with_ids(vectors, np.arange(count, dtype=np.int64))
+    faiss.write_index(index, os.path.join(index_dir, LEGACY_INDEX_FILE))
+    
+    chunks = [{'chunk_id': f'doc_chunk_{i}', 'content': f'text {i}', 'metadata': {'filename': 'doc.txt'}}
+              for i in range(count)]
+    with open(os.path.join(index_dir, LEGACY_CHUNKS_FILE), 'wb') as f:
+        pickle.dump({'chunks': chunks, 'document_ids': ['doc']}, f)
+    return vectors
+
+
+def test_adopts_legacy_files(tmp_path):
+    vectors = _legacy_index(str(tmp_path), 5)
+    
+    persistence = IndexPersistence(str(tmp_path), DIMENSION)
+    persistence.load()
+    assert persistence.manifest['base']['index'] == LEGACY_INDEX_FILE
+    assert len(persistence.chunk_store) == 5
+    np.testing.assert_allclose(np.asarray(persistence.vectors), vectors, rtol=1e-6)
+    assert not os.path.exists(tmp_path / LEGACY_CHUNKS_FILE)
+    
+    store = VectorStore(index_dir=str(tmp_path), dimension=DIMENSION)
+    store.load()
+    assert store.get_chunk_count() == 5
+    chunk, score = store.search_by_vector(vectors[3], top_k=1, hybrid=False)[0]
+    assert chunk['chunk_id'] == 'doc_chunk_3'
+    assert chunk['content'] == 'text 3'
+    assert score > 0.99
+
+
+def _chunks(prefix: str, count: int):
+    return [{'chunk_id': f'{prefix}_chunk_{i}', 'content': f'{prefix} {i}', 'metadata': {'filename': f'{prefix}.txt'}}
+            for i in range(count)]
+
+
+def _vectors(count: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype(np.float32)
+
+
+def test_appends_only_new_rows(tmp_path):
+    persistence = IndexPersistence(str(tmp_path), DIMENSION)
+    persistence.load()
+    first = _vectors(3, 1)
+    persistence.append(np.arange(3), first, _chunks('a', 3))
+    vectors_file = tmp_path / 'vectors.f32'
+    head = vectors_file.read_bytes()
+    commit = persistence.commit
+    
+    second = _vectors(2, 2)
+    persistence.append(np.arange(3, 5), second, _chunks('b', 2))
+    assert vectors_file.read_bytes()[:len(head)] == head
+    assert persistence.commit == commit + 1
+    
+    reopened = IndexPersistence(str(tmp_path), DIMENSION)
+    reopened.load()
+    ids, vectors, deleted = next(reopened.iter_logs())
+    np.testing.assert_array_equal(ids, np.arange(5))
+    np.testing.assert_array_equal(vectors, np.concatenate([first, second]))
+    assert len(deleted) == 0
+    assert reopened.chunk_store.get(4)['chunk_id'] == 'b_chunk_1'
+
+
+def test_rejects_non_contiguous_ids(tmp_path):
+    persistence = IndexPersistence(str(tmp_path), DIMENSION)
+    persistence.load()
+    persistence.append(np.arange(2), _vectors(2, 1), _chunks('a', 2))
+    with pytest.raises(ValueError):
+        persistence.append(np.arange(3, 4), _vectors(1, 2), _chunks('b', 1))
+
+
+def test_truncates_uncommitted_tail(tmp_path):
+    persistence = IndexPersistence(str(tmp_path), DIMENSION)
+    persistence.load()
+    persistence.append(np.arange(2), _vectors(2, 1), _chunks('a', 2))
+    log = persistence.manifest['logs'][-1]['name']
+    
+    # 模拟写入向量与 ID 后、提交清单前崩溃
+    with open(tmp_path / 'vectors.f32', 'ab') as f:
+        f.write(_vectors(1, 2).tobytes())
+    with open(tmp_path / f'{log}.ids', 'ab') as f:
+        f.write(np.array([2], dtype=np.int64).tobytes())
+    
+    reopened = IndexPersistence(str(tmp_path), DIMENSION)
+    reopened.load()
+    assert os.path.getsize(tmp_path / 'vectors.f32') == 2 * DIMENSION * 4
+    assert len(reopened.chunk_store) == 2
+    reopened.append(np.arange(2, 3), _vectors(1, 3), _chunks('b', 1))
+    ids, _, _ = next(reopened.iter_logs())
+    np.testing.assert_array_equal(ids, np.arange(3))
@@ -0,0 +1,73 @@
+import os
+import time
+
+import pytest
+
+from core.config import settings
+from services.embedding_service import MockEmbeddingService
+from services.job_queue import IngestionJobQueue, page_ranges
+from services.vector_store import VectorStore
+
+
+def _wait(job, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while not job.done and time.time() < deadline:
+        time.sleep(0.05)
+    assert job.done, job.to_dict()
+
+
+@pytest.fixture
+def job_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'chunk_size', 80)
+    monkeypatch.setattr(settings, 'chunk_overlap', 0)
+    monkeypatch.setattr(settings, 'chunk_length_unit', 'chars')
+    store = VectorStore(MockEmbeddingService(32), index_dir=str(tmp_path / 'index'))
+    job_queue = IngestionJobQueue(store, parse_workers=2, batch_size=4)
+    yield job_queue
+    job_queue.stop()
+
+
+def _write(tmp_path, name: str, sentences: int) -> str:
+    path = tmp_path / name
+    path.write_text('\n'.join(f'{name} 第 {i} 句关于后台入库的说明。' for i in range(sentences)), encoding='utf-8')
+    return str(path)
+
+
+def test_jobs_report_progress_and_index_chunks(tmp_path, job_queue):
+    jobs = [
+        job_queue.submit(_write(tmp_path, f'doc{i}.txt', 30), 'text/plain', f'doc{i}', f'doc{i}.txt')
+        for i in range(3)
+    ]
+    for job in jobs:
+        _wait(job)
+    
+    for job in jobs:
+        status = job_queue.get(job.job_id).to_dict()
+        assert status['stage'] == 'completed', status
+        assert status['chunks_total'] > 4
+        assert status['chunks_indexed'] == status['chunks_total']
+        assert not os.path.exists(job.file_path)
+        assert not os.path.exists(job.spool_path)
+    
+    store = job_queue.vector_store
+    assert store.get_chunk_count() == sum(job.chunks_total for job in jobs)
+    assert {document['document_id'] for document in store.list_documents()} == {'doc0', 'doc1', 'doc2'}
+
+
+def test_failed_job_cleans_up(tmp_path, job_queue):
+    path = tmp_path / 'bad.txt'
+    path.write_bytes(b'\xff\xfe not utf-8 \xff')
+    job = job_queue.submit(str(path), 'text/plain', 'bad', 'bad.txt')
+    _wait(job)
+    
+    assert job.stage == 'failed'
+    assert job.error
+    assert not os.path.exists(path)
+    assert job_queue.vector_store.get_chunk_count() == 0
+
+
+def test_page_ranges():
+    assert page_ranges(40, 16) == [(0, 16), (16, 32), (32, 40)]
+    assert page_ranges(16, 16) == [(0, 16)]
+    assert page_ranges(3, 0) == [(0, 1), (1, 2), (2, 3)]
+    assert page_ranges(0, 16) == []
@@ -0,0 +1,109 @@
+import os
+import time
+
+import numpy as np
+
+from core.config import settings
+from services.lexical_index import SNAPSHOT_FILE, LexicalIndex, reciprocal_rank_fusion, tokenize, write_snapshot
+from services.vector_store import VectorStore
+
+
+def _chunks(document_id: str, count: int):
+    return [
+        {
+            'chunk_id': f'{document_id}_chunk_{i}',
+            'content': f'{document_id} error E{1000 + i} 向量检索 word{i}',
+            'metadata': {'document_id': document_id, 'filename': f'{document_id}.txt'},
+        }
+        for i in range(count)
+    ]
+
+
+def _open_store(index_dir: str) -> VectorStore:
+    store = VectorStore(index_dir=index_dir, dimension=8)
+    store.load()
+    deadline = time.time() + 10
+    while not store.lexical_ready and time.time() < deadline:
+        time.sleep(0.01)
+    return store
+
+
+def test_snapshot_round_trip(tmp_path):
+    index = LexicalIndex()
+    index.add([0, 1, 2], ['connection timed out', 'E1234 连接超时', 'timed out again'])
+    path = str(tmp_path / SNAPSHOT_FILE)
+    write_snapshot(path, index.snapshot(), count=np.int64(3))
+    
+    restored = LexicalIndex()
+    extra = restored.restore(path)
+    assert int(extra['count']) == 3
+    assert restored.doc_count == index.doc_count
+    for query in ('timed out', 'e1234', '超时'):
+        assert restored.search(query, 3) == index.search(query, 3)
+
+
+def test_restart_restores_snapshot_and_later_deletes(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'index_watch_interval', 0)
+    rng = np.random.default_rng(0)
+    store = _open_store(str(tmp_path))
+    store.add_embeddings(_chunks('a', 600), rng.standard_normal((600, 8)).astype(np.float32))
+    store.add_embeddings(_chunks('b', 300), rng.standard_normal((300, 8)).astype(np.float32))
+    store.save_lexical_index()
+    store.delete_document('a')
+    
+    restarted = VectorStore(index_dir=str(tmp_path), dimension=8)
+    restarted.load()
+    assert restarted.lexical_ready
+    assert restarted.lexical_index.doc_count == 300
+    assert restarted.lexical_index.search('e1005', 5) == store.lexical_index.search('e1005', 5)
+    
+    os.remove(str(tmp_path / SNAPSHOT_FILE))
+    rebuilt = _open_store(str(tmp_path))
+    assert rebuilt.lexical_index.doc_count == 300
+    assert rebuilt.lexical_index.search('e1005', 5) == store.lexical_index.search('e1005', 5)
+
+
+def test_tokenize_cjk_and_codes():
+    assert tokenize('连接超时 ERR_CONN-RESET') == ['连', '接', '超', '时', '连接', '接超', '超时', 'err_conn-reset', 'err', 'conn', 'reset']
+    assert tokenize('连接超时', for_query=True) == ['连接', '接超', '超时']
+    assert tokenize('超', for_query=True) == ['超']
+
+
+def test_search_ranks_matches_and_respects_candidates():
+    index = LexicalIndex()
+    texts = ['error E1234 connection timed out', 'connection ok', 'E1234 E1234 again']
+    index.add([0, 1, 2], texts)
+    
+    assert [idx for idx, _ in index.search('e1234', 5)] == [2, 0]
+    assert [idx for idx, _ in index.search('e1234', 5, np.array([0, 1]))] == [0]
+    assert index.search('missing', 5) == []
+    
+    index.remove([2], [texts[2]])
+    assert [idx for idx, _ in index.search('e1234', 5)] == [0]
+    assert index.doc_count == 2
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 4]], k=60)
+    assert [item for item, _ in fused] == [3, 1, 2, 4]
+    assert fused[0][1] == 1 / 63 + 1 / 61
+
+
+def test_hybrid_search_surfaces_exact_terms(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'index_watch_interval', 0)
+    rng = np.random.default_rng(0)
+    store = _open_store(str(tmp_path))
+    vectors = rng.standard_normal((50, 8)).astype(np.float32)
+    store.add_embeddings(_chunks('a', 50), vectors)
+    # 查询向量与 a_chunk_0 最相近，查询文本只命中 a_chunk_37
+    query_embedding = vectors[0]
+    
+    dense = store.search_by_vector(query_embedding, top_k=3, query='e1037', hybrid=False)
+    assert 'a_chunk_37' not in [chunk['chunk_id'] for chunk, _ in dense]
+    
+    fused = store.search_by_vector(query_embedding, top_k=3, query='e1037', hybrid=True)
+    ids = [chunk['chunk_id'] for chunk, _ in fused]
+    assert ids[:2] in (['a_chunk_0', 'a_chunk_37'], ['a_chunk_37', 'a_chunk_0'])
+    similarity = dict((chunk['chunk_id'], score) for chunk, score in fused)['a_chunk_37']
+    expected = vectors[37] @ vectors[0] / np.linalg.norm(vectors[37]) / np.linalg.norm(vectors[0])
+    assert np.isclose(similarity, expected, atol=1e-5)
@@ -0,0 +1,148 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from core.config import settings
+from services.llm_service import LLMError, LLMService
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+        self.response = None
+
+
+class FakeStream:
+    def __init__(self, parts):
+        self.parts = parts
+        self.closed = False
+    
+    def __aiter__(self):
+        return self._iter()
+    
+    async def _iter(self):
+        for part in self.parts:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+    
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """按调用顺序依次执行 responses 中的函数，模拟 chat.completions.create"""
+    
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+    
+    async def create(self, **kwargs):
+        respond = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await respond(**kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+def _answer(text: str, delay: float = 0):
+    async def respond(**kwargs):
+        await asyncio.sleep(delay)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=None)
+    return respond
+
+
+def _fail(status_code: int):
+    async def respond(**kwargs):
+        raise UpstreamError(status_code)
+    return respond
+
+
+def _service(client: FakeClient, **overrides) -> LLMService:
+    service = LLMService(api_key='test')
+    service.retry_base_delay = 0.001
+    service.retry_max_delay = 0.01
+    for name, value in overrides.items():
+        setattr(service, name, value)
+    service._async_client = client
+    return service
+
+
+CHUNKS = [{'content': '向量检索按内积找最近邻。', 'metadata': {'source': 'doc.txt'}}]
+
+
+def test_retries_rate_limit_then_succeeds():
+    client = FakeClient(_fail(429), _fail(503), _answer('回答'))
+    service = _service(client)
+    assert asyncio.run(service.agenerate_answer('问题', CHUNKS)) == '回答'
+    assert client.calls == 3
+
+
+def test_bad_request_is_not_retried():
+    client = FakeClient(_fail(400), _answer('回答'))
+    with pytest.raises(LLMError) as info:
+        asyncio.run(_service(client).agenerate_answer('问题', CHUNKS))
+    assert info.value.code == 'bad_request'
+    assert info.value.http_status == 400
+    assert info.value.attempts == 1
+    assert client.calls == 1
+
+
+def test_gives_up_after_max_retries():
+    client = FakeClient(_fail(503))
+    with pytest.raises(LLMError) as info:
+        asyncio.run(_service(client, max_retries=2).agenerate_answer('问题', CHUNKS))
+    assert info.value.to_dict() == {
+        'code': 'upstream_error', 'message': 'HTTP 503', 'upstream_status': 503, 'attempts': 3,
+    }
+    assert client.calls == 3
+
+
+def test_timeout_stops_retrying():
+    client = FakeClient(_answer('回答', delay=1))
+    with pytest.raises(LLMError) as info:
+        asyncio.run(_service(client, timeout=0.05).agenerate_answer('问题', CHUNKS))
+    assert info.value.code == 'timeout'
+    assert info.value.http_status == 504
+
+
+def test_hedged_request_takes_first_success():
+    client = FakeClient(_answer('慢', delay=1), _answer('快'))
+    service = _service(client, hedge_delay=0.02)
+    assert asyncio.run(service.agenerate_answer('问题', CHUNKS)) == '快'
+    assert client.calls == 2
+    assert client.in_flight == 0
+
+
+def test_concurrency_is_capped(monkeypatch):
+    monkeypatch.setattr(settings, 'llm_max_concurrency', 2)
+    client = FakeClient(_answer('回答', delay=0.02))
+    service = _service(client)
+    
+    async def run():
+        return await asyncio.gather(*(service.agenerate_answer(f'问题 {i}', CHUNKS) for i in range(6)))
+    
+    assert asyncio.run(run()) == ['回答'] * 6
+    assert client.max_in_flight == 2
+
+
+def test_stream_answer_yields_deltas_and_closes():
+    stream = FakeStream(['向量', '', '检索'])
+    
+    async def respond(**kwargs):
+        assert kwargs['stream'] is True
+        return stream
+    
+    service = _service(FakeClient(respond))
+    
+    async def run():
+        return [text async for text in service.stream_answer('问题', CHUNKS)]
+    
+    assert asyncio.run(run()) == ['向量', '检索']
+    assert stream.closed
@@ -0,0 +1,52 @@
+import pytest
+
+from services import metrics
+from services.metrics import Counter, Histogram, _Metric, render_metrics, server_timing, timed, track_request
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, 'REGISTRY', [])
+    monkeypatch.setattr(metrics.settings, 'metrics_enabled', True)
+
+
+def test_metric_base_is_abstract():
+    with pytest.raises(TypeError):
+        _Metric('test_metric', 'doc')
+
+
+def test_render_counter_and_histogram():
+    counter = Counter('test_total', '计数', ('kind',))
+    counter.inc(2, kind='a')
+    counter.inc(kind='a')
+    counter.inc(0, kind='b')
+    histogram = Histogram('test_seconds', '耗时', buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    
+    assert counter.value(kind='a') == 3
+    lines = render_metrics().splitlines()
+    assert '# TYPE test_total counter' in lines
+    assert 'test_total{kind="a"} 3' in lines
+    assert not any('kind="b"' in line for line in lines)
+    assert 'test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'test_seconds_count 2' in lines
+
+
+def test_timed_records_request_breakdown(monkeypatch):
+    stages = Histogram('test_stage_seconds', '阶段耗时', ('stage',))
+    monkeypatch.setattr(metrics, 'STAGE_SECONDS', stages)
+    
+    @timed('work')
+    def work():
+        return 42
+    
+    with track_request() as timings:
+        assert work() == 42
+        with timed('other'):
+            pass
+    
+    assert set(timings) == {'work', 'other'}
+    assert server_timing(timings, 0.001).endswith('total;dur=1.00')
+    assert any(line.startswith('test_stage_seconds_count{stage="work"} 1') for line in render_metrics().splitlines())
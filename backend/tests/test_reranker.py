@@ -0,0 +1,74 @@
+import time
+
+from core.config import settings
+from services.metrics import RERANK_BUDGET_EXCEEDED
+from services.reranker import CHARS_PER_TOKEN, CrossEncoderReranker
+
+
+class FakeCrossEncoder:
+    """以文本中的数字作为相关性分数；每批耗时 delay 秒"""
+    
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.batches = []
+    
+    def predict(self, pairs, batch_size=32):
+        self.batches.append(pairs)
+        time.sleep(self.delay)
+        return [float(text.split()[-1]) for _, text in pairs]
+
+
+def _results(scores):
+    return [
+        ({'chunk_id': f'c{i}', 'content': f'文本 {score}', 'metadata': {'document_id': 'doc'}}, 1 - i / 10)
+        for i, score in enumerate(scores)
+    ]
+
+
+def _reranker(model: FakeCrossEncoder, **kwargs) -> CrossEncoderReranker:
+    reranker = CrossEncoderReranker(model_name='fake', **kwargs)
+    reranker._model = model
+    return reranker
+
+
+def test_rerank_orders_by_cross_encoder_and_keeps_cosine():
+    model = FakeCrossEncoder()
+    results = _results([1, 5, 3, 4])
+    reranked = _reranker(model, batch_size=3, budget_ms=0).rerank('问题', results, top_k=3)
+    
+    assert [chunk['chunk_id'] for chunk, _ in reranked] == ['c1', 'c3', 'c2']
+    assert [score for _, score in reranked] == [results[1][1], results[3][1], results[2][1]]
+    assert [chunk['metadata']['rerank_score'] for chunk, _ in reranked] == [5.0, 4.0, 3.0]
+    assert reranked[0][0]['metadata']['document_id'] == 'doc'
+    assert 'rerank_score' not in results[1][0]['metadata']
+    assert [len(batch) for batch in model.batches] == [3, 1]
+
+
+def test_rerank_truncates_long_candidates():
+    model = FakeCrossEncoder()
+    results = [({'chunk_id': 'long', 'content': 'x' * 500 + ' 2'}, 0.9), ({'chunk_id': 'short', 'content': '1'}, 0.8)]
+    reranker = _reranker(model, max_tokens=16, budget_ms=0)
+    model.predict = lambda pairs, batch_size=32: [len(text) for _, text in pairs]
+    
+    reranked = reranker.rerank('问题', results, top_k=2)
+    assert reranked[0][0]['metadata']['rerank_score'] == 16 * CHARS_PER_TOKEN
+
+
+def test_rerank_stops_at_latency_budget(monkeypatch):
+    monkeypatch.setattr(settings, 'metrics_enabled', True)
+    exceeded = RERANK_BUDGET_EXCEEDED.value()
+    model = FakeCrossEncoder(delay=0.05)
+    results = _results([1, 2, 9, 8, 7, 6])
+    
+    reranked = _reranker(model, batch_size=2, budget_ms=60).rerank('问题', results, top_k=5)
+    assert len(model.batches) == 1
+    assert [chunk['chunk_id'] for chunk, _ in reranked] == ['c1', 'c0', 'c2', 'c3', 'c4']
+    assert 'rerank_score' not in reranked[2][0]['metadata']
+    assert RERANK_BUDGET_EXCEEDED.value() == exceeded + 1
+
+
+def test_single_candidate_skips_model():
+    reranker = CrossEncoderReranker(model_name='fake')
+    results = _results([1])
+    assert reranker.rerank('问题', results, top_k=5) == results
+    assert reranker._model is None
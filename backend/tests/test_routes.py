@@ -0,0 +1,207 @@
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.routes import router
+from core.config import settings
+from services.answer_cache import SemanticAnswerCache
+from services.container import container
+from services.embedding_scheduler import EmbeddingScheduler
+from services.embedding_service import MockEmbeddingService
+from services.llm_service import LLMError
+from services.vector_store import VectorStore
+
+DIMENSION = 64
+
+
+class FakeLLMService:
+    """按给定片段逐段输出；error 不为空时在输出完片段后抛出"""
+    
+    def __init__(self, parts, error=None):
+        self.parts = parts
+        self.error = error
+        self.calls = 0
+    
+    async def stream_answer(self, query, context_chunks):
+        self.calls += 1
+        for part in self.parts:
+            yield part
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def services(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'rerank_enabled', False)
+    monkeypatch.setattr(settings, 'hybrid_search_enabled', False)
+    embedding_service = MockEmbeddingService(DIMENSION)
+    store = VectorStore(embedding_service, index_dir=str(tmp_path))
+    store.add_chunks([
+        {'chunk_id': f'doc_chunk_{i}', 'content': content, 'metadata': {'document_id': 'doc', 'filename': 'doc.txt'}}
+        for i, content in enumerate(['向量检索按内积找最近邻', '文档上传后在后台解析', '倒数排名融合'])
+    ])
+    answer_cache = SemanticAnswerCache(DIMENSION, capacity=16, threshold=0.99, ttl_seconds=60)
+    store.add_change_listener(answer_cache.invalidate)
+    
+    monkeypatch.setattr(container, 'embedding_service', embedding_service)
+    monkeypatch.setattr(container, 'embedding_scheduler', EmbeddingScheduler(embedding_service))
+    monkeypatch.setattr(container, 'vector_store', store)
+    monkeypatch.setattr(container, 'answer_cache', answer_cache)
+    monkeypatch.setattr(container, 'llm_service', FakeLLMService(['向量', '检索']))
+    monkeypatch.setattr(container, 'ready', True)
+    return container
+
+
+@pytest.fixture
+def client(services):
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await services.embedding_scheduler.stop()
+    
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router, prefix="/api")
+    with TestClient(app) as client:
+        yield client
+
+
+def _events(response):
+    """把 SSE 响应体解析为 [(事件名, 数据)]"""
+    assert response.headers['content-type'].startswith('text/event-stream')
+    events = []
+    for block in response.text.split('\n\n'):
+        if not block:
+            continue
+        event, data = block.split('\n')
+        assert event.startswith('event: ') and data.startswith('data: ')
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+def _off_event_loop(monkeypatch, store, name):
+    """包装 store 的方法：记录其是否在事件循环线程之外被调用"""
+    calls = []
+    method = getattr(store, name)
+    
+    def wrapper(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            calls.append(False)
+        except RuntimeError:
+            calls.append(True)
+        return method(*args, **kwargs)
+    
+    monkeypatch.setattr(store, name, wrapper)
+    return calls
+
+
+def test_stream_frames_sources_tokens_and_done(services, client):
+    events = _events(client.post('/api/query/stream', json={'query': '向量检索', 'top_k': 2}))
+    
+    names = [name for name, _ in events]
+    assert names == ['sources', 'token', 'token', 'done']
+    sources = events[0][1]
+    assert sources['query'] == '向量检索'
+    assert sources['cached'] is False
+    assert len(sources['sources']) == 2
+    assert [data['text'] for name, data in events if name == 'token'] == ['向量', '检索']
+    assert len(services.answer_cache) == 1
+
+
+def test_stream_replays_cached_answer(services, client):
+    client.post('/api/query/stream', json={'query': '向量检索', 'top_k': 2})
+    events = _events(client.post('/api/query/stream', json={'query': '向量检索', 'top_k': 2}))
+    
+    assert [name for name, _ in events] == ['sources', 'token', 'done']
+    assert events[0][1]['cached'] is True
+    assert events[1][1]['text'] == '向量检索'
+    assert services.llm_service.calls == 1
+
+
+def test_stream_error_event_skips_cache(services, client, monkeypatch):
+    error = LLMError('rate_limited', '上游限流', status_code=429, retryable=True)
+    monkeypatch.setattr(services, 'llm_service', FakeLLMService(['部分'], error=error))
+    events = _events(client.post('/api/query/stream', json={'query': '向量检索'}))
+    
+    assert [name for name, _ in events] == ['sources', 'token', 'error']
+    assert events[-1][1]['code'] == 'rate_limited'
+    assert events[-1][1]['upstream_status'] == 429
+    assert len(services.answer_cache) == 0
+
+
+def test_stream_without_matches(services, client, monkeypatch):
+    monkeypatch.setattr(services.vector_store, 'search_by_vector', lambda *args, **kwargs: [])
+    events = _events(client.post('/api/query/stream', json={'query': '无关问题'}))
+    
+    assert [name for name, _ in events] == ['sources', 'token', 'done']
+    assert events[0][1]['sources'] == []
+    assert services.llm_service.calls == 0
+
+
+def test_documents_count_in_threadpool(services, client, monkeypatch):
+    calls = _off_event_loop(monkeypatch, services.vector_store, 'get_chunk_count')
+    response = client.get('/api/documents')
+    assert response.status_code == 200
+    body = response.json()
+    assert body['total_chunks'] == 3
+    assert body['documents'][0]['chunk_count'] == 3
+    assert calls == [True]
+
+
+def test_health_in_threadpool(services, client, monkeypatch):
+    calls = _off_event_loop(monkeypatch, services.vector_store, 'get_chunk_count')
+    response = client.get('/api/health')
+    assert response.status_code == 200
+    assert response.json()['document_count'] == 3
+    assert response.json()['vector_store'] == services.vector_store.index_type
+    assert calls == [True]
+
+
+def test_upload_returns_job_and_reports_progress(services, client, tmp_path, monkeypatch):
+    from services.job_queue import IngestionJobQueue
+    
+    upload_dir = tmp_path / 'uploads'
+    upload_dir.mkdir()
+    monkeypatch.setattr(settings, 'upload_dir', str(upload_dir))
+    job_queue = IngestionJobQueue(services.vector_store, parse_workers=1)
+    monkeypatch.setattr(services, 'job_queue', job_queue)
+    try:
+        response = client.post('/api/upload', files={'file': ('notes.txt', '后台入库。进度查询。'.encode('utf-8'), 'text/plain')})
+        assert response.status_code == 200
+        job_id = response.json()['job_id']
+        
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            status = client.get(f'/api/jobs/{job_id}').json()
+            if status['stage'] in ('completed', 'failed'):
+                break
+            time.sleep(0.05)
+        assert status['stage'] == 'completed', status
+        assert status['chunks_indexed'] == status['chunks_total'] == 1
+        assert client.get('/api/jobs/missing').status_code == 404
+    finally:
+        job_queue.stop()
+
+
+def test_batch_search_matches_single_searches(services, client):
+    queries = [{'query': '向量检索', 'top_k': 2}, {'query': '后台解析', 'top_k': 1, 'document_id': 'doc'}]
+    response = client.post('/api/search/batch', json={'queries': queries})
+    assert response.status_code == 200
+    body = response.json()
+    assert body['total'] == 2
+    
+    for item, result in zip(queries, body['results']):
+        single = client.get('/api/search', params=item).json()
+        assert result == single
+        assert result['total'] == item['top_k']
+
+
+def test_batch_search_rejects_too_many_queries(services, client, monkeypatch):
+    monkeypatch.setattr(settings, 'search_batch_max_queries', 2)
+    response = client.post('/api/search/batch', json={'queries': [{'query': 'q'}] * 3})
+    assert response.status_code == 400
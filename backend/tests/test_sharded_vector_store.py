@@ -0,0 +1,68 @@
+import pytest
+
+from core.config import settings
+from services.embedding_service import MockEmbeddingService
+from services.sharded_vector_store import ShardedVectorStore, shard_of
+from services.vector_store import VectorStore
+
+DIMENSION = 32
+
+
+def _chunks(document_count: int, per_document: int):
+    return [
+        {'chunk_id': f'doc{d}_chunk_{i}', 'content': f'文档 {d} 第 {i} 段：向量检索与分片 {d * i}',
+         'metadata': {'document_id': f'doc{d}', 'filename': f'doc{d}.txt'}}
+        for d in range(document_count)
+        for i in range(per_document)
+    ]
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'index_dir', str(tmp_path / 'sharded'))
+    monkeypatch.setattr(settings, 'index_watch_interval', 0)
+    monkeypatch.setattr(settings, 'hybrid_search_enabled', False)
+    store = ShardedVectorStore(MockEmbeddingService(DIMENSION), shard_count=2)
+    store.load()
+    yield store
+    store.close()
+
+
+def test_sharded_search_matches_single_store(sharded, tmp_path):
+    chunks = _chunks(6, 5)
+    sharded.add_chunks(chunks)
+    single = VectorStore(MockEmbeddingService(DIMENSION), index_dir=str(tmp_path / 'single'))
+    single.load()
+    single.add_chunks(chunks)
+    
+    assert {shard_of(f'doc{d}', 2) for d in range(6)} == {0, 1}
+    assert sharded.get_chunk_count() == 30
+    for query in ('向量检索', '文档 3 第 4 段'):
+        expected = single.search(query, top_k=7)
+        results = sharded.search(query, top_k=7)
+        assert [chunk['chunk_id'] for chunk, _ in results] == [chunk['chunk_id'] for chunk, _ in expected]
+        assert [score for _, score in results] == pytest.approx([score for _, score in expected], abs=1e-5)
+    
+    filtered = sharded.search('向量检索', top_k=3, filter_document_id='doc2')
+    assert len(filtered) == 3
+    assert {chunk['metadata']['document_id'] for chunk, _ in filtered} == {'doc2'}
+
+
+def test_sharded_documents_and_delete(sharded):
+    sharded.add_chunks(_chunks(4, 3))
+    changes = []
+    sharded.add_change_listener(lambda document_ids, filenames: changes.append(document_ids))
+    
+    documents = {document['document_id']: document['chunk_count'] for document in sharded.list_documents()}
+    assert documents == {f'doc{d}': 3 for d in range(4)}
+    
+    assert sharded.delete_document('doc1') == 3
+    assert sharded.delete_document('doc1') == 0
+    assert changes == [{'doc1'}]
+    assert sharded.get_chunk_count() == 9
+    assert 'doc1' not in {chunk['metadata']['document_id'] for chunk in sharded.get_all_chunks()}
+
+
+def test_shard_count_cannot_change(sharded):
+    with pytest.raises(ValueError):
+        ShardedVectorStore(MockEmbeddingService(DIMENSION), shard_count=3).load()
@@ -0,0 +1,164 @@
+import threading
+
+import numpy as np
+import pytest
+
+from core.config import settings
+from services.vector_store import VectorStore
+
+DIMENSION = 8
+
+
+def _chunks(prefix: str, count: int):
+    return [
+        {'chunk_id': f'{prefix}_chunk_{i}', 'content': f'{prefix} text {i}',
+         'metadata': {'document_id': prefix, 'filename': f'{prefix}.txt'}}
+        for i in range(count)
+    ]
+
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype(np.float32)
+
+
+def test_background_compaction_runs_once(tmp_path, monkeypatch):
+    store = VectorStore(index_dir=str(tmp_path), dimension=DIMENSION)
+    monkeypatch.setattr(settings, 'index_compaction_threshold', 0)
+    
+    release = threading.Event()
+    calls = []
+    
+    def compact():
+        calls.append(threading.current_thread().name)
+        release.wait(5)
+    
+    monkeypatch.setattr(store, 'compact', compact)
+    threads = [threading.Thread(target=store._maybe_compact) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    release.set()
+    
+    for thread in threading.enumerate():
+        if thread.name == 'index-compaction':
+            thread.join(5)
+    assert calls == ['index-compaction']
+    assert not store._compaction_lock.locked()
+
+
+def test_search_does_not_wait_for_write_fsync(tmp_path, monkeypatch):
+    store = VectorStore(index_dir=str(tmp_path), dimension=DIMENSION)
+    vectors = _vectors(4)
+    store.add_embeddings(_chunks('first', 4), vectors)
+    
+    entered = threading.Event()
+    release = threading.Event()
+    append = store.persistence.append
+    
+    def slow_append(*args):
+        entered.set()
+        release.wait(5)
+        append(*args)
+    
+    monkeypatch.setattr(store.persistence, 'append', slow_append)
+    writer = threading.Thread(target=store.add_embeddings, args=(_chunks('second', 2), _vectors(2, seed=1)))
+    writer.start()
+    try:
+        assert entered.wait(5)
+        results = store.search_batch(vectors[:1], [1], hybrid=False)
+        assert results[0][0][0]['chunk_id'] == 'first_chunk_0'
+        assert store.get_chunk_count() == 4
+    finally:
+        release.set()
+        writer.join(5)
+    assert store.get_chunk_count() == 6
+
+
+def _store(tmp_path, monkeypatch) -> VectorStore:
+    monkeypatch.setattr(settings, 'index_watch_interval', 0)
+    monkeypatch.setattr(settings, 'hybrid_search_enabled', False)
+    store = VectorStore(index_dir=str(tmp_path), dimension=DIMENSION)
+    store.load()
+    return store
+
+
+def _reopen(tmp_path) -> VectorStore:
+    store = VectorStore(index_dir=str(tmp_path), dimension=DIMENSION)
+    store.load()
+    return store
+
+
+def _document_ids(results):
+    return {chunk['chunk_id'].split('_chunk_')[0] for chunk, _ in results}
+
+
+def test_delete_document_survives_reload_and_compaction(tmp_path, monkeypatch):
+    store = _store(tmp_path, monkeypatch)
+    vectors = _vectors(6)
+    store.add_embeddings(_chunks('a', 3), vectors[:3])
+    store.add_embeddings(_chunks('b', 3), vectors[3:])
+    
+    assert store.delete_document('a') == 3
+    assert store.delete_document('a') == 0
+    assert store.get_chunk_count() == 3
+    assert _document_ids(store.search_by_vector(vectors[0], top_k=6)) == {'b'}
+    assert store.persistence.pending_deletes == 3
+    
+    reopened = _reopen(tmp_path)
+    assert reopened.get_chunk_count() == 3
+    assert _document_ids(reopened.search_by_vector(vectors[0], top_k=6)) == {'b'}
+    
+    reopened.compact()
+    assert reopened.persistence.pending_count == 0
+    assert reopened.persistence.pending_deletes == 0
+    compacted = _reopen(tmp_path)
+    assert [document['document_id'] for document in compacted.list_documents()] == ['b']
+    assert _document_ids(compacted.search_by_vector(vectors[0], top_k=6)) == {'b'}
+
+
+def test_delete_notifies_listeners(tmp_path, monkeypatch):
+    store = _store(tmp_path, monkeypatch)
+    store.add_embeddings(_chunks('a', 2), _vectors(2))
+    changes = []
+    store.add_change_listener(lambda document_ids, filenames: changes.append((document_ids, filenames)))
+    
+    store.delete_document('a')
+    assert changes == [({'a'}, {'a.txt'})]
+
+
+def test_prefilter_returns_full_top_k_within_document(tmp_path, monkeypatch):
+    store = _store(tmp_path, monkeypatch)
+    query = _vectors(1, seed=7)[0]
+    # 文档 near 的向量都贴近查询，文档 far 的向量远离查询
+    near = query + 0.01 * _vectors(20, seed=8)
+    far = -query + 0.01 * _vectors(5, seed=9)
+    store.add_embeddings(_chunks('near', 20), near)
+    store.add_embeddings(_chunks('far', 5), far)
+    
+    results = store.search_by_vector(query, top_k=5, filter_document_id='far')
+    assert len(results) == 5
+    assert _document_ids(results) == {'far'}
+    
+    results = store.search_by_vector(query, top_k=3, filters={'filename': 'far.txt', 'document_id': 'far'})
+    assert len(results) == 3
+    assert store.search_by_vector(query, top_k=3, filter_document_id='missing') == []
+    
+    with pytest.raises(ValueError):
+        store.search_by_vector(query, top_k=3, filters={'author': 'x'})
+
+
+def test_search_batch_matches_single_searches(tmp_path, monkeypatch):
+    store = _store(tmp_path, monkeypatch)
+    store.add_embeddings(_chunks('a', 10), _vectors(10))
+    store.add_embeddings(_chunks('b', 10), _vectors(10, seed=1))
+    queries = _vectors(4, seed=2)
+    top_ks = [3, 5, None, 2]
+    filters = [None, {'document_id': 'b'}, {'document_id': 'a'}, {'document_id': 'b'}]
+    
+    batched = store.search_batch(queries, top_ks=top_ks, filters=filters)
+    assert len(batched) == 4
+    for query, top_k, row_filters, results in zip(queries, top_ks, filters, batched):
+        assert results == store.search_by_vector(query, top_k=top_k, filters=row_filters)
+    assert len(batched[2]) == settings.similarity_top_k
+    assert _document_ids(batched[1]) == {'b'}
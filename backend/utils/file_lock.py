@@ -0,0 +1,18 @@
+import os
+import fcntl
+from contextlib import contextmanager
+
+# 索引目录与嵌入缓存目录共用的写锁文件名
+LOCK_FILE = 'write.lock'
+
+
+@contextmanager
+def exclusive_lock(path: str):
+    """进程间互斥的文件锁 (flock)，不可重入"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
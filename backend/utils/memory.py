@@ -0,0 +1,7 @@
+def rss_anon(pid: str = 'self') -> int:
+    """进程私有常驻内存 (字节)；不含与其他进程共享的文件映射页"""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) * 1024
+    return 0
@@ -0,0 +1,6 @@
+import multiprocessing
+
+
+def spawn_context():
+    """子进程统一用 spawn 启动，避免 fork 继承模型/FAISS 的线程状态"""
+    return multiprocessing.get_context('spawn')
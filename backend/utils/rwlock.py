@@ -0,0 +1,57 @@
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+
+class ReadWriteLock:
+    """读写锁 - 读者共享，写者独占且可重入；有写者等待时新的读者排队，避免写者饿死
+
+    持有写锁的线程可以再获取读锁 (直接通过)。
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writers_waiting = 0
+        self._owner: Optional[int] = None
+        self._depth = 0
+    
+    @contextmanager
+    def read(self):
+        if self._owner == threading.get_ident():
+            yield
+            return
+        
+        with self._cond:
+            while self._owner is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner != me:
+                self._writers_waiting += 1
+                try:
+                    while self._owner is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._writers_waiting -= 1
+                self._owner = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._owner = None
+                    self._cond.notify_all()
@@ -1,12 +1,29 @@
 import { useState, useCallback } from 'react'
 import { useDropzone } from 'react-dropzone'
 import toast from 'react-hot-toast'
-import type { UploadResponse } from '../types'
+import type { JobStatus, UploadResponse } from '../types'
 
 interface DocumentUploadProps {
   onSuccess: () => void
 }
 
+async function waitForJob(jobId: string, onProgress: (job: JobStatus) => void): Promise<JobStatus> {
+  while (true) {
+    const response = await fetch(`/api/jobs/${jobId}`)
+    if (!response.ok) {
+      throw new Error('查询处理进度失败')
+    }
+
+    const job: JobStatus = await response.json()
+    onProgress(job)
+    if (job.stage === 'completed' || job.stage === 'failed') {
+      return job
+    }
+
+    await new Promise(resolve => setTimeout(resolve, 500))
+  }
+}
+
 export default function DocumentUpload({ onSuccess }: DocumentUploadProps) {
   const [isUploading, setIsUploading] = useState(false)
   const [uploadProgress, setUploadProgress] = useState(0)
@@ -33,15 +50,29 @@ export default function DocumentUpload({ onSuccess }: DocumentUploadProps) {
       })
 
       clearInterval(progressInterval)
-      setUploadProgress(100)
 
       if (!response.ok) {
         throw new Error('上传失败')
       }
 
       const data: UploadResponse = await response.json()
-      
-      toast.success(`${file.name} 上传成功！处理为 ${data.chunk_count} 个文本块`)
+      let chunkCount = data.chunk_count
+
+      if (data.job_id) {
+        // 上传完成后文档在后台解析与入库，轮询任务进度
+        const job = await waitForJob(data.job_id, current => {
+          if (current.chunks_total) {
+            setUploadProgress(Math.round(90 + 10 * current.chunks_indexed / current.chunks_total))
+          }
+        })
+        if (job.stage === 'failed') {
+          throw new Error(job.error || '文档处理失败')
+        }
+        chunkCount = job.chunks_indexed
+      }
+
+      setUploadProgress(100)
+      toast.success(`${file.name} 上传成功！处理为 ${chunkCount} 个文本块`)
       onSuccess()
       
     } catch (error) {
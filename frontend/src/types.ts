@@ -33,6 +33,20 @@ export interface UploadResponse {
   filename: string
   chunk_count: number
   message: string
+  job_id?: string
+  status?: string
+}
+
+export interface JobStatus {
+  job_id: string
+  document_id: string
+  filename: string
+  stage: 'queued' | 'parsing' | 'embedding' | 'completed' | 'failed'
+  chunks_total: number | null
+  chunks_indexed: number
+  elapsed_seconds: number
+  chunks_per_second: number
+  error: string | null
 }
 
 export interface HealthStatus {